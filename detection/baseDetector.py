@@ -41,6 +41,52 @@ class BaseDetector(ABC):
         """
         pass
 
+    def detect_many(self, paths: List[Path]) -> List[DetectionResult]:
+        """
+        Detect file types of several files at once.
+
+        The default runs :meth:`detect` on each file. Detectors with per-call
+        overhead (e.g. a model invocation) override it together with
+        :meth:`_get_batch_size`.
+
+        Args:
+            paths: Paths of the files to analyze.
+
+        Returns:
+            One DetectionResult per path, in the same order.
+        """
+        return [self.detect(path) for path in paths]
+
+    def _get_batch_size(self) -> int:
+        """
+        Return how many files :meth:`detect_many` should be given at once.
+
+        Returns:
+            Batch size, 1 if the detector has no batch path.
+        """
+        return 1
+
+    def _get_version(self) -> str:
+        """
+        Return the version of the underlying tool.
+
+        Together with :meth:`_get_config` it identifies cached results, so it
+        must change whenever the output for the same file can change.
+
+        Returns:
+            Version string, "1" if the detector has no external tool.
+        """
+        return "1"
+
+    def _get_config(self) -> dict:
+        """
+        Return the settings that influence the detection result.
+
+        Returns:
+            JSON serializable dict, empty if there are none.
+        """
+        return {}
+
     @abstractmethod
     def _get_name(self) -> str:
         """
@@ -0,0 +1,140 @@
+"""
+Persistent, content addressed cache of detection results.
+
+Results are stored in a sqlite database keyed by the sha256 of the scanned
+file, the detector name and a fingerprint of the detector version and
+configuration. A file that did not change since an earlier run (e.g. the
+monoglot sources, or the output of generators that were not rerun) is
+therefore never scanned twice by the same detector.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+from .types import DetectionResult, json_default, result_from_dict
+
+DEFAULT_CACHE_BUDGET = 256 * 1024 * 1024  # bytes of stored results
+
+# bump when parsing/normalization in this package changes the results of all detectors
+SCHEMA_VERSION = 1
+
+COMMIT_EVERY = 100 # new results, so a crash only loses the last few
+
+
+def file_sha256(path: Path) -> str:
+    """sha256 of a file, streamed so big files are not loaded at once."""
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class DetectionCache:
+    """
+    Size bounded sqlite cache of successful DetectionResults.
+
+    Entries are evicted least recently used first once the stored results
+    exceed ``max_bytes``. New results are committed and evicted every
+    ``COMMIT_EVERY`` writes (so a long run stays within the budget) and on
+    :meth:`close`, which also writes the rest.
+
+    Args:
+        path: sqlite database file, created if missing.
+        max_bytes: Budget for the summed size of the stored results.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = DEFAULT_CACHE_BUDGET):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "sha256 TEXT NOT NULL, detector TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+            "result TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (sha256, detector, fingerprint))"
+        )
+        self._max_bytes = max_bytes
+        self._fingerprints: dict[int, Optional[str]] = {}
+        self._uncommitted = 0
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, detector) -> Optional[str]:
+        """Version and config of detector as a string, None (not cacheable) if its version is unknown."""
+        key = id(detector)
+        if key not in self._fingerprints:
+            try:
+                self._fingerprints[key] = json.dumps({
+                    "schema": SCHEMA_VERSION,
+                    "version": detector._get_version(),
+                    "config": detector._get_config(),
+                }, sort_keys=True)
+            except Exception as e: # e.g. tool not installed, its results are errors anyway
+                print(f"Not caching {detector._get_name()}: version unknown ({e})")
+                self._fingerprints[key] = None
+        return self._fingerprints[key]
+
+    def get(self, sha256: str, name: str, detector) -> Optional[DetectionResult]:
+        """Cached result of detector ``name`` for the file with hash sha256, None if there is none."""
+        fingerprint = self.fingerprint(detector)
+        if fingerprint is None:
+            return None
+        row = self._db.execute(
+            "SELECT result FROM results WHERE sha256 = ? AND detector = ? AND fingerprint = ?",
+            (sha256, name, fingerprint)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._db.execute(
+            "UPDATE results SET last_used = ? WHERE sha256 = ? AND detector = ? AND fingerprint = ?",
+            (time.time(), sha256, name, fingerprint)
+        )
+        return result_from_dict(json.loads(row[0]))
+
+    def put(self, sha256: str, name: str, detector, result: DetectionResult):
+        """Store result, failed ones (errors, timeouts) are not cached so they are retried next run."""
+        fingerprint = self.fingerprint(detector)
+        if fingerprint is None or result.error is not None:
+            return
+        data = json.dumps({
+            "tool": result.tool,
+            "detected_types": result.detected_types,
+            "is_polyglot": result.is_polyglot,
+            "raw_output": result.raw_output,
+            "error": result.error,
+        }, default=json_default)
+        self._db.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+            (sha256, name, fingerprint, data, len(data), time.time())
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self.evict()
+            self._db.commit()
+            self._uncommitted = 0
+
+    def evict(self):
+        """Drop least recently used results until the stored size fits the budget."""
+        if self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0] <= self._max_bytes:
+            return
+        total = 0
+        stale = []
+        for rowid, size in self._db.execute("SELECT rowid, size FROM results ORDER BY last_used DESC"):
+            total += size
+            if total > self._max_bytes:
+                stale.append((rowid,))
+        self._db.executemany("DELETE FROM results WHERE rowid = ?", stale)
+
+    def close(self):
+        self.evict()
+        self._db.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,234 @@
+"""
+Process pool for running detectors with hard per-task deadlines.
+
+Each worker process loads the detectors once and then runs (file, detector)
+tasks it receives over its own pipe, several files at once for detectors with
+a batch path. Unlike the SIGALRM timeout of the serial
+runner, a deadline here also holds for native code that never returns to the
+interpreter: a worker that misses it is killed and replaced.
+"""
+
+import math
+import multiprocessing
+import signal
+import time
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import Any, Callable, Hashable, Iterable, Iterator, Optional
+
+from .types import DetectionResult
+
+BATCH_SLACK = 0.5 # seconds per extra file of a batch on top of the single file timeout
+
+
+def error_result(name: str, error: str) -> DetectionResult:
+    """Empty DetectionResult of detector ``name`` carrying ``error``."""
+    return DetectionResult(
+        tool=name,
+        detected_types=set(),
+        is_polyglot=False,
+        raw_output="",
+        error=error
+    )
+
+
+def batch_timeout(timeout: int, count: int) -> int:
+    """Whole seconds a batch of count files may take: the timeout of one file plus some slack per extra file.
+
+    Not the timeout times count, else a hanging batch of a few hundred files
+    blocks for hours before it is retried one by one.
+    """
+    return min(timeout * count, timeout + math.ceil(BATCH_SLACK * (count - 1)))
+
+
+def _detect(detector, name: str, paths: list[Path]) -> list[DetectionResult]:
+    """detect_many, if a batch raises every file is run alone so only the broken one gets the error."""
+    try:
+        return detector.detect_many(paths)
+    except Exception as e:
+        if len(paths) == 1:
+            return [error_result(name, str(e))]
+    return [_detect(detector, name, [path])[0] for path in paths]
+
+
+def _worker_main(conn: Connection, load_detectors: Callable[[], dict[str, Any]]):
+    """Worker loop: load detectors, signal readiness, then answer (task id, name, paths) messages until None."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # ctrl-c is handled by the parent
+    detectors = load_detectors()
+    conn.send("ready")
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        task_id, name, paths = message
+        results = _detect(detectors[name], name, [Path(path) for path in paths])
+        try:
+            conn.send((task_id, results))
+        except Exception as e: # e.g. raw output that cannot be pickled
+            conn.send((task_id, [error_result(name, f"could not send result: {e}")] * len(paths)))
+
+
+@dataclass
+class _Worker:
+    """Parent side of one worker process."""
+    process: multiprocessing.process.BaseProcess
+    conn: Connection
+    ready: bool = False
+    task: Optional[tuple] = None # (task id, name, batch, timeout) while busy
+    deadline: float = 0.0
+
+
+class DetectorPool:
+    """
+    Pool of detector worker processes with killable per-task timeouts.
+
+    Workers are started with the ``spawn`` method so no state (threads, model
+    handles) is inherited from the parent. Timeouts only start once a worker
+    has loaded its detectors.
+
+    Tasks of a detector with a batch size above 1 are sent in batches, their
+    timeout is given by :func:`batch_timeout`. If a batch times out, kills its
+    worker or does not return one result per file, its files are retried one
+    by one so only the file actually responsible gets the error.
+
+    Args:
+        workers: Number of worker processes.
+        load_detectors: Picklable (module level) callable returning
+            ``{name: detector}``, called once in every worker.
+        timeouts: Timeout in seconds per detector name.
+        batch_sizes: Files per task per detector name, 1 if missing.
+    """
+
+    def __init__(self, workers: int, load_detectors: Callable[[], dict[str, Any]], timeouts: dict[str, int],
+                 batch_sizes: Optional[dict[str, int]] = None):
+        self._context = multiprocessing.get_context("spawn")
+        self._load_detectors = load_detectors
+        self._timeouts = timeouts
+        self._batch_sizes = batch_sizes or {}
+        self._workers = [self._start_worker() for _ in range(workers)]
+        self._next_id = 0
+
+    def _start_worker(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn, self._load_detectors), daemon=True)
+        process.start()
+        child_conn.close() # else recv in the parent never sees EOF if the worker dies
+        return _Worker(process, parent_conn)
+
+    def _replace(self, worker: _Worker) -> Optional[int]:
+        """Kill worker (if still alive) and start a fresh one in its place, returns the old exit code."""
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+        self._workers[self._workers.index(worker)] = self._start_worker()
+        return worker.process.exitcode
+
+    def _next_batch(self, queues: dict[str, deque]) -> tuple[str, list]:
+        """Pop the oldest queued task plus up to batch size - 1 following tasks of the same detector."""
+        _, name = min((queue[0][0], name) for name, queue in queues.items() if queue)
+        queue = queues[name]
+        batch = [queue.popleft()]
+        if not batch[0][3]: # retries run alone
+            while queue and len(batch) < self._batch_sizes.get(name, 1) and not queue[0][3]:
+                batch.append(queue.popleft())
+        return name, batch
+
+    def run(self, tasks: Iterable[tuple[Hashable, str, Path]]) -> Iterator[tuple[Hashable, str, DetectionResult]]:
+        """
+        Run (key, detector name, path) tasks and yield (key, name, result) as they finish.
+
+        A task that exceeds its detector timeout yields a result with error
+        ``timeout after Ns``, a task whose worker died yields the exit code as
+        error. Both workers are replaced.
+        """
+        queues: dict[str, deque] = {} # name -> (seq, key, path, retry) in task order
+        for seq, (key, name, path) in enumerate(tasks):
+            queues.setdefault(name, deque()).append((seq, key, path, False))
+        while any(queues.values()) or any(worker.task for worker in self._workers):
+            for worker in self._workers:
+                if worker.ready and worker.task is None and any(queues.values()):
+                    name, batch = self._next_batch(queues)
+                    task_id = self._next_id
+                    self._next_id += 1
+                    timeout = batch_timeout(self._timeouts[name], len(batch))
+                    worker.conn.send((task_id, name, [str(path) for _, _, path, _ in batch]))
+                    worker.task = (task_id, name, batch, timeout)
+                    worker.deadline = time.monotonic() + timeout
+            busy = [worker.deadline for worker in self._workers if worker.task]
+            wait_for = max(0.0, min(busy) - time.monotonic()) if busy else None
+            ready = wait([worker.conn for worker in self._workers], timeout=wait_for)
+            for worker in list(self._workers):
+                if worker.conn in ready:
+                    try:
+                        message = worker.conn.recv()
+                    except EOFError:
+                        message = None
+                    if message == "ready":
+                        worker.ready = True
+                        continue
+                    if message is None:
+                        # died (segfault, OOM kill, ...)
+                        if not worker.ready:
+                            # loading the detectors failed, a new worker would fail the same way
+                            worker.process.join()
+                            raise RuntimeError(f"detector worker failed to start (exit code {worker.process.exitcode})")
+                        code = self._replace(worker)
+                        if worker.task:
+                            _, name, batch, _ = worker.task
+                            if len(batch) > 1:
+                                self._retry(queues, name, batch)
+                            else:
+                                yield batch[0][1], name, error_result(name, f"worker died (exit code {code})")
+                        continue
+                    task_id, results = message
+                    if worker.task and worker.task[0] == task_id:
+                        _, name, batch, _ = worker.task
+                        worker.task = None
+                        if len(results) != len(batch):
+                            if len(batch) > 1:
+                                print(f"{name} returned {len(results)} results for {len(batch)} files, retrying them one by one")
+                                self._retry(queues, name, batch)
+                            else:
+                                yield batch[0][1], name, error_result(name, f"returned {len(results)} results for 1 file")
+                            continue
+                        for (_, key, _, _), result in zip(batch, results):
+                            yield key, name, result
+                elif worker.task and time.monotonic() >= worker.deadline:
+                    _, name, batch, timeout = worker.task
+                    self._replace(worker)
+                    if len(batch) > 1:
+                        print(f"{name} timed out on a batch of {len(batch)} files, retrying them one by one")
+                        self._retry(queues, name, batch)
+                    else:
+                        print(f"{name} timed out after {timeout}s")
+                        yield batch[0][1], name, error_result(name, f"timeout after {timeout}s")
+
+    def _retry(self, queues: dict[str, deque], name: str, batch: list):
+        """Put the tasks of a failed batch back at the front of their queue, to be run one by one."""
+        queues[name].extendleft((seq, key, path, True) for seq, key, path, _ in reversed(batch))
+
+    def close(self):
+        """Ask workers to exit and kill those that do not."""
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+            worker.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
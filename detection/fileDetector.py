@@ -4,26 +4,129 @@ from .baseDetector import BaseDetector
 from .types import DetectionResult
 from pathlib import Path
 from typing import List
+import ctypes
+import ctypes.util
 import subprocess
 
+# from magic.h
+MAGIC_MIME_TYPE = 0x0000010
+MAGIC_CONTINUE = 0x0000020
+
+
+class _LibMagic:
+    """Minimal ctypes binding of libmagic, the magic database is loaded once per instance."""
+
+    def __init__(self, flags: int = MAGIC_CONTINUE | MAGIC_MIME_TYPE):
+        name = ctypes.util.find_library("magic")
+        if name is None:
+            raise OSError("libmagic not found")
+        lib = ctypes.CDLL(name)
+        lib.magic_open.restype = ctypes.c_void_p
+        lib.magic_open.argtypes = [ctypes.c_int]
+        lib.magic_load.restype = ctypes.c_int
+        lib.magic_load.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        lib.magic_file.restype = ctypes.c_char_p
+        lib.magic_file.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        lib.magic_error.restype = ctypes.c_char_p
+        lib.magic_error.argtypes = [ctypes.c_void_p]
+        lib.magic_close.restype = None
+        lib.magic_close.argtypes = [ctypes.c_void_p]
+        lib.magic_version.restype = ctypes.c_int
+        lib.magic_version.argtypes = []
+        self._lib = lib
+        self._cookie = lib.magic_open(flags)
+        if not self._cookie:
+            raise OSError("magic_open failed")
+        if lib.magic_load(self._cookie, None) != 0: # None = default database, same as the file command
+            error = lib.magic_error(self._cookie)
+            lib.magic_close(self._cookie)
+            raise OSError(f"magic_load failed: {error.decode(errors='replace') if error else 'unknown error'}")
+
+    def version(self) -> str:
+        """Version in the format of ``file --version``, e.g. file-5.44."""
+        version = self._lib.magic_version()
+        return f"file-{version // 100}.{version % 100:02d}"
+
+    def file(self, path: Path) -> str:
+        result = self._lib.magic_file(self._cookie, bytes(path))
+        if result is None:
+            error = self._lib.magic_error(self._cookie)
+            raise OSError(error.decode(errors="replace") if error else f"magic_file failed for {path}")
+        return result.decode(errors="replace")
+
+    def __del__(self):
+        if getattr(self, "_cookie", None):
+            self._lib.magic_close(self._cookie)
+            self._cookie = None
+
 
 class FileDetector(BaseDetector):
-    """Wraps the Unix ``file --keep-going --mime-type`` command for detection."""
+    """Wraps the Unix ``file --keep-going --mime-type`` command for detection.
+
+    Args:
+        backend: ``"subprocess"`` runs ``file`` once per file, ``"batch"``
+            passes up to ``batch_size`` paths to one ``file`` call and
+            ``"libmagic"`` calls libmagic in process through ctypes. All give
+            the same output to :meth:`_parse`.
+        batch_size: Number of files per ``file`` call for :meth:`detect_many`
+            (``"batch"`` backend only).
+    """
+
+    BACKENDS = ("subprocess", "batch", "libmagic")
+
+    def __init__(self, backend: str = "subprocess", batch_size: int = 256):
+        super().__init__()
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, expected one of {', '.join(self.BACKENDS)}")
+        self._backend = backend
+        self._batch_size = batch_size
+        self._libmagic = None # loaded on first use, so unused instances (e.g. the pool parent) never load the database
 
     def detect(self, path: Path) -> DetectionResult:
         try:
             raw_out = self._run(path)
-            types = self._parse(raw_out)
-            normalized = self._normalize(types)
-            return self._make_result(normalized, raw_out)
+            return self._result(raw_out)
         #some exception occured for error handling we just make it empty but give the error
         #bercause we will put this all in the end in json so its good to know why it failed there not just in the console when running
         except Exception as exception:
             return self._make_error(exception)
 
+    def detect_many(self, paths: List[Path]) -> List[DetectionResult]:
+        """Detect several files with one ``file`` call (batch backend), falling back to one call per file if it fails."""
+        if self._backend != "batch" or len(paths) < 2:
+            return [self.detect(path) for path in paths]
+        try:
+            raw_outs = self._run_many(paths)
+        except Exception:
+            return [self.detect(path) for path in paths]
+        results = []
+        for raw_out in raw_outs:
+            try:
+                results.append(self._result(raw_out))
+            except Exception as exception:
+                results.append(self._make_error(exception))
+        return results
+
+    def _result(self, raw_out: str) -> DetectionResult:
+        types = self._parse(raw_out)
+        normalized = self._normalize(types)
+        return self._make_result(normalized, raw_out)
+
     def _get_name(self) -> str:
         return "file"
+
+    def _get_batch_size(self) -> int:
+        return self._batch_size if self._backend == "batch" else 1
+
+    def _get_version(self) -> str:
+        if self._backend == "libmagic":
+            return self._load_libmagic().version()
+        fileRes = subprocess.run(["file", "--version"], capture_output=True, text=True, timeout=20, check=True)
+        return fileRes.stdout.splitlines()[0].strip() # file-5.44, the next line is the magic file path
+
     def _run(self, path: Path) -> str:
+        if self._backend == "libmagic":
+            return self._run_libmagic(path)
         fileRes = subprocess.run(["file", "--keep-going","--mime-type", str(path)],
         capture_output=True,
         text=True,#output in text mode not byte
@@ -31,6 +134,34 @@ class FileDetector(BaseDetector):
         )
         return fileRes.stdout
 
+    def _run_many(self, paths: List[Path]) -> List[str]:
+        """Output of one ``file`` call for all paths, split into the line ``_run`` gives for each of them."""
+        # no padding so every line looks like a single file call, \0 after the name as names may contain ':'
+        fileRes = subprocess.run(["file", "--keep-going", "--mime-type", "--no-pad", "--print0", "--", *map(str, paths)],
+        capture_output=True,
+        text=True,
+        timeout = 20 * len(paths)
+        )
+        # file escapes newlines (also the ones between --keep-going matches) so there is exactly one line per path
+        lines = fileRes.stdout.split("\n")[:-1]
+        if len(lines) != len(paths):
+            raise ValueError(f"file printed {len(lines)} lines for {len(paths)} paths")
+        outputs = []
+        for line in lines:
+            name, content = line.split("\0", 1)
+            outputs.append(f"{name}{content}\n")
+        return outputs
+
+    def _load_libmagic(self) -> _LibMagic:
+        if self._libmagic is None:
+            self._libmagic = _LibMagic()
+        return self._libmagic
+
+    def _run_libmagic(self, path: Path) -> str:
+        # the file command prints the newline between --keep-going matches as \012
+        content = self._load_libmagic().file(path).replace("\n", "\\012")
+        return f"{path}: {content}\n"
+
     def _parse(self, output : str) -> List[str]:
         #07-06.pdf: application/pdf\012- application/octet-stream
         #insert_jpg_metadata.py: text/html\012- text/plain
@@ -41,4 +172,4 @@ class FileDetector(BaseDetector):
             mime = mime.strip()
             if mime and mime not in ["application/octet-stream", "text/plain"]: #these seem to match for any binary/text
                 types.append(mime)
-        return types
\ No newline at end of file
+        return types
@@ -8,32 +8,73 @@ import magika
 
 
 class MagikaDetector(BaseDetector):
-    """Wraps Magika with configurable threshold for multi-type detection."""
-    def __init__(self, threshold : float = 0.1):
+    """Wraps Magika with configurable threshold for multi-type detection.
+
+    Args:
+        threshold: Minimum score for a label to count as detected.
+        batch_size: Number of files scored per model call in :meth:`detect_many`.
+    """
+    def __init__(self, threshold : float = 0.1, batch_size: int = 64):
         super().__init__()
         self._threshold = threshold
+        self._batch_size = batch_size
         self._magika = magika.Magika() #do it just once
         self._labels = self._magika._model_config.target_labels_space
 
 
     def _get_name(self) -> str:
         return "magika"
+
+    def _get_batch_size(self) -> int:
+        return self._batch_size
+
+    def _get_version(self) -> str:
+        return magika.__version__
+
+    def _get_config(self) -> dict:
+        return {"threshold": self._threshold}
+
     def detect(self, path: Path) -> DetectionResult:
-        try:
-            preds = self._run(path)
-            relevant = [(l,s) for l,s in preds if s > self._threshold]
-            normalized = self._normalize([l for l,_ in relevant])
-            return self._make_result(normalized, preds)
-        except Exception as exception:
-            return self._make_error(exception)
-
-    def _run(self, path: Path) -> list:
-        out, features = self._magika._get_result_or_features_from_path(path)
-        if out != None:
-            #https://github.com/google/magika/blob/main/python/src/magika/types/magika_result.py
-            #https://github.com/google/magika/blob/main/python/src/magika/types/content_type_info.py#L26
-            return [(out.output.label, out.output.score)]
-        preds = self._magika._get_raw_predictions([(path, features)]).flatten()
-        preds_labeled = list(zip(self._labels, preds))
+        return self.detect_many([path])[0]
+
+    def detect_many(self, paths: List[Path]) -> List[DetectionResult]:
+        """Detect several files, running the model once per ``batch_size`` files that need it."""
+        results = [None] * len(paths)
+        pending = [] # (index, path, features) of files that need the model
+        for i, path in enumerate(paths):
+            try:
+                out, features = self._magika._get_result_or_features_from_path(path)
+                if out != None:
+                    #https://github.com/google/magika/blob/main/python/src/magika/types/magika_result.py
+                    #https://github.com/google/magika/blob/main/python/src/magika/types/content_type_info.py#L26
+                    results[i] = self._result([(out.output.label, out.output.score)])
+                else:
+                    pending.append((i, path, features))
+            except Exception as exception:
+                results[i] = self._make_error(exception)
+        for start in range(0, len(pending), self._batch_size):
+            batch = pending[start:start + self._batch_size]
+            try:
+                # one (files, labels) score matrix for the whole batch
+                preds = self._magika._get_raw_predictions([(path, features) for _, path, features in batch])
+            except Exception as exception:
+                for i, _, _ in batch:
+                    results[i] = self._make_error(exception)
+                continue
+            for (i, _, _), scores in zip(batch, preds):
+                try:
+                    results[i] = self._result(self._rank(scores))
+                except Exception as exception:
+                    results[i] = self._make_error(exception)
+        return results
+
+    def _result(self, preds: list) -> DetectionResult:
+        relevant = [(l,s) for l,s in preds if s > self._threshold]
+        normalized = self._normalize([l for l,_ in relevant])
+        return self._make_result(normalized, preds)
+
+    def _rank(self, scores) -> list:
+        """(label, score) pairs of one row of raw predictions, best first."""
+        preds_labeled = list(zip(self._labels, scores))
         preds_sorted = sorted(preds_labeled, key=lambda x: x[1], reverse=True)
-        return preds_sorted        
\ No newline at end of file
+        return preds_sorted
@@ -4,6 +4,7 @@ from .baseDetector import BaseDetector
 from .types import DetectionResult
 from pathlib import Path
 from typing import List, Any, Dict
+from importlib import metadata
 
 
 class PolyDetDetector(BaseDetector):
@@ -11,6 +12,9 @@ class PolyDetDetector(BaseDetector):
     def _get_name(self) -> str:
         return "polydet"
 
+    def _get_version(self) -> str:
+        return metadata.version("polydet")
+
     def detect(self, path : Path) -> DetectionResult:
         try:
             import polydet
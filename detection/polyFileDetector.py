@@ -4,6 +4,7 @@ from .baseDetector import BaseDetector
 from .types import DetectionResult
 from pathlib import Path
 from typing import List
+from importlib import metadata
 
 
 class PolyFileDetector(BaseDetector):
@@ -18,6 +19,12 @@ class PolyFileDetector(BaseDetector):
 
     def _get_name(self) -> str:
         return "polyfile"
+
+    def _get_version(self) -> str:
+        return metadata.version("polyfile")
+
+    def _get_config(self) -> dict:
+        return {"require_mimetype": self._require_mimetype}
     
     def detect(self, path : Path) -> DetectionResult:
         try:
@@ -8,9 +8,13 @@ monoglots, collecting results into a JSON dataset for analysis.
 from pathlib import Path
 from dataclasses import dataclass, asdict
 from datetime import datetime
+import argparse
 import json
 import signal
-from .types import DetectionResult
+from typing import Callable, Optional
+from .types import DetectionResult, json_default, result_from_dict
+from .detectorPool import DetectorPool, batch_timeout, error_result
+from .detectionCache import DetectionCache, DEFAULT_CACHE_BUDGET, file_sha256
 from .fileDetector import FileDetector
 from .magikaDetector import MagikaDetector
 from .polyFileDetector import PolyFileDetector
@@ -26,14 +30,20 @@ class DetectorConfig:
 
 # ADD HERE TO ADD NEW DETECTOR
 ALL_DETECTORS = [
-    DetectorConfig(FileDetector(), "file", timeout=10),
+    DetectorConfig(FileDetector(backend="batch"), "file", timeout=10),
     DetectorConfig(MagikaDetector(threshold=0.05), "magika", timeout=30),
     DetectorConfig(PolyFileDetector(require_mimetype=True), "polyfile", timeout=60),
     DetectorConfig(PolyDetDetector(), "polydet", timeout=60),
 ]
 
+def _load_detectors() -> dict:
+    """Detectors by name, module level so pool workers can call it (they build ALL_DETECTORS on import)."""
+    return {config.name: config.detector for config in ALL_DETECTORS}
+
 BASE_PATH = Path(__file__).parent.parent #dir containing the git
 GENERATED_DIR = BASE_PATH / "generated"
+CACHE_PATH = GENERATED_DIR / "detection_cache.sqlite"
+CHECKPOINT_PATH = GENERATED_DIR / "detection_results.jsonl"
 
 #having actual working timeout on python is quite the rabbit hole cause it cant kill thread and multi process dont work if not pickleable 
 #but with signal it works with timeout but on linux/únix only
@@ -75,20 +85,132 @@ class EvalDataset:
 
     def save(self, path: Path):
         path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('w') as f:
+            json.dump(asdict(self), f, default=json_default, indent=2)
 
-        def custom_json(obj):
-            #set si not serializable
-            if isinstance(obj, set):
-                return list(obj)
-            # numpy
-            if hasattr(obj, 'item'):  # numpy scalars
-                return obj.item()
-            if hasattr(obj, 'tolist'):  # numpy arrays
-                return obj.tolist()
-            raise TypeError(f"Failed to sesrialize object of type {type(obj)}")
 
-        with path.open('w') as f:
-            json.dump(asdict(self), f, default=custom_json, indent=2)
+def _read_checkpoint(path: Path) -> tuple[Optional[str], dict[str, dict], int]:
+    """Timestamp, merged record per file path and the size of the complete lines of a checkpoint.
+
+    A line cut off by a crash is ignored. If the sha256 of a file changes the
+    results recorded for its old content are dropped.
+    """
+    timestamp = None
+    files = {}
+    valid = 0
+    with path.open('rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break # only the last line can be incomplete
+            valid += len(line)
+            record = json.loads(line)
+            if timestamp is None:
+                timestamp = record["timestamp"]
+                continue
+            merged = files.get(record["file_path"])
+            if merged is None or merged["sha256"] != record["sha256"]:
+                files[record["file_path"]] = record
+            else:
+                merged["detectors"].update(record["detectors"])
+    return timestamp, files, valid
+
+
+class EvalCheckpoint:
+    """
+    Append-only JSONL log of detection results, one line per (file, detector) as soon as it is done.
+
+    The first line is a header holding the timestamp of the run, every further
+    line an :class:`EvalResult` with a single detector plus the sha256 of the
+    file from run.json (None if unknown). Lines are flushed right away, so a
+    run that crashed or was interrupted can be resumed and only the missing
+    (file, detector) pairs are run again.
+
+    Args:
+        path: JSONL file.
+        resume: Continue the log in path (keeping its results and timestamp) instead of starting a new one.
+    """
+
+    def __init__(self, path: Path, resume: bool = False):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._files = {}
+        timestamp = None
+        if resume and path.exists():
+            timestamp, self._files, valid = _read_checkpoint(path)
+            with path.open('r+b') as f:
+                f.truncate(valid) # drop a line cut off by a crash, else the next record would be glued to it
+        if timestamp is None:
+            self.timestamp = datetime.now().isoformat()
+            self._file = path.open('w')
+            self._write({"timestamp": self.timestamp})
+        else:
+            self.timestamp = timestamp
+            self._file = path.open('a')
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record, default=json_default) + "\n")
+        self._file.flush()
+
+    def results(self, file_path: str, sha256: Optional[str]) -> dict:
+        """Results (name -> DetectionResult) recorded for a file, none if its content changed since.
+
+        Without a hash on either side the content cannot be compared, so nothing is reused.
+        """
+        record = self._files.get(file_path)
+        if record is None or sha256 is None or record["sha256"] != sha256:
+            return {}
+        return {name: result_from_dict(result) for name, result in record["detectors"].items()}
+
+    def add(self, file: tuple, name: str, result: DetectionResult):
+        """Record the result of detector ``name`` for a file as returned by :func:`collect_files`."""
+        file_path, generator, overt, covert, is_poly, sha256 = file
+        record = asdict(_eval_result(file_path, generator, overt, covert, is_poly, {name: asdict(result)}))
+        record["sha256"] = sha256
+        self._write(record)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def compact_checkpoint(src: Path, dst: Path, order: Optional[list[str]] = None) -> int:
+    """
+    Write the results of a checkpoint in the detection_results.json format.
+
+    Args:
+        src: Checkpoint written by :class:`EvalCheckpoint`.
+        dst: JSON file to write.
+        order: File paths in the order of a run (see :func:`collect_files`),
+            files not in it follow in the order they were first recorded.
+
+    Returns:
+        Number of files left out because not all detectors have a result for
+        them yet (the evaluation scripts expect every detector).
+    """
+    timestamp, files, _ = _read_checkpoint(src)
+    rank = {file_path: idx for idx, file_path in enumerate(order or [])}
+    names = [config.name for config in ALL_DETECTORS]
+    results = []
+    incomplete = 0
+    for file_path, record in sorted(files.items(), key=lambda item: rank.get(item[0], len(rank))):
+        if any(name not in record["detectors"] for name in names):
+            incomplete += 1
+            continue
+        results.append(EvalResult(
+            file_path=file_path,
+            generator=record["generator"],
+            overt_format=record["overt_format"],
+            covert_format=record["covert_format"],
+            is_polyglot=record["is_polyglot"],
+            detectors={name: record["detectors"][name] for name in names}
+        ))
+    EvalDataset(timestamp=timestamp, results=results).save(dst)
+    return incomplete
 
 def run_detector_with_timeout(detector, name, file_path, seconds):
     """Run a detector with Unix SIGALRM-based timeout protection."""
@@ -100,50 +222,85 @@ def run_detector_with_timeout(detector, name, file_path, seconds):
         return result
     except TimeoutException:
         print(f"{name} timed out after {seconds}s")
-        return DetectionResult(
-            tool=name,
-            detected_types=set(),
-            is_polyglot=False,
-            raw_output="",
-            error=f"timeout after {seconds}s"
-        )
+        return error_result(name, f"timeout after {seconds}s")
     except Exception as e:
-        return DetectionResult(
-            tool=name,
-            detected_types=set(),
-            is_polyglot=False,
-            raw_output="",
-            error=str(e)
-        )
+        return error_result(name, str(e))
     finally:
         signal.signal(signal.SIGALRM, old_handler) #reset in case sth went wrong exception handled in other place
         signal.alarm(0)
 
+def run_detector_batch(config: DetectorConfig, file_paths: list) -> list:
+    """Run a detector on several files at once (see batch_timeout), one by one if the batch fails or does not return one result per file."""
+    if len(file_paths) == 1:
+        return [run_detector_with_timeout(config.detector, config.name, file_paths[0], config.timeout)]
+    seconds = batch_timeout(config.timeout, len(file_paths))
+    old_handler = signal.signal(signal.SIGALRM, _timeout_handler)
+    try:
+        signal.alarm(seconds)
+        results = config.detector.detect_many(file_paths)
+        signal.alarm(0)
+        if len(results) == len(file_paths):
+            return results
+        print(f"{config.name} returned {len(results)} results for {len(file_paths)} files, retrying them one by one")
+    except TimeoutException:
+        print(f"{config.name} timed out on a batch of {len(file_paths)} files, retrying them one by one")
+    except Exception:
+        pass # rerun alone so only the broken file gets the error
+    finally:
+        signal.signal(signal.SIGALRM, old_handler)
+        signal.alarm(0)
+    return [run_detector_with_timeout(config.detector, config.name, path, config.timeout) for path in file_paths]
+
 def run_detectors(file_path) -> dict:
     """Run all configured detectors on a file and return results dict."""
-    results = {}
+    return run_detectors_many([file_path])[0]
+
+def run_detectors_many(file_paths: list, known: list[dict] | None = None,
+                       record: Optional[Callable[[int, str, DetectionResult], None]] = None) -> list[dict]:
+    """Run all configured detectors on several files, each detector gets them in batches of its batch size.
+
+    Detectors that already have a result in ``known[i]`` (e.g. from the cache) are not run on file i again.
+    Every new result is passed to ``record(i, name, result)`` as soon as its batch is done.
+    """
+    results = [dict(file_known) for file_known in known] if known else [{} for _ in file_paths]
     for config in ALL_DETECTORS:
-        result = run_detector_with_timeout(config.detector, config.name, file_path, config.timeout)
-        results[config.name] = result
-    return results
+        batch_size = config.detector._get_batch_size()
+        todo = [i for i, file_results in enumerate(results) if config.name not in file_results]
+        for start in range(0, len(todo), batch_size):
+            batch = todo[start:start + batch_size]
+            for i, result in zip(batch, run_detector_batch(config, [file_paths[i] for i in batch])):
+                results[i][config.name] = result
+                if record is not None:
+                    record(i, config.name, result)
+    return [{config.name: file_results[config.name] for config in ALL_DETECTORS} for file_results in results]
 
-def run() -> EvalDataset:
-    """Run detection evaluation on all generated polyglots and source files."""
-    dataset = EvalDataset.create()
+def collect_files() -> list[tuple]:
+    """(path, generator, overt format, covert format, is polyglot, sha256) of every source file and successful polyglot in run.json.
+
+    The sha256 is the one recorded in run.json, None if the file was modified after run.json was written.
+    """
     generation_json_path = GENERATED_DIR / "run.json"
     with open(generation_json_path) as f:
         generation = json.load(f)
+    written = generation_json_path.stat().st_mtime
+
+    def recorded_hash(path, sha256):
+        return sha256 if path.stat().st_mtime <= written else None
+
     files_to_eval = []
     #get all monoglots (map with its format so no duplicate and easy .items())
     formats = {}  
+    hashes = {}
     for poly in generation['polyglots']:
         if poly['status'] == 'success':
             formats[Path(poly['overt_path'])] = poly['overt_format']
             formats[Path(poly['covert_path'])] = poly['covert_format']
+            hashes[Path(poly['overt_path'])] = poly.get('overt_hash')
+            hashes[Path(poly['covert_path'])] = poly.get('covert_hash')
     # add monoglots to eval
     for src_path, src_format in formats.items():
         if src_path.exists():
-            files_to_eval.append((src_path, "Monoglot", src_format, "", False))
+            files_to_eval.append((src_path, "Monoglot", src_format, "", False, recorded_hash(src_path, hashes[src_path])))
     # add polyglots to eval
     for poly in generation['polyglots']:
         if poly['status'] == 'success':
@@ -154,39 +311,192 @@ def run() -> EvalDataset:
                     poly['generator'],
                     poly['overt_format'],
                     poly['covert_format'], 
-                    True
+                    True,
+                    recorded_hash(poly_path, poly.get('output_hash'))
                 ))
+    return files_to_eval
 
-    # eval all files
+def _print_progress(idx, total_files, file_path, is_poly):
+    file_size = file_path.stat().st_size
+    file_type = "polyglot" if is_poly else "monoglot"
+    print(f"[{idx}/{total_files}] {file_type}: {file_path.relative_to(BASE_PATH)} ({file_size//1024}KB)")
+
+def _relative(file_path: Path) -> str:
+    return str(file_path.relative_to(BASE_PATH))
+
+def _eval_result(file_path, generator, overt, covert, is_poly, results) -> EvalResult:
+    return EvalResult(
+        file_path=_relative(file_path),
+        generator=generator,
+        overt_format=overt,
+        covert_format=covert,
+        is_polyglot=is_poly,
+        detectors=results
+    )
+
+def run_serial(files_to_eval: list[tuple], known: list[dict], record: Optional[Callable[[int, str, DetectionResult], None]] = None):
+    """Run the detectors missing in ``known`` on every file in this process and yield EvalResults in file order.
+
+    New results are passed to ``record(file idx, name, result)`` as they finish.
+    """
+    # in windows so batched detectors (magika, file) get several files per call
     total_files = len(files_to_eval)
-    for idx, (file_path, generator, overt, covert, is_poly) in enumerate(files_to_eval, 1):
-        file_size = file_path.stat().st_size
-        file_type = "polyglot" if is_poly else "monoglot"
-        file_path_rel = file_path.relative_to(BASE_PATH)
-        print(f"[{idx}/{total_files}] {file_type}: {file_path_rel} ({file_size//1024}KB)")
-
-        results = run_detectors(file_path)
-
-        eval_result = EvalResult(
-            file_path=str(file_path_rel),
-            generator=generator,
-            overt_format=overt,
-            covert_format=covert,
-            is_polyglot=is_poly,
-            detectors=results
-        )
+    window = max(config.detector._get_batch_size() for config in ALL_DETECTORS)
+    for start in range(0, total_files, window):
+        chunk = files_to_eval[start:start + window]
+        chunk_record = None
+        if record is not None:
+            chunk_record = lambda i, name, result, start=start: record(start + i, name, result)
+        chunk_results = run_detectors_many([file[0] for file in chunk], known[start:start + window], chunk_record)
+        for idx, ((file_path, generator, overt, covert, is_poly, _), results) in enumerate(zip(chunk, chunk_results), start + 1):
+            _print_progress(idx, total_files, file_path, is_poly)
+            yield _eval_result(file_path, generator, overt, covert, is_poly, results)
 
-        dataset.add(eval_result)
+def run_parallel(files_to_eval: list[tuple], workers: int, known: list[dict],
+                 record: Optional[Callable[[int, str, DetectionResult], None]] = None):
+    """Run the detectors missing in ``known`` on a :class:`DetectorPool` and yield EvalResults in file order.
+
+    New results are passed to ``record(file idx, name, result)`` as they finish.
+    """
+    timeouts = {config.name: config.timeout for config in ALL_DETECTORS}
+    batch_sizes = {config.name: config.detector._get_batch_size() for config in ALL_DETECTORS}
+    tasks = [(idx, config.name, file[0]) for idx, file in enumerate(files_to_eval) for config in ALL_DETECTORS
+             if config.name not in known[idx]]
+    pending = {idx: dict(file_known) for idx, file_known in enumerate(known) if file_known} # file idx -> {name: DetectionResult}
+    next_idx = 0
 
+    def finished():
+        # hand out finished files in order so the output matches the serial run
+        nonlocal next_idx
+        while next_idx < len(files_to_eval) and len(pending.get(next_idx, ())) == len(ALL_DETECTORS):
+            file_path, generator, overt, covert, is_poly, _ = files_to_eval[next_idx]
+            _print_progress(next_idx + 1, len(files_to_eval), file_path, is_poly)
+            results = pending.pop(next_idx)
+            results = {config.name: results[config.name] for config in ALL_DETECTORS} # same key order as run_detectors
+            yield _eval_result(file_path, generator, overt, covert, is_poly, results)
+            next_idx += 1
+
+    yield from finished()
+    if not tasks: # everything cached, no need to start workers
+        return
+    with DetectorPool(workers, _load_detectors, timeouts, batch_sizes) as pool:
+        for idx, name, result in pool.run(tasks):
+            if record is not None:
+                record(idx, name, result)
+            pending.setdefault(idx, {})[name] = result
+            yield from finished()
+
+def _cached_results(cache: DetectionCache, hashes: list[str], known: list[dict]) -> list[dict]:
+    """Cached results (name -> DetectionResult) per file of the detectors not in ``known`` yet."""
+    cached = []
+    for sha256, file_known in zip(hashes, known):
+        file_cached = {}
+        for config in ALL_DETECTORS:
+            if config.name in file_known:
+                continue
+            result = cache.get(sha256, config.name, config.detector)
+            if result is not None:
+                file_cached[config.name] = result
+        cached.append(file_cached)
+    return cached
+
+def run(workers: int = 1, cache: DetectionCache | None = None, checkpoint: EvalCheckpoint | None = None) -> EvalDataset:
+    """Run detection evaluation on all generated polyglots and source files.
+
+    With ``workers`` > 1 the (file, detector) tasks run on a process pool
+    with hard timeouts (see :class:`DetectorPool`), else serially in this process.
+    With a ``checkpoint`` every result is logged as soon as it is done and
+    pairs already in it (resumed run) are not run again. With a ``cache`` only
+    (file, detector) pairs without a cached result for the file content are
+    run, successful new results are added to it.
+    """
+    dataset = EvalDataset.create()
+    files_to_eval = collect_files()
+    total = len(files_to_eval) * len(ALL_DETECTORS)
+    known = [{} for _ in files_to_eval]
+    if checkpoint is not None or cache is not None:
+        # run.json hashes are reused, only files changed since are hashed
+        files_to_eval = [(*file, sha256 or file_sha256(file[0])) for *file, sha256 in files_to_eval]
+        hashes = [file[5] for file in files_to_eval]
+    if checkpoint is not None:
+        dataset.timestamp = checkpoint.timestamp
+        known = [checkpoint.results(_relative(file[0]), sha256) for file, sha256 in zip(files_to_eval, hashes)]
+        print(f"{sum(map(len, known))} of {total} detector results taken from the checkpoint")
+    if cache is not None:
+        cached = _cached_results(cache, hashes, known)
+        print(f"{sum(map(len, cached))} of {total} detector results taken from the cache")
+        for idx, file_cached in enumerate(cached):
+            known[idx].update(file_cached)
+            if checkpoint is not None:
+                for name, result in file_cached.items():
+                    checkpoint.add(files_to_eval[idx], name, result)
+
+    detectors = {config.name: config.detector for config in ALL_DETECTORS}
+    def record(idx, name, result):
+        if cache is not None:
+            cache.put(hashes[idx], name, detectors[name], result)
+        if checkpoint is not None:
+            checkpoint.add(files_to_eval[idx], name, result)
+
+    if workers > 1:
+        evaluated = run_parallel(files_to_eval, workers, known, record)
+    else:
+        evaluated = run_serial(files_to_eval, known, record)
+    for eval_result in evaluated:
+        dataset.add(eval_result)
     return dataset
 
-if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(description="Run polyglot detectors on the generated files")
+    parser.add_argument(
+        "--workers", "-w",
+        type=int,
+        default=1,
+        help="Number of detector worker processes with killable timeouts (default: 1 = serial with SIGALRM timeouts)"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Run every detector on every file instead of reusing results for unchanged files from the cache"
+    )
+    parser.add_argument(
+        "--cache-mb",
+        type=int,
+        default=DEFAULT_CACHE_BUDGET // (1024 * 1024),
+        help="Size budget of the detection result cache in MB, least recently used results are evicted"
+    )
+    parser.add_argument(
+        "--resume", "-r",
+        action="store_true",
+        help="Continue an interrupted run from detection_results.jsonl, only missing (file, detector) pairs are run"
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Only convert detection_results.jsonl (e.g. of a crashed run) to detection_results.json, files missing a detector are left out"
+    )
+    args = parser.parse_args()
+    output_file = GENERATED_DIR / "detection_results.json"
+    if args.compact:
+        order = [_relative(file[0]) for file in collect_files()] if (GENERATED_DIR / "run.json").exists() else None
+        incomplete = compact_checkpoint(CHECKPOINT_PATH, output_file, order)
+        print(f"Results saved to: {output_file} ({incomplete} incomplete files left out)")
+        return
+
     print("Starting polyglot detection evaluation...")
-    dataset = run()
+    with EvalCheckpoint(CHECKPOINT_PATH, resume=args.resume) as checkpoint:
+        if args.no_cache:
+            dataset = run(workers=args.workers, checkpoint=checkpoint)
+        else:
+            with DetectionCache(CACHE_PATH, args.cache_mb * 1024 * 1024) as cache:
+                dataset = run(workers=args.workers, cache=cache, checkpoint=checkpoint)
+                print(f"Cache: {cache.hits} hits, {cache.misses} misses")
 
-    output_file = GENERATED_DIR / "detection_results.json"
     dataset.save(output_file)
 
     print(f"\nEvaluation complete!")
     print(f"Total files evaluated: {len(dataset.results)}")
     print(f"Results saved to: {output_file}")
+
+if __name__ == "__main__":
+    main()
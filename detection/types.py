@@ -55,4 +55,38 @@ class DetectionResult:
     detected_types: set[str]
     is_polyglot: bool
     raw_output: dict | str | list
-    error: Optional[str] = None
\ No newline at end of file
+    error: Optional[str] = None
+
+
+def json_default(obj):
+    """``default`` for json.dump of DetectionResults: sets and numpy values are not serializable."""
+    #set si not serializable
+    if isinstance(obj, set):
+        return list(obj)
+    # numpy
+    if hasattr(obj, 'item'):  # numpy scalars
+        return obj.item()
+    if hasattr(obj, 'tolist'):  # numpy arrays
+        return obj.tolist()
+    raise TypeError(f"Failed to sesrialize object of type {type(obj)}")
+
+
+def result_from_dict(data: dict) -> DetectionResult:
+    """
+    Rebuild a DetectionResult that was stored as JSON.
+
+    Detected types become a set again, names of known types FileType members.
+    """
+    types = set()
+    for name in data["detected_types"]:
+        try:
+            types.add(FileType(name))
+        except ValueError:
+            types.add(name) # raw type the detector could not normalize
+    return DetectionResult(
+        tool=data["tool"],
+        detected_types=types,
+        is_polyglot=data["is_polyglot"],
+        raw_output=data["raw_output"],
+        error=data.get("error")
+    )
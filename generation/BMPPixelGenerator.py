@@ -3,11 +3,15 @@
 import sys
 import struct
 import os
+from pathlib import Path
+from typing import Iterable, Iterator
 from .baseGenerator import BaseGenerator
+from .file_utils import copy_file, map_file
 
 
 class BMPPixelGenerator(BaseGenerator):
     """Embeds payload into BMP pixel data (semantic polyglot)."""
+    _payload_offset = 20 # bytes after the image data start
     def _get_name(self) -> str:
         return "BMPPixelPolyglotGenerator"
 
@@ -16,8 +20,32 @@ class BMPPixelGenerator(BaseGenerator):
     
     def generate(self, host: bytes, payload: bytes) -> bytes:
         """Embed payload into BMP pixel data at a fixed offset after the image data start."""
-        payload_offset = 20
-        bmp = host
+        return self._embed(self._parse_header(host), payload)
+
+    def generate_many(self, host: bytes, payloads: Iterable[bytes]) -> Iterator[bytes | Exception]:
+        """Generate one polyglot per payload, parsing the BMP header only once."""
+        return self._generate_each(host, payloads, self._parse_header, self._embed)
+
+    def generate_into(self, host_path: Path, payload: bytes, out_path: Path):
+        """Copy the host kernel side and patch the payload into the copy through an mmap."""
+        with host_path.open("rb") as f:
+            header = self._parse_header(f.read(30))
+        offset, offset_end = self._payload_span(header, payload)
+        if offset_end > host_path.stat().st_size:
+            # truncated pixel data, the in-memory path grows the file
+            return super().generate_into(host_path, payload, out_path)
+        copy_file(host_path, out_path)
+        with map_file(out_path) as mm:
+            mm[offset:offset_end] = payload
+
+    def capacity(self, host_path: Path) -> int:
+        """Pixel data size minus the payload offset, read from the header only."""
+        with host_path.open("rb") as f:
+            _, _, imgSize = self._parse_header(f.read(30))
+        return imgSize - self._payload_offset
+
+    def _parse_header(self, bmp: bytes) -> tuple[bytes, int, int]:
+        """Validate BMP and return (bmp, image data offset, image size)."""
         if len(bmp) < 30:
             #TODO use actual minimum header size?
             raise ValueError("File Too Small to be a BMP File")
@@ -27,16 +55,26 @@ class BMPPixelGenerator(BaseGenerator):
         img_offset = struct.unpack('<I', bmp[10:14])[0]
         width = struct.unpack('<I', bmp[18:22])[0]
         length = struct.unpack('<I', bmp[22:26])[0]
-        bitspp = struct.unpack('<H', bmp[28:30])[0] #bits per pixel 
+        bitspp = struct.unpack('<H', bmp[28:30])[0] #bits per pixel
         bytespp = bitspp // 8 # calc bytes per pixel
         imgSize = width*length*bytespp
-        if(len(payload) + payload_offset > imgSize): 
-            raise ValueError("payload size + offset greater than image size")
-        offset = img_offset + payload_offset
-        offset_end = offset + len(payload)
+        return bmp, img_offset, imgSize
+
+    def _embed(self, header: tuple[bytes, int, int], payload: bytes) -> bytes:
+        bmp = header[0]
+        offset, offset_end = self._payload_span(header, payload)
         bmp_array = bytearray(bmp) # mutable
         bmp_array[offset:offset_end] = payload
         return bytes(bmp_array)
 
+    def _payload_span(self, header: tuple[bytes, int, int], payload: bytes) -> tuple[int, int]:
+        """Start and end offset of the payload in the file, raises if it does not fit the pixel data."""
+        _, img_offset, imgSize = header
+        payload_offset = self._payload_offset
+        if(len(payload) + payload_offset > imgSize):
+            raise ValueError("payload size + offset greater than image size")
+        offset = img_offset + payload_offset
+        return offset, offset + len(payload)
+
 if __name__ == "__main__":
     BMPPixelGenerator().main()
\ No newline at end of file
@@ -1,26 +1,67 @@
 """JPEG polyglot generator using APP0 segment embedding."""
 
 import struct
+from typing import BinaryIO, Iterable, Iterator
 from .baseGenerator import BaseGenerator
-from .jpg_utils import inject_segment
+from .capacity import PayloadInfo
+from .file_utils import copy_stream
+from .jpg_utils import index_jpg_header, inject_segment
 import math
 
 
 class JPEGAPP0Generator(BaseGenerator):
     """Embeds payload into JPEG APP0 (JFIF) segment as thumbnail data (parasite polyglot)."""
+    _THUMBNAIL_WIDTH = 255 # max of the 1 byte width field
+    _MAX_SEGMENT_DATA = 65000
+    # whole thumbnail rows of 3 byte pixels
+    _MAX_PAYLOAD = _MAX_SEGMENT_DATA // (_THUMBNAIL_WIDTH * 3) * _THUMBNAIL_WIDTH * 3
+
     def _get_name(self) -> str:
         return "JPEGAPP0Generator"
 
     def _implements_format(self) -> str:
         return "JPEG"
     
+    def rejects(self, payload: PayloadInfo) -> str | None:
+        if payload.size > self._MAX_PAYLOAD:
+            return f"Jpeg segment cannot be more than 65KB"
+        return None
+
     def generate(self, host: bytes, payload: bytes) -> bytes:
         """Embed payload in APP0 thumbnail and inject after SOI marker."""
+        return self._embed(self._prepare(host), payload)
+
+    def generate_many(self, host: bytes, payloads: Iterable[bytes]) -> Iterator[bytes | Exception]:
+        """Generate one polyglot per payload, removing the old APP0 of the host only once."""
+        return self._generate_each(host, payloads, self._prepare, self._embed)
+
+    def generate_stream(self, host_file: BinaryIO, payload: bytes, out_file: BinaryIO):
+        """Copy the host to out_file with the new APP0 after SOI, only the header segments are read up front."""
+        start = host_file.tell()
+        if host_file.read(2) != b'\xFF\xD8':
+            raise ValueError("Error: Is not a valid JPEG")
+        host_file.seek(start)
+        app0s = [seg for seg in index_jpg_header(host_file) if seg['type'] == 'APP0']
+        app0 = self._create_app0(payload)
+        out_file.write(b'\xFF\xD8' + app0)
+        host_file.seek(start + 2)
+        if app0s:
+            # drop the old APP0 (the last one in front of the image data like inject_segment)
+            old = app0s[-1]
+            copy_stream(host_file, out_file, old['pos'] - 2)
+            host_file.seek(start + old['pos'] + old['length'])
+        copy_stream(host_file, out_file)
+
+    def _prepare(self, host: bytes) -> bytes:
+        """Host without its APP0 segment (so the new one can just be inserted after SOI)."""
         if len(host)<2 or host[0:2] != b'\xFF\xD8':
             raise ValueError("Error: Is not a valid JPEG")
+        stripped, offset = inject_segment(host, b"", "APP0", 2)
+        return stripped
+
+    def _embed(self, stripped: bytes, payload: bytes) -> bytes:
         app0 = self._create_app0(payload)
-        new_jpg, offset = inject_segment(host, app0, "APP0", 2)
-        return new_jpg
+        return stripped[:2] + app0 + stripped[2:]
 
     def _create_app0(self, payload):
         """Build JFIF APP0 segment with payload as RGB thumbnail data (max 65KB)."""
@@ -29,10 +70,10 @@ class JPEGAPP0Generator(BaseGenerator):
             payload = payload + (b'\x00' * (3-mod3))
         # probably easiest instead of thign i sjust pad it out 
         pixels = len(payload) // 3
-        width = 255
+        width = self._THUMBNAIL_WIDTH
         height = math.ceil(pixels / width) 
         totalsize = width * height * 3 
-        if totalsize > 65000:
+        if totalsize > self._MAX_SEGMENT_DATA:
             raise ValueError(f"Jpeg segment cannot be more than 65KB")
         payload = payload + b"\x00" * (totalsize-len(payload))
 
@@ -1,42 +1,128 @@
 """JPEG polyglot generator using progressive scan data embedding."""
 
+import hashlib
+import io
 import subprocess
+from pathlib import Path
+from typing import Iterable, Iterator
 from .baseGenerator import BaseGenerator
+from .capacity import PayloadInfo
+from .cache import host_cache
+from .file_utils import map_file
+from .jpg_utils import get_jpg_index, index_jpg_segments
 import tempfile
+from PIL import Image
+
+# progressive form of each host, module level so it survives across tasks in a pool worker
+_progressive_cache = host_cache(1 / 3)
 
 
 class JPEGPixelGenerator(BaseGenerator):
-    """Embeds payload into progressive JPEG scan data (semantic polyglot). Requires ImageMagick."""
+    """Embeds payload into progressive JPEG scan data (semantic polyglot).
+
+    The progressive re-encode uses ImageMagick ``convert`` by default, the
+    ``pillow`` backend does it in-process without a subprocess per host (the
+    output bytes differ, so it has its own version).
+    """
+    BACKENDS = ("convert", "pillow")
+
+    def __init__(self, backend: str = "convert"):
+        super().__init__()
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, use one of {self.BACKENDS}")
+        self._backend = backend
 
     def _get_name(self) -> str:
         return "JPEGPixelGenerator"
 
     def _implements_format(self) -> str:
         return "JPEG"
-    
+
+    def _get_version(self) -> str:
+        # output bytes differ between the encoders
+        return "1" if self._backend == "convert" else "1-pillow"
+
+    def rejects(self, payload: PayloadInfo) -> str | None:
+        # the gap before EOI is only known after the conversion, the FF rule is not
+        return "Error: payload should not contain any FF bytes" if payload.has_ff else None
+
     def generate(self, host: bytes, payload: bytes) -> bytes:
         """Convert to progressive JPEG and embed payload before EOI marker."""
+        return self._embed(self._prepare(host), payload)
+
+    def generate_many(self, host: bytes, payloads: Iterable[bytes]) -> Iterator[bytes | Exception]:
+        """Generate one polyglot per payload, converting and indexing the host only once."""
+        return self._generate_each(host, payloads, self._prepare, self._embed)
+
+    def generate_into(self, host_path: Path, payload: bytes, out_path: Path):
+        """Write the progressive host straight to out_path and patch the payload in through an mmap."""
+        with host_path.open("rb") as f:
+            self._check_jpeg(f.read(2))
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        if self._backend == "convert":
+            subprocess.run(["convert", str(host_path), "-interlace", "JPEG", str(out_path)], check=True)
+        else:
+            self._to_progressive_pillow(host_path, out_path)
+        try:
+            if b"\xFF" in payload:
+                raise ValueError("Error: payload should not contain any FF bytes")
+            with map_file(out_path) as mm:
+                start, end = self._payload_span(self._locate(mm, index_jpg_segments(mm)), payload)
+                mm[start:end] = payload
+        except Exception:
+            out_path.unlink(missing_ok=True) # dont leave the unpatched host behind
+            raise
+
+    def _check_jpeg(self, host: bytes):
         if len(host)<2 or host[0:2] != b'\xFF\xD8':
             raise ValueError("Error: Is not a valid JPEG")
+
+    def _prepare(self, host: bytes) -> tuple[bytes, int, int]:
+        """Progressive host with its EOI and last SOS position."""
+        self._check_jpeg(host)
+        prog, key = self._get_progressive(host)
+        return (prog, *self._locate(prog, get_jpg_index(prog, key)))
+
+    def _locate(self, prog, segments: list[dict]) -> tuple[int, int]:
+        """EOI and last SOS position of the progressive JPEG."""
+        eoi = next((seg['pos'] for seg in segments if seg['type'] == 'EOI'), len(prog)-1) #no EOI just say at end
+        scans = [seg for seg in segments if seg['type'] == 'SOS']
+        if not scans:
+            raise ValueError("Error: Could not find any SOS marker")
+        return eoi, scans[-1]['pos']
+
+    def _embed(self, prepared: tuple[bytes, int, int], payload: bytes) -> bytes:
+        prog = prepared[0]
         if b"\xFF" in payload:
             raise ValueError("Error: payload should not contain any FF bytes")
-        prog = self._to_progressive(host)
-        eoi = prog.rfind(b"\xFF\xD9")
-        if eoi == -1:
-            eoi = len(prog)-1 #just say at end
+        start, end = self._payload_span(prepared[1:], payload)
+        prog = bytearray(prog)
+        prog[start:end] = payload
+        return bytes(prog)
+
+    def _payload_span(self, located: tuple[int, int], payload: bytes) -> tuple[int, int]:
+        """Where the payload goes: right before the EOI minus a safety distance, raises if it reaches the last SOS."""
+        eoi, last_sos = located
         safety_distance = 50
-        last_sos = prog.rfind(b'\xFF\xDA')
-        if last_sos == -1:
-            raise ValueError("Error: Could not find any SOS marker")
         header_size = 20 # estimate
-        if eoi-safety_distance-len(payload) <= last_sos+header_size: #with safety distance it should be safe now to inject and not break 
+        if eoi-safety_distance-len(payload) <= last_sos+header_size: #with safety distance it should be safe now to inject and not break
             raise ValueError("Error: Payload doesnt fit, overwrites last Start of Scan")
-        
         end = eoi-safety_distance
-        start = end-len(payload)
-        prog = bytearray(prog)
-        prog[start:end] = payload
-        return bytes(prog)
+        return end-len(payload), end
+
+    def _get_progressive(self, host: bytes) -> tuple[bytes, tuple]:
+        """Progressive form of host (converted once per host and backend) and its cache key."""
+        key = (self._backend, hashlib.sha256(host).digest())
+        prog = _progressive_cache.get(key)
+        if prog is None:
+            if self._backend == "convert":
+                prog = self._to_progressive(host)
+            else:
+                out = io.BytesIO()
+                self._to_progressive_pillow(io.BytesIO(host), out)
+                prog = out.getvalue()
+            _progressive_cache.put(key, prog)
+        return prog, key
 
     def _to_progressive(self, host : bytes) -> bytes:
         """Convert JPEG to progressive using ImageMagick."""
@@ -47,5 +133,13 @@ class JPEGPixelGenerator(BaseGenerator):
             result = tmp_out.read()
         return result
 
+    def _to_progressive_pillow(self, host, out):
+        """Re-encode JPEG (path or file object) as progressive into out with Pillow, keeping quantization tables, subsampling, ICC and EXIF like convert."""
+        with Image.open(host) as img:
+            if img.format != "JPEG":
+                raise ValueError("Error: Is not a valid JPEG")
+            img.save(out, "JPEG", progressive=True, quality="keep",
+                     icc_profile=img.info.get("icc_profile"), exif=img.info.get("exif", b""))
+
 if __name__ == "__main__":
-    JPEGPixelGenerator().main()
\ No newline at end of file
+    JPEGPixelGenerator().main()
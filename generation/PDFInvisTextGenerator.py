@@ -1,30 +1,105 @@
 """PDF polyglot generator using invisible text stream embedding."""
 
+import io
+import mmap
 import re
 import sys
 import struct
 import os
+from typing import BinaryIO, Iterable, Iterator
 from .baseGenerator import BaseGenerator
-from .pdf_utils import find_highest_obj_ID, create_xref, create_trailer, parseDictSpan
+from .capacity import PayloadInfo
+from .pdf_utils import (EditedPDF, PDFIndex, create_xref, create_trailer, create_update_trailer, create_xref_section,
+                        find_startxref, object_generation, parseDictSpan, trailer_entries, trailer_size)
+
+_XREF_KEYWORD = re.compile(rb'[\r\n]xref[\r\n]')
+_STARTXREF_KEYWORD = re.compile(rb'[\r\n]startxref[\r\n]')
 
 
 class PDFInvisTextGenerator(BaseGenerator):
-    """Embeds payload as invisible text (Tr 3) in a PDF content stream (semantic polyglot)."""
+    """Embeds payload as invisible text (Tr 3) in a PDF content stream (semantic polyglot).
+
+    By default the file is cut at its xref and the xref/trailer are rebuilt.
+    With ``incremental=True`` the host bytes stay untouched and the changed
+    objects are appended as a PDF incremental update instead. Only this mode
+    can edit pages (or their resources) stored in object streams, the full
+    rewrite cannot replace objects inside a compressed stream.
+    """
+
+    def __init__(self, incremental: bool = False):
+        super().__init__()
+        self._incremental = incremental
 
     def _get_name(self) -> str:
-        return "PDFInvisTextGenerator"
+        return "PDFInvisTextGeneratorIncremental" if self._incremental else "PDFInvisTextGenerator"
 
     def _implements_format(self) -> str:
         return "PDF"
 
+    def _get_version(self) -> str:
+        # 2: font goes into the page resources, not into a /Contents stream dict following direct /Resources
+        # 3: new object number also above the trailer /Size and objects in object streams
+        # 4: update trailer repeats /Encrypt, /ID and /Info of the host,
+        #    rewritten xref has one subsection per run of object numbers and a matching /Size
+        return "4-incremental" if self._incremental else "4"
+
+    def rejects(self, payload: PayloadInfo) -> str | None:
+        # the text is written into the content stream as an ascii string
+        return None if payload.is_ascii else "Error: payload is not ASCII"
+
     def generate(self, host: bytes, payload: bytes) -> bytes:
-        return self._insertHiddenStream(host, payload)
+        return self._embed(self._prepare(host), payload)
+
+    def generate_many(self, host: bytes, payloads: Iterable[bytes]) -> Iterator[bytes | Exception]:
+        """Generate one polyglot per payload, indexing the host and editing page/font objects only once."""
+        return self._generate_each(host, payloads, self._prepare, self._embed)
+
+    def generate_stream(self, host_file: BinaryIO, payload: bytes, out_file: BinaryIO):
+        """Write the polyglot to out_file with the host memory mapped, only the edited objects are held in memory."""
+        try:
+            pdf = mmap.mmap(host_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            # no regular file (or empty), nothing to map
+            return super().generate_stream(host_file, payload, out_file)
+        with pdf:
+            self._write(self._prepare(pdf), payload, out_file)
+
+    def _prepare(self, pdf):
+        """Everything that does not depend on the payload, done once per host."""
+        index = PDFIndex(pdf) # one scan, every step resolves objects through it
+        if self._incremental:
+            return pdf, self._prepareUpdate(pdf, index)
+        return self._prepareRewrite(index)
+
+    def _embed(self, prepared, content):
+        if self._incremental:
+            pdf, update = prepared
+            return pdf + self._incrementalTail(update, content)
+        out = io.BytesIO()
+        self._writeHiddenStream(prepared, content, out)
+        return out.getvalue()
+
+    def _write(self, prepared, content, out):
+        """Like :meth:`_embed` but writes to the file object out, the host is copied in chunks."""
+        if self._incremental:
+            pdf, update = prepared
+            chunk_size = 1024 * 1024
+            for pos in range(0, len(pdf), chunk_size):
+                out.write(pdf[pos:pos+chunk_size])
+            out.write(self._incrementalTail(update, content))
+            return
+        self._writeHiddenStream(prepared, content, out)
 
     _font_inner_dict = b" << /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
 
-    def _addToFontDict(self, pdf, page, res_dict, fontname):
-        """Insert font into /Font dict (handles missing, direct, or indirect ref)."""
+    def _getObject(self, index, edits, num):
+        """Current bytes of object num, taking already edited objects into account."""
+        return edits[num] if num in edits else index.get(num)
+
+    def _addToFontDict(self, index, edits, obj_num, obj, res_start, res_end, fontname):
+        """Insert font into /Font dict of the resource dict obj[res_start:res_end] (handles missing, direct, or indirect ref)."""
         custom_font = b"/" + fontname + self._font_inner_dict
+        res_dict = obj[res_start:res_end]
         match = re.search(b"/Font[ \t\n]*", res_dict)
 
         if not match:
@@ -32,184 +107,211 @@ class PDFInvisTextGenerator(BaseGenerator):
             end = res_dict.rfind(b">>") #find end of dict (should already been parsed/no adjacent dicts on same level so just rfind)
             insert = b" /Font << " + custom_font + b" >>"
             new_res_dict = res_dict[:end] + insert + res_dict[end:]
-            new_page = page.replace(res_dict, new_res_dict, 1)
-            return pdf.replace(page, new_page, 1)
+            edits[obj_num] = obj[:res_start] + new_res_dict + obj[res_end:]
+            return
 
         # look if dictionary follows after /Font
         after_font = res_dict[match.end():]
         direct_dict_match = re.match(b"[ \t\n]*<<", after_font)
 
         if direct_dict_match:
-            #  dictionary come direectly after 
+            #  dictionary come direectly after
             start = match.end()
             end = parseDictSpan(res_dict, start)
             font_dict = res_dict[start:end]
             new_font_dict = font_dict[:-2] + b" " + custom_font + b">>" #insert at end our font
             new_res_dict = res_dict[:start] + new_font_dict + res_dict[end:] #construct new resource dict
-            new_page = page.replace(res_dict, new_res_dict, 1) # first replace in page to avoid replace in wrong place (there can be duplicate for diff page)
-            return pdf.replace(page, new_page, 1) 
+            edits[obj_num] = obj[:res_start] + new_res_dict + obj[res_end:]
+            return
 
         #look if indirect ref come after
         indirect_match = re.match(b"[ \t\n]*(\d+)[ \t\n]*\d+[ \t\n]*R", after_font)
         if indirect_match:
-            #search this whole font obj in pdf. 
-            font_obj_match = re.search(
-                b"\n[ \t]*" + indirect_match.group(1) + b"[ \t\n]*\d+[ \t\n]*obj.*?endobj", pdf, re.S)
-            font_obj = font_obj_match.group(0) # we match with the obj number so no worry about replacing duplicate dictionaries later
+            font_num = int(indirect_match.group(1))
+            font_obj = self._getObject(index, edits, font_num)
+            if font_obj is None:
+                raise ValueError("Error: referenced Font dictionary object not found")
             #extract font dict from obj
             dict_start = font_obj.find(b"<<")
             dict_end = parseDictSpan(font_obj, dict_start)
-            font_dict = font_obj[dict_start:dict_end]
-            new_font_dict = font_dict[:-2] + b" " + custom_font + b">>" #insert same as above
-            return pdf.replace(font_dict, new_font_dict,1)        #replace in whole pdf 
+            new_font_dict = font_obj[dict_start:dict_end-2] + b" " + custom_font + b">>" #insert same as above
+            edits[font_num] = font_obj[:dict_start] + new_font_dict + font_obj[dict_end:]
+            return
 
         raise ValueError("Error: malformed Font dictionary")
 
-    def _addFontToPage(self, pdf, page, fontname):
+    def _addFontToPage(self, index, edits, page_num, fontname):
         """Add font to page /Resources (handles missing, direct, or indirect ref)."""
-        custom_font = fontname + self._font_inner_dict
+        page = self._getObject(index, edits, page_num)
+        custom_font = b"/" + fontname + self._font_inner_dict
         match = re.search(b"/Resources[ \t\n]*", page)
         if not match:
             #res dont exist
             insert = b" /Resources << /Font << " + custom_font + b" >> >>"
             dict_end = page.rfind(b">>") # find end of dictionary
-            new_page = page[:dict_end] + insert + page[dict_end:]
-            return pdf.replace(page, new_page, 1)
-        #look if it matches indirect after end of Resources regex match
+            edits[page_num] = page[:dict_end] + insert + page[dict_end:]
+            return
+        #look if the ref directly follows /Resources (else its the ref of some later key like /Contents)
         #make the obj num findable with .group(1)
-        indirect_match = re.search(b"(\d+)[ \t\n]*\d+[ \t\n]*R", page[match.end():])
+        indirect_match = re.match(b"(\d+)[ \t\n]*\d+[ \t\n]*R", page[match.end():])
         if indirect_match:
-            #match the whole object with the id found before
-            res_obj = re.search(b"\n[ \t]*"+indirect_match.group(1)+b"[ \t\n]*\d+[ \t\n]*obj.*?endobj", pdf, re.S)
-            if res_obj:
-                res_obj_bytes = res_obj.group(0)
-                #extract res dict from res obj
-                dict_start = res_obj_bytes.find(b"<<")
-                dict_end = parseDictSpan(res_obj_bytes, dict_start)
-                res_dict = res_obj_bytes[dict_start:dict_end]
-                return self._addToFontDict(pdf, res_obj_bytes, res_dict, fontname)
+            res_num = int(indirect_match.group(1))
+            res_obj = self._getObject(index, edits, res_num)
+            if res_obj is None:
+                raise ValueError("Error: referenced Resources object not found")
+            #extract res dict from res obj
+            dict_start = res_obj.find(b"<<")
+            dict_end = parseDictSpan(res_obj, dict_start)
+            self._addToFontDict(index, edits, res_num, res_obj, dict_start, dict_end, fontname)
+            return
 
         # direct ref
         start = match.end() # start of obj dict
         end = parseDictSpan(page, start)
-        res_dict = page[start:end]
-        return self._addToFontDict(pdf, page, res_dict, fontname)
-
-    def _findPageObject(self, pdf):
-        """Find first /Type /Page object by iterating all objects."""
-        for obj_match in re.finditer(rb"(\d+ \d+ obj.*?endobj)", pdf, re.S):
-            #we have to parse both header and footer
-            #it seems like in PDF /Type/Page its either in beginning or end
-            obj = obj_match.group(0)
-            dict_start = obj.find(b'<<')
-            if dict_start == -1:
-                continue
-            dict_end = parseDictSpan(obj, dict_start)
-            if dict_end == -1:
-                continue
-            #Find if there is a nested dict
-            begin_nested = obj.find(b'<<', dict_start+2)
-            #Find last nested dict (dont parseDictSpan we WANT to skip same-level nested)
-            end_nested = obj.rfind(b'>>', dict_start, dict_end-2)
-            # get header and footer with pos we parsed
-            if begin_nested != -1 and begin_nested < dict_end: #2nd is sanity check
-                header = obj[dict_start:begin_nested]
-            else:
-                #theres no nested
-                header = obj[dict_start:dict_end]
-            if end_nested != -1: #we find a nested dict end
-                footer = obj[end_nested+2:dict_end]
-            else:
-                #theres no nested dict or its corrupt
-                footer = b''
-            ## search for /Type{0..*(space,tabetc)}/Page{\s or / or >> allwed} so it cant match Pages or sth
-            if re.search(rb'/Type\s*/Page(\s|/|>>)', header) or re.search(rb'/Type\s*/Page(\s|/|>>)', footer):
-                return obj
-        return None #no Page obj found
-
-    def _insertHiddenStream(self, pdf, content):
-        """Add invisible text stream (Tr 3) to first page, rebuild xref/trailer."""
-        fontname = b"Font124573" #no collision
-        fontname_str = fontname.decode('ascii')
-        old_max_obj_id = find_highest_obj_ID(pdf)
-        max_obj_id = old_max_obj_id+1
-        stream = f"BT /{fontname_str} 24 Tf 3 Tr 0 0 Td ({content.decode('ascii')}) Tj ET"
-        stream_bytes = stream.encode('ascii')
-        stream_object = f"{max_obj_id} 0 obj\n<< /Length {len(stream_bytes)} >>\nstream\n{stream}\nendstream\nendobj\n".encode('ascii')
-        stream_object_ref = f"{max_obj_id} 0 R".encode()
-        page = self._findPageObject(pdf)
-        if not page:
-            raise ValueError("Error: could not find any page in PDF (might be parser issue rather than of pdf)")
+        self._addToFontDict(index, edits, page_num, page, start, end, fontname)
 
-        # sanity check: avoids injecting into wrong places and making a corrupt PDF   
-        #/Contents and /Resouces not required by standard (could be empty page) so could delete this but its might worsen correctness                      
-        if not (b'/Contents' in page or b'/Resources' in page):
-            raise ValueError("Error: weird Page object found does not contain either /Contents or /Resources")
-        pdf = self._addFontToPage(pdf, page, fontname)
-        # search again to sync
-        page = self._findPageObject(pdf)
-        if not page: #should not really happen
-            raise ValueError("Error: could not find any page in PDF (might be parser issue rather than of pdf)")
+    def _addContentsRef(self, page, stream_object_ref):
+        """Return page with stream_object_ref added to its /Contents (creating or wrapping it in an array)."""
         contents_match = re.search(b".*?/Contents[ \t\n]*", page, re.S)
         if not contents_match:
             # there is no contents
             insert = b' /Contents ' + stream_object_ref
             end = page.rfind(b">>") # find end
-            new_page = page[:end] + insert + page[end:]
-            pdf = pdf.replace(page, new_page)
-        else:
-            # now we need check is it just one ref or array..
-            rest = page[contents_match.end():]
-            arr_match = re.match(b"\[.*?\]", rest, re.S) # match from begin
-            if arr_match:
-                pos = contents_match.end() + arr_match.end() -1 #pos before ]
-                new_page = page[:pos] + b" " + stream_object_ref + page[pos:]
-                pdf = pdf.replace(page, new_page)
-            else:
-                # no array we need create array and insert now the old and our ref
-                ref_match = re.match(b"\d+[ \t\n]*\d+[ \t\n]*R", rest)
-            
-                if ref_match:
-                    old_content_ref = ref_match.group(0)
-                    start = contents_match.end()
-                    end = start + ref_match.end()
-                    new_contents = b"[" + old_content_ref + b" " + stream_object_ref +b"]"
-                    new_page = page[:start] + new_contents + page[end:]
-                    pdf = pdf.replace(page, new_page)
-                else:
-                    raise ValueError("Error: could not match any obj ref for Contents")
-
-        #  need to handle xref/trailer
-        # get root element now because later pdf gets cut
-        root = re.search(rb'/Root[ \t\n]*\d+[ \t\n]*\d+[ \t\n]*R', pdf)
-        if not root:
+            return page[:end] + insert + page[end:]
+        # now we need check is it just one ref or array..
+        rest = page[contents_match.end():]
+        arr_match = re.match(b"\[.*?\]", rest, re.S) # match from begin
+        if arr_match:
+            pos = contents_match.end() + arr_match.end() -1 #pos before ]
+            return page[:pos] + b" " + stream_object_ref + page[pos:]
+        # no array we need create array and insert now the old and our ref
+        ref_match = re.match(b"\d+[ \t\n]*\d+[ \t\n]*R", rest)
+        if ref_match:
+            old_content_ref = ref_match.group(0)
+            start = contents_match.end()
+            end = start + ref_match.end()
+            new_contents = b"[" + old_content_ref + b" " + stream_object_ref +b"]"
+            return page[:start] + new_contents + page[end:]
+        raise ValueError("Error: could not match any obj ref for Contents")
+
+    _fontname = b"Font124573" #no collision
+
+    def _prepareEdits(self, index):
+        """Edit page/font objects to reference the hidden stream.
+
+        Returns (edits, stream_obj_num) where edits maps object numbers to their
+        new object bytes, the stream object itself is built per payload.
+        """
+        # the trailer /Size also covers numbers only the xref knows of (e.g. free or compressed objects)
+        max_obj_id = max(index.highest_id()+1, trailer_size(index.pdf) or 0)
+        stream_object_ref = f"{max_obj_id} 0 R".encode()
+        page_num = index.first_page()
+        if page_num is None:
+            raise ValueError("Error: could not find any page in PDF (might be parser issue rather than of pdf)")
+        page = index.get(page_num)
+
+        # sanity check: avoids injecting into wrong places and making a corrupt PDF
+        #/Contents and /Resouces not required by standard (could be empty page) so could delete this but its might worsen correctness
+        if not (b'/Contents' in page or b'/Resources' in page):
+            raise ValueError("Error: weird Page object found does not contain either /Contents or /Resources")
+        edits = {} # obj num -> new obj bytes, applied in one go
+        self._addFontToPage(index, edits, page_num, self._fontname)
+        page = self._getObject(index, edits, page_num)
+        edits[page_num] = self._addContentsRef(page, stream_object_ref)
+        if index.root_ref is None:
             raise ValueError("Error: no /Root in pdf")
-        root_bytes = root.group()
+        return edits, max_obj_id
+
+    def _streamObject(self, num, content):
+        """Invisible text (render mode 3 Tr) stream object showing content."""
+        fontname_str = self._fontname.decode('ascii')
+        stream = f"BT /{fontname_str} 24 Tf 3 Tr 0 0 Td ({content.decode('ascii')}) Tj ET"
+        stream_bytes = stream.encode('ascii')
+        return f"{num} 0 obj\n<< /Length {len(stream_bytes)} >>\nstream\n{stream}\nendstream\nendobj\n".encode('ascii')
+
+    def _prepareUpdate(self, pdf, index):
+        """Payload independent part of an incremental update: the edited objects and where they go."""
+        edits, stream_num = self._prepareEdits(index)
+        prev_xref = find_startxref(pdf)
+        if prev_xref is None:
+            raise ValueError("Error: found no startxref to chain the update to")
+        head = [] if pdf[-1:] == b"\n" else [b"\n"]
+        pos = len(pdf) + len(head)
+        entries = {} # obj num -> (offset, generation)
+        for num, obj in sorted(edits.items()):
+            entries[num] = (pos, object_generation(obj))
+            head.append(obj + b"\n")
+            pos += len(obj) + 1
+        # the new stream is not encrypted (no key), /Encrypt is kept so the host objects stay readable
+        trailer_keys = trailer_entries(pdf)
+        return b"".join(head), pos, entries, stream_num, index.root_ref, prev_xref, trailer_keys
+
+    def _incrementalTail(self, update, content):
+        """Build the incremental update section to append to the untouched host.
+
+        Contains the changed objects, the new stream object, an xref section for
+        just these objects and a trailer with /Prev pointing to the previous xref
+        that repeats /Encrypt, /ID and /Info of the previous one.
+        Also works for linearized and xref stream hosts as their xref is left as is.
+        """
+        head, pos, entries, stream_num, root_ref, prev_xref, trailer_keys = update
+        stream_object = self._streamObject(stream_num, content)
+        entries = {**entries, stream_num: (pos, 0)}
+        return b"".join((
+            head,
+            stream_object,
+            create_xref_section(entries),
+            create_update_trailer(stream_num + 1, root_ref, prev_xref, trailer_keys),
+            b"startxref\n" + str(pos + len(stream_object)).encode() + b"\n%%EOF\n",
+        ))
+
+    def _incrementalUpdate(self, pdf, content):
+        """Incremental update section (without the host) for a single payload."""
+        return self._incrementalTail(self._prepareUpdate(pdf, PDFIndex(pdf)), content)
+
+    def _prepareRewrite(self, index):
+        """Apply the edits and find where the document gets cut and the new object goes."""
+        edits, stream_num = self._prepareEdits(index)
+        if any(num not in index.spans for num in edits):
+            raise ValueError("Error: page objects in object streams are only supported with incremental=True")
+        # root from the index, later pdf gets cut
+        root_bytes = index.root_ref
+        doc = EditedPDF(index, edits) # edited document without copying the host
         #look for normal xref keyword
-        xref_match = re.search(rb'[\r\n]xref[\r\n]', pdf)
-        if xref_match:
+        xref_pos = doc.search(_XREF_KEYWORD)
+        if xref_pos is not None:
             #normal case not linearized just cut off and rebuilt at end
-            pdf = pdf[:xref_match.start()+1]  #else its off by 1 (we match 1 before)
-            pdf = pdf + stream_object       # add new object
-            xref = create_xref(pdf)         
-            trailer = create_trailer(pdf, root_bytes) # build new trailer with prev saved root
-            xref_pos = str(len(pdf) + 1).encode()                  # again offset 1 byte to align 
-            pdf = pdf + xref + trailer
-            pdf = pdf + b"startxref\n" + xref_pos + b"\n%%EOF"
-        else:
-            # no normal xref probably linearized pdf
-            # 2 options to do 
-            # be safe and Raise error
-            #raise ValueError("Error: linearized PDF / xref stream is not supported in this generator")
-            #just inject content as xref issues do not break pdf viewers
-            startxref_match = re.search(rb'[\r\n]startxref[\r\n]', pdf)
-            if startxref_match:
-                insert_pos = startxref_match.start()+1
-                pdf = pdf[:insert_pos] + stream_object + b"\n" + pdf[insert_pos:]
-            else:
-                raise ValueError("Error: found no xref or startxref")
-
-        return pdf
+            cut = xref_pos+1  #else its off by 1 (we match 1 before)
+            return doc, True, (cut, doc.index_objects(cut)), stream_num, root_bytes
+        # no normal xref probably linearized pdf
+        # 2 options to do
+        # be safe and Raise error
+        #raise ValueError("Error: linearized PDF / xref stream is not supported in this generator")
+        #just inject content as xref issues do not break pdf viewers
+        startxref_pos = doc.search(_STARTXREF_KEYWORD)
+        if startxref_pos is None:
+            raise ValueError("Error: found no xref or startxref")
+        insert_pos = startxref_pos+1
+        return doc, False, insert_pos, stream_num, root_bytes
+
+    def _writeHiddenStream(self, prepared, content, out):
+        """Add invisible text stream (Tr 3) to first page, rebuild xref/trailer, writing the document to out."""
+        doc, has_xref, pos, stream_num, root_bytes = prepared
+        stream_object = self._streamObject(stream_num, content)
+        if not has_xref:
+            # inject before startxref
+            doc.write(out, 0, pos)
+            out.write(stream_object + b"\n")
+            doc.write(out, pos)
+            return
+        cut, offsets = pos
+        offsets = {**offsets, stream_num: cut} # offsets of the cut pdf + our new object
+        doc.write(out, 0, cut)
+        out.write(stream_object)       # add new object
+        out.write(create_xref(doc, offsets))
+        out.write(create_trailer(doc, root_bytes, offsets)) # build new trailer with prev saved root
+        xref_pos = str(cut + len(stream_object) + 1).encode()   # again offset 1 byte to align
+        out.write(b"startxref\n" + xref_pos + b"\n%%EOF")
 
 if __name__ == "__main__":
-    PDFInvisTextGenerator().main()
\ No newline at end of file
+    PDFInvisTextGenerator().main()
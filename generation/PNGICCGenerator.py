@@ -2,8 +2,44 @@
 
 import zlib
 import struct
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from typing import Iterable, Iterator
 from .baseGenerator import BaseGenerator
+from .capacity import PayloadInfo
+
+
+@dataclass(frozen=True)
+class _ICCTemplate:
+    """ICC profile split around the tag table end, tag offsets already shifted for one extra entry."""
+    size: int # size of the original profile
+    header: bytes # bytes 4-128, the size field is rebuilt per payload
+    tag_count: int
+    tag_table: bytes
+    body: bytes # everything after the tag table
+
+
+@lru_cache(maxsize=None)
+def _load_icc_template(relative: str = "data/sRGB2014.icc") -> _ICCTemplate:
+    """Read and pre-parse the ICC profile once per process."""
+    icc = (Path(__file__).parent / relative).resolve().read_bytes()
+    tag_count = struct.unpack('>I', icc[128:132])[0]
+    # OLD end value
+    tag_table_end = 132 + (tag_count * 12)
+    #need to shift all contents after the entry table as we add new entry
+    tag_table = bytearray(icc[132:tag_table_end])
+    for i in range(tag_count):
+        offset_pos = (i * 12) + 4  # offset 4 = position offset
+        old_offset = struct.unpack('>I', tag_table[offset_pos:offset_pos+4])[0]
+        tag_table[offset_pos:offset_pos+4] = struct.pack('>I', old_offset + 12)
+    return _ICCTemplate(
+        size=len(icc),
+        header=icc[4:128],
+        tag_count=tag_count,
+        tag_table=bytes(tag_table),
+        body=icc[tag_table_end:],
+    )
 
 
 class PNGICCGenerator(BaseGenerator):
@@ -17,59 +53,63 @@ class PNGICCGenerator(BaseGenerator):
 
     def generate(self, host: bytes, payload: bytes) -> bytes:
         """Inject payload into ICC profile and insert as iCCP chunk after IHDR."""
-        parent = Path(__file__).parent
-        relative = "data/sRGB2014.icc"
-        icc_path = (parent / relative).resolve()
-        icc = icc_path.read_bytes()
-        icc = self._inject_into_icc(icc, payload)
+        return self._embed(self._split_host(host), payload)
+
+    def generate_many(self, host: bytes, payloads: Iterable[bytes]) -> Iterator[bytes | Exception]:
+        """Generate one polyglot per payload, parsing the host chunk list only once."""
+        return self._generate_each(host, payloads, self._split_host, self._embed)
+
+    def rejects(self, payload: PayloadInfo) -> str | None:
+        size = _load_icc_template().size + 12 + payload.size # same as the profile built by _inject_into_icc
+        if size > 65536:
+            return f"ICC profile + payload is {size} bytes, maximum is 65536"
+        return None
+
+    def _embed(self, split_host: tuple[bytes, bytes], payload: bytes) -> bytes:
+        head, tail = split_host
+        iccp = self._build_iccp(payload)
+        if tail is None: # no IHDR to insert after
+            return head
+        return b"".join((head, iccp, tail))
+
+    def _split_host(self, host: bytes) -> tuple[bytes, bytes | None]:
+        """Split host at the iCCP insertion point (after IHDR), dropping an existing iCCP chunk."""
+        chunks = self._parse_chunks(host)
+        for chunk_type, start, end in chunks:
+            if chunk_type == b"iCCP":
+                host = host[:start] + host[end:] #insert at start for detection so magika can see it
+                break
+        #insert after IHDR sicne iccp doesnt exist anymore
+        for chunk_type, start, end in chunks:
+            if chunk_type == b"IHDR": # IHDR always comes before iCCP so its offsets stay valid after deleting
+                return host[:end], host[end:]
+        return host, None # no IHDR, nothing inserted
+
+    def _build_iccp(self, payload: bytes) -> bytes:
+        icc = self._inject_into_icc(_load_icc_template(), payload)
 
         #uncompressed deflate block cant be bigger than that
         if len(icc) >65536:
             raise ValueError(f"ICC profile + payload is {len(icc)} bytes, maximum is 65536")
 
-        iccp = self._create_iccp_chunk("sRGB", icc)
+        return self._create_iccp_chunk("sRGB", icc)
 
-        chunks = self._parse_chunks(host)
-        host = bytearray(host)
-        existing_iccp = False
-        for chunk_type, start, end in chunks:
-            if chunk_type == b"iCCP":
-                del host[start:end] #insert at start for detection so magika can see it
-                #host[start:end] = iccp
-                #existing_iccp = True
-                break
-        if not existing_iccp:
-            #insert after IHDR sicne iccp doesnt exist yet
-            for chunk_type, start, end in chunks:
-                if chunk_type == b"IHDR": # NEVER insert after any chunk != IHDR IF deleting before (now offsets wrong)
-                    host[end:end] = iccp
-                    existing_iccp = True
-                    break
-
-        return bytes(host)
-
-
-    def _inject_into_icc(self, icc, payload):
-        """Add payload as 'junk' tag in ICC profile, shifting existing tag offsets."""
-        icc = bytearray(icc)
-        tag_count = struct.unpack('>I', icc[128:132])[0]
-        # OLD end value
-        tag_table_end = 132 + (tag_count * 12)
-        #need to shift all contents after the entry table as we add new entry 
-        for i in range(tag_count):
-            offset_pos = 132 + (i * 12) + 4  # offset 4 = position offset 
-            old_offset = struct.unpack('>I', icc[offset_pos:offset_pos+4])[0]
-            new_offset = old_offset + 12
-            icc[offset_pos:offset_pos+4] = struct.pack('>I', new_offset)
+    def _inject_into_icc(self, template: "_ICCTemplate", payload: bytes) -> bytes:
+        """Add payload as 'junk' tag in ICC profile, the existing tag offsets are already shifted in the template."""
         # payload after old icc size + new table entry size
-        payload_offset = len(icc) + 12
+        payload_offset = template.size + 12
         # create new entry tag
-        new_tag = b'junk' + struct.pack('>II', payload_offset, len(payload)) 
-        # add new payload and set fields
-        icc = icc[:tag_table_end] + new_tag + icc[tag_table_end:] + payload  
-        icc[128:132] = struct.pack('>I', tag_count + 1)   
-        icc[0:4] = struct.pack('>I', len(icc)) 
-        return bytes(icc)
+        new_tag = b'junk' + struct.pack('>II', payload_offset, len(payload))
+        size = payload_offset + len(payload)
+        return b"".join((
+            struct.pack('>I', size),
+            template.header,
+            struct.pack('>I', template.tag_count + 1),
+            template.tag_table,
+            new_tag,
+            template.body,
+            payload,
+        ))
 
     def _create_iccp_chunk(self, profile_name, icc_profile):
         """Create iCCP chunk with null-terminated name and zlib-compressed ICC data."""
@@ -1,44 +1,84 @@
 """PNG polyglot generator using pixel data embedding."""
 
+import hashlib
 import zlib
 import struct
 from pathlib import Path
+from typing import Iterable, Iterator
 from .baseGenerator import BaseGenerator
+from .cache import host_cache
+import numpy as np
 import png
 import sys
 
+# decoded hosts, module level so it survives across tasks in a pool worker
+_decoded_cache = host_cache(2 / 3, sizeof=lambda pixels: pixels.nbytes)
+
 
 class PNGPixelGenerator(BaseGenerator):
-    """Embeds payload into PNG pixel data with uncompressed IDAT (semantic polyglot)."""
+    """Embeds payload into PNG pixel data with uncompressed IDAT (semantic polyglot).
+
+    In ``stored`` mode the whole IDAT is uncompressed. ``mixed`` mode stores only
+    the payload row uncompressed and deflates all other rows in the same zlib
+    stream, so the payload stays visible but the file is not raw bitmap sized.
+    """
     _compression_method = zlib.Z_NO_COMPRESSION
+    _mixed_compression_level = zlib.Z_DEFAULT_COMPRESSION
+    MODES = ("stored", "mixed")
+    _MAX_STORED_BLOCK = 65535 # LEN field of a stored deflate block is 16 bit
+
+    def __init__(self, mode: str = "stored"):
+        super().__init__()
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown mode {mode}, use one of {self.MODES}")
+        self._mode = mode
+
     def _get_name(self) -> str:
-        return "PNGPixelGenerator"
+        return "PNGPixelGeneratorMixed" if self._mode == "mixed" else "PNGPixelGenerator"
 
     def _implements_format(self) -> str:
         return "PNG"
 
+    def _get_version(self) -> str:
+        return "1" if self._mode == "stored" else "1-mixed"
+
     def generate(self, host: bytes, payload: bytes) -> bytes:
         """Rebuild PNG with payload in first row of pixel data using uncompressed IDAT."""
-        reader = png.Reader(bytes=host)
-        width, height, pixels, metadata = reader.asRGB()
-        pixels = list(pixels)
+        return self._embed(self._decode(host), payload)
+
+    def generate_many(self, host: bytes, payloads: Iterable[bytes]) -> Iterator[bytes | Exception]:
+        """Generate one polyglot per payload, decoding the host only once."""
+        return self._generate_each(host, payloads, self._decode, self._embed)
+
+    def capacity(self, host_path: Path) -> int | None:
+        """First row size (width*3 RGB bytes) from the IHDR, in mixed mode also bounded by one stored block."""
+        with host_path.open("rb") as f:
+            head = f.read(24)
+        if len(head) < 24 or head[:8] != b'\x89PNG\r\n\x1a\n' or head[12:16] != b"IHDR":
+            return None
+        row_len = struct.unpack('>I', head[16:20])[0] * 3
+        if self._mode == "mixed":
+            return min(row_len, self._MAX_STORED_BLOCK - 1) # -1 for the filter byte
+        return row_len
+
+    def _embed(self, pixels: np.ndarray, payload: bytes) -> bytes:
+        height, row_len = pixels.shape
         nRow = 0
-        row = pixels[nRow]
-        if len(payload) > len(row):
+        if len(payload) > row_len:
             raise ValueError("Error: payload does not fit in row")
-        row[0:len(payload)] = payload
-        pixels[nRow] = row
-        bdata = bytearray()
-        for row in pixels: 
-            bdata.append(0) #every row first byte signal the filtering applied, 0 = none
-            bdata.extend(row)
-        compressed = zlib.compress(bdata, level=self._compression_method)
+        # every row first byte signal the filtering applied, 0 = none -> column of zeros in front
+        bdata = np.zeros((height, row_len + 1), dtype=np.uint8)
+        bdata[:, 1:] = pixels
+        bdata[nRow, 1:len(payload) + 1] = np.frombuffer(payload, dtype=np.uint8)
+        if self._mode == "mixed":
+            compressed = self._compress_mixed(bdata, nRow, len(payload))
+        else:
+            compressed = zlib.compress(bdata, level=self._compression_method)
         idat_type = b"IDAT"
         idat_chunk = self._create_chunk(idat_type, compressed)
 
         #https://www.w3.org/TR/PNG-Chunks.html
-        height = len(pixels)
-        width = int(len(pixels[0])/3)
+        width = row_len // 3
         bit_depth = 8
         color_type = 2 #only color used
         compression_method = 0 #zlib (note it doesnt specify which zlib level just zlib)
@@ -53,6 +93,42 @@ class PNGPixelGenerator(BaseGenerator):
         return full
 
 
+    def _compress_mixed(self, bdata: np.ndarray, nRow: int, payload_len: int) -> bytes:
+        """Build a zlib stream with row nRow in stored deflate blocks and all other rows compressed."""
+        # payload starts after the filter byte and has to stay in one block, else a block header splits it
+        if payload_len + 1 > self._MAX_STORED_BLOCK:
+            raise ValueError("Error: payload does not fit in a single stored deflate block")
+        #https://www.rfc-editor.org/rfc/rfc1950 / rfc1951
+        parts = [b"\x78\x01"] # zlib header: deflate, 32K window, no dict
+        if nRow > 0:
+            before = zlib.compressobj(self._mixed_compression_level, zlib.DEFLATED, -15) # raw deflate
+            parts.append(before.compress(bdata[:nRow]))
+            parts.append(before.flush(zlib.Z_SYNC_FLUSH)) # non final + byte aligned so the stored block can follow
+        row = bdata[nRow].tobytes()
+        for pos in range(0, len(row), self._MAX_STORED_BLOCK):
+            block = row[pos:pos + self._MAX_STORED_BLOCK]
+            # BFINAL=0 BTYPE=00 padded to a byte, then LEN and its complement NLEN (little endian)
+            parts.append(b"\x00" + struct.pack('<HH', len(block), len(block) ^ 0xFFFF) + block)
+        after = zlib.compressobj(self._mixed_compression_level, zlib.DEFLATED, -15)
+        parts.append(after.compress(bdata[nRow + 1:]))
+        parts.append(after.flush()) # ends with the final block
+        parts.append(struct.pack('>I', zlib.adler32(bdata)))
+        return b"".join(parts)
+
+    def _decode(self, host: bytes) -> np.ndarray:
+        """Decode host to a read-only (height, width*3) RGB array, once per host."""
+        key = hashlib.sha256(host).digest()
+        pixels = _decoded_cache.get(key)
+        if pixels is None:
+            reader = png.Reader(bytes=host)
+            width, height, rows, metadata = reader.asRGB()
+            if metadata["bitdepth"] > 8:
+                raise ValueError("Error: only PNGs with up to 8 bit per channel are supported")
+            # rows are byte arrays, join them into one contiguous buffer
+            pixels = np.frombuffer(b"".join(rows), dtype=np.uint8).reshape(height, width * 3)
+            _decoded_cache.put(key, pixels)
+        return pixels
+
     def _create_chunk(self, chunk_type, chunk_data):
         """Build a PNG chunk: length (4B) + type (4B) + data + CRC32 (4B)."""
         length = len(chunk_data)
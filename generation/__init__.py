@@ -25,20 +25,30 @@ Example:
     >>> polyglot = generator.generate(host_bytes, payload_bytes)
 """
 
-from .BMPPixelGenerator import BMPPixelGenerator
-from .PNGICCGenerator import PNGICCGenerator
-from .PNGPixelGenerator import PNGPixelGenerator
-from .PDFInvisTextGenerator import PDFInvisTextGenerator
-from .JPEGAPP0Generator import JPEGAPP0Generator
-from .JPEGPixelGenerator import JPEGPixelGenerator
-from .run_generation import run
-
-__all__ = [
-    "BMPPixelGenerator",
-    "PNGICCGenerator",
-    "PNGPixelGenerator",
-    "PDFInvisTextGenerator",
-    "JPEGAPP0Generator",
-    "JPEGPixelGenerator",
-    "run",
-]
+import importlib
+
+# name -> module, imported on first access (PEP 562) so running one generator
+# standalone does not pull in numpy/pypng/Pillow or the runner
+_LAZY = {
+    "BMPPixelGenerator": ".BMPPixelGenerator",
+    "PNGICCGenerator": ".PNGICCGenerator",
+    "PNGPixelGenerator": ".PNGPixelGenerator",
+    "PDFInvisTextGenerator": ".PDFInvisTextGenerator",
+    "JPEGAPP0Generator": ".JPEGAPP0Generator",
+    "JPEGPixelGenerator": ".JPEGPixelGenerator",
+    "run": ".run_generation",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    globals()[name] = value # next access skips __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
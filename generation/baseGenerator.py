@@ -2,7 +2,9 @@
 
 from abc import ABC, abstractmethod
 from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterable, Iterator
 import argparse
+from .capacity import PayloadInfo
 
 
 class BaseGenerator(ABC):
@@ -14,11 +16,79 @@ class BaseGenerator(ABC):
     @abstractmethod
     def _implements_format(self) -> str:
         pass
+
+    def _get_version(self) -> str:
+        """Version of the technique, bump it whenever the output for the same inputs changes."""
+        return "1"
     
     @abstractmethod
     def generate(self, host: bytes, payload: bytes) -> bytes: #pass bytes return bytes so dont have to deal with file io in generate functions = SRP/SOC
         pass
-    
+
+    def capacity(self, host_path: Path) -> int | None:
+        """Largest payload in bytes the host can take, None if unknown.
+
+        Used to skip doomed tasks before running them (see :mod:`.capacity`),
+        so read as little of the host as possible and never underestimate.
+        """
+        return None
+
+    def rejects(self, payload: PayloadInfo) -> str | None:
+        """Reason why the payload can never be embedded, whatever the host, None if it may."""
+        return None
+
+    def generate_many(self, host: bytes, payloads: Iterable[bytes]) -> Iterator[bytes | Exception]:
+        """Generate one polyglot per payload for the same host, lazily in payload order.
+
+        A failing payload does not abort the batch, its exception is yielded in
+        place of the output. Generators that can parse the host once override
+        this with :meth:`_generate_each`.
+        """
+        return self._generate_each(host, payloads, lambda host: host, self.generate)
+
+    def generate_into(self, host_path: Path, payload: bytes, out_path: Path):
+        """Write the polyglot for the host file directly to out_path.
+
+        The default reads the host and writes the output of :meth:`generate`.
+        Generators that only patch a few bytes of the host override it to copy
+        the file kernel side and patch the copy in place (see :mod:`.file_utils`).
+        """
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        out_path.write_bytes(self.generate(host_path.read_bytes(), payload))
+
+    def writes_in_place(self) -> bool:
+        """True if :meth:`generate_into` is overridden and avoids holding the host in memory."""
+        return type(self).generate_into is not BaseGenerator.generate_into
+
+    def generate_stream(self, host_file: BinaryIO, payload: bytes, out_file: BinaryIO):
+        """Read the host from host_file and write the polyglot to out_file.
+
+        The default reads the whole host and writes the output of :meth:`generate`.
+        Generators that can work with bounded buffering override it, they may
+        expect host_file to be a seekable (and mappable) regular file.
+        """
+        out_file.write(self.generate(host_file.read(), payload))
+
+    def streams(self) -> bool:
+        """True if :meth:`generate_stream` is overridden and does not hold the whole host in memory."""
+        return type(self).generate_stream is not BaseGenerator.generate_stream
+
+    def _generate_each(self, host: bytes, payloads: Iterable[bytes], prepare: Callable[[bytes], Any],
+                       embed: Callable[[Any, bytes], bytes]) -> Iterator[bytes | Exception]:
+        """Run prepare(host) once, then yield embed(prepared, payload) per payload (exceptions in place)."""
+        prepared = error = None
+        try:
+            prepared = prepare(host)
+        except Exception as e:
+            error = e # host is broken, every payload fails with it
+        for payload in payloads:
+            try:
+                if error is not None:
+                    raise error
+                yield embed(prepared, payload)
+            except Exception as e:
+                yield e
+
     def parse_cli(self):
         """Parse CLI arguments for standalone generator usage."""
         parser = argparse.ArgumentParser(prog=f"{self._get_name()} polyglot generator",
@@ -0,0 +1,116 @@
+"""In-memory caches shared by the generation pipeline."""
+
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Hashable
+
+DEFAULT_SAMPLE_BUDGET = 1024 * 1024 * 1024  # bytes for all processes, see configure_caches in generation.py
+HOST_CACHE_SHARE = 0.5 # of a process budget that goes to the host caches of the generators
+
+
+class LRUCache:
+    """LRU cache bounded by the summed size of its values (``sizeof`` of each value)."""
+
+    def __init__(self, max_size: int, sizeof: Callable[[Any], int] = len):
+        self.max_size = max_size
+        self._sizeof = sizeof
+        self._items: OrderedDict = OrderedDict()
+        self._size = 0
+
+    def get(self, key: Hashable, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key: Hashable, value):
+        """Insert value, evicting least recently used entries; values bigger than the budget are not kept."""
+        size = self._sizeof(value)
+        if key in self._items:
+            self._size -= self._sizeof(self._items.pop(key))
+        if size > self.max_size:
+            return
+        self._items[key] = value
+        self._size += size
+        while self._size > self.max_size:
+            _, evicted = self._items.popitem(last=False)
+            self._size -= self._sizeof(evicted)
+
+    def resize(self, max_size: int):
+        """Change the budget, evicting least recently used entries until it fits."""
+        self.max_size = max_size
+        while self._size > self.max_size:
+            _, evicted = self._items.popitem(last=False)
+            self._size -= self._sizeof(evicted)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+# prepared hosts (decoded pixels, progressive re-encodes) of the generators, module level
+# in the generator modules so they survive across tasks in a pool worker
+_host_caches: list[tuple[LRUCache, float]] = []
+_host_budget = int(DEFAULT_SAMPLE_BUDGET * HOST_CACHE_SHARE)
+
+def host_cache(share: float, sizeof: Callable[[Any], int] = len) -> LRUCache:
+    """LRU cache holding ``share`` of the process host budget, resized by :func:`configure_host_caches`."""
+    cache = LRUCache(int(_host_budget * share), sizeof)
+    _host_caches.append((cache, share))
+    return cache
+
+def configure_host_caches(max_bytes: int):
+    """Set the host budget of this process, also for generator modules imported later."""
+    global _host_budget
+    _host_budget = max_bytes
+    for cache, share in _host_caches:
+        cache.resize(int(max_bytes * share))
+
+
+@dataclass(frozen=True)
+class Sample:
+    """Content of a sample file together with its sha256."""
+    data: bytes
+    sha256: str
+
+
+class SampleStore:
+    """Loads each sample file once and memoizes its bytes and sha256.
+
+    Bytes are kept under a memory budget with LRU eviction, hashes are tiny and
+    kept for every file seen so an evicted sample is never hashed twice.
+    """
+
+    def __init__(self, max_bytes: int = int(DEFAULT_SAMPLE_BUDGET * (1 - HOST_CACHE_SHARE))):
+        self._data = LRUCache(max_bytes, sizeof=lambda sample: len(sample.data))
+        self._hashes: dict[str, str] = {}
+
+    def get(self, path: Path) -> Sample:
+        key = str(path)
+        sample = self._data.get(key)
+        if sample is None:
+            data = path.read_bytes()
+            digest = self._hashes.get(key)
+            if digest is None:
+                digest = hashlib.sha256(data).hexdigest()
+                self._hashes[key] = digest
+            sample = Sample(data, digest)
+            self._data.put(key, sample)
+        return sample
+
+    def read(self, path: Path) -> bytes:
+        return self.get(path).data
+
+    def sha256(self, path: Path) -> str:
+        """Hash of a sample, computed by streaming the file if it is not loaded yet."""
+        key = str(path)
+        digest = self._hashes.get(key)
+        if digest is None:
+            with path.open("rb") as f:
+                digest = hashlib.file_digest(f, "sha256").hexdigest()
+            self._hashes[key] = digest
+        return digest
@@ -0,0 +1,61 @@
+"""Pre-flight checks that find generation tasks which can never succeed before running them."""
+
+from dataclasses import dataclass
+from pathlib import Path
+from .cache import SampleStore
+
+
+@dataclass(frozen=True)
+class PayloadInfo:
+    """Properties of a payload that generators have hard requirements on."""
+    size: int
+    has_ff: bool
+    is_ascii: bool
+
+    @classmethod
+    def of(cls, data: bytes) -> "PayloadInfo":
+        return cls(len(data), b"\xff" in data, data.isascii())
+
+
+class CapacityIndex:
+    """Host capacity per generator and payload properties per covert, each computed once.
+
+    A task is rejected if the generator refuses the payload outright
+    (``BaseGenerator.rejects``) or the payload is bigger than the capacity
+    of the host (``BaseGenerator.capacity``). Both only ever reject tasks
+    that would fail anyway.
+    """
+
+    def __init__(self, store: SampleStore):
+        self._store = store
+        self._capacities: dict[tuple, int | None] = {}
+        self._payloads: dict[str, PayloadInfo] = {}
+
+    def payload(self, path: Path) -> PayloadInfo:
+        key = str(path)
+        info = self._payloads.get(key)
+        if info is None:
+            info = PayloadInfo.of(self._store.read(path))
+            self._payloads[key] = info
+        return info
+
+    def capacity(self, generator, host_path: Path) -> int | None:
+        """Capacity of host for generator, None if unknown (unreadable hosts are left to the generator)."""
+        key = (generator._get_name(), generator._get_version(), str(host_path))
+        if key not in self._capacities:
+            try:
+                self._capacities[key] = generator.capacity(host_path)
+            except Exception:
+                self._capacities[key] = None # broken host, let the generator report it
+        return self._capacities[key]
+
+    def rejection(self, generator, host_path: Path, covert_path: Path) -> str | None:
+        """Reason why generator can never embed covert into host, None if it may work."""
+        info = self.payload(covert_path)
+        reason = generator.rejects(info)
+        if reason is not None:
+            return reason
+        capacity = self.capacity(generator, host_path)
+        if capacity is not None and info.size > capacity:
+            return f"Pre-flight: payload of {info.size} bytes exceeds host capacity of {capacity} bytes"
+        return None
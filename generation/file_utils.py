@@ -0,0 +1,46 @@
+"""Utility functions for generators that write their output file in place or as a stream."""
+
+import mmap
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+
+def copy_file(src: Path, dst: Path):
+    """Copy src to dst kernel side (copy_file_range, may reflink) without reading it into Python memory."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if not hasattr(os, "copy_file_range"): # not on macOS/Windows
+        shutil.copyfile(src, dst)
+        return
+    with src.open("rb") as fsrc, dst.open("wb") as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+            return
+        except OSError:
+            pass # e.g. cross filesystem on old kernels or unsupported fs, fall back below
+    shutil.copyfile(src, dst) # uses sendfile where available
+
+def copy_stream(src: BinaryIO, dst: BinaryIO, length: int | None = None, chunk_size: int = 1024 * 1024):
+    """Copy length bytes (default: everything left) from src to dst in chunks of at most chunk_size."""
+    if length is None:
+        shutil.copyfileobj(src, dst, chunk_size)
+        return
+    while length > 0:
+        chunk = src.read(min(chunk_size, length))
+        if not chunk:
+            break
+        dst.write(chunk)
+        length -= len(chunk)
+
+@contextmanager
+def map_file(path: Path) -> Iterator[mmap.mmap]:
+    """Writable mmap of a whole (non empty) file, changes are written back on close."""
+    with path.open("r+b") as f, mmap.mmap(f.fileno(), 0) as mm:
+        yield mm
@@ -5,15 +5,18 @@ import hashlib
 import json
 from dataclasses import dataclass, asdict
 from datetime import datetime
+from itertools import repeat
 from pathlib import Path
 from typing import Optional
 from .baseGenerator import BaseGenerator
+from .cache import HOST_CACHE_SHARE, SampleStore, configure_host_caches
 
 
 class GenStatus(StrEnum):
     """Status of a polyglot generation attempt."""
     SUCCESS = auto()
     ERROR = auto()
+    REJECTED = auto() # never ran, pre-flight found the payload cannot fit
 
 
 class PolyglotKind(StrEnum):
@@ -26,6 +29,32 @@ class PolyglotKind(StrEnum):
 def sha256(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
 
+def file_sha256(path: Path) -> str:
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+# hosts at least this big go through generate_into if the generator can patch in place
+IN_PLACE_THRESHOLD = 64 * 1024 * 1024
+# else through generate_stream if the generator streams
+STREAM_THRESHOLD = 256 * 1024 * 1024
+
+# one store per process, pool workers set up their own via configure_caches
+_sample_store = SampleStore()
+
+def configure_sample_store(max_bytes: int):
+    """Replace the process wide sample store, e.g. to change its memory budget."""
+    global _sample_store
+    _sample_store = SampleStore(max_bytes)
+
+def configure_caches(max_bytes: int):
+    """Split the memory budget of this process between the sample store and the host caches of the generators."""
+    host_bytes = int(max_bytes * HOST_CACHE_SHARE)
+    configure_sample_store(max_bytes - host_bytes)
+    configure_host_caches(host_bytes)
+
+def get_sample_store() -> SampleStore:
+    return _sample_store
+
 @dataclass
 class Result:
     """Result of a single polyglot generation with metadata for reproducibility."""
@@ -45,27 +74,108 @@ class Result:
     output_hash: Optional[str]
     # might not fail no error
     error: Optional[str]
+    # older run.json files do not have them
+    generator_version: Optional[str] = None
+    output_size: Optional[int] = None
+
+    @staticmethod
+    def from_dict(data: dict) -> "Result":
+        """Rebuild a Result from its run.json representation."""
+        data = dict(data)
+        data["status"] = GenStatus(data["status"])
+        data["kind"] = PolyglotKind(data["kind"])
+        return Result(**data)
 
 
-def launch(generator: BaseGenerator, overt_path: Path, covert_path: Path, out_path: Path, kind: PolyglotKind, covert_format: Optional[str]):
-    """Execute a generator on given files and return a Result with hashes."""
-    overt = overt_path.read_bytes()
-    covert = covert_path.read_bytes()
-    status = GenStatus.SUCCESS
-    error = None
-    out_hash = None
-    if covert_format is None:
-        covert_format = covert_path.suffix.rsplit(".",1)[-1].upper()
+def _generate_stream(generator: BaseGenerator, overt_path: Path, payload: bytes, out_path: Path):
+    """Run generate_stream from overt_path into out_path, removing the partial output on error."""
+    out_path.parent.mkdir(parents=True, exist_ok=True)
     try:
-        out = generator.generate(overt, covert)
-        out_path.parent.mkdir(parents=True, exist_ok=True) # else it fails
-        out_path.write_bytes(out)
-        out_hash = sha256(out)
-    except Exception as e:
-        error = str(e)
-        status = GenStatus.ERROR
-    finally:
-        return Result(
+        with overt_path.open("rb") as host_file, out_path.open("wb") as out_file:
+            generator.generate_stream(host_file, payload, out_file)
+    except Exception:
+        out_path.unlink(missing_ok=True)
+        raise
+
+def reject(generator: BaseGenerator, overt_path: Path, covert_path: Path, out_path: Path, kind: PolyglotKind, covert_format: str,
+           reason: str, store: Optional[SampleStore] = None) -> Result:
+    """Result for a task rejected by the pre-flight check, the overt is only hashed."""
+    if store is None:
+        store = _sample_store
+    return Result(
+        status = GenStatus.REJECTED,
+        kind = kind,
+        generator = generator._get_name(),
+        overt_format = generator._implements_format(),
+        covert_format = covert_format,
+        overt_path = str(overt_path),
+        covert_path = str(covert_path),
+        overt_hash = store.sha256(overt_path),
+        covert_hash = store.sha256(covert_path),
+        output_path = str(out_path),
+        output_hash = None,
+        error = reason,
+        generator_version = generator._get_version()
+    )
+
+def launch(generator: BaseGenerator, overt_path: Path, covert_path: Path, out_path: Path, kind: PolyglotKind, covert_format: Optional[str],
+           store: Optional[SampleStore] = None):
+    """Execute a generator on given files and return a Result with hashes.
+
+    Inputs are read through ``store`` (the process wide sample store by default)
+    so every sample is loaded and hashed only once.
+    """
+    return launch_many(generator, overt_path, [covert_path], [out_path], kind, [covert_format], store)[0]
+
+def launch_many(generator: BaseGenerator, overt_path: Path, covert_paths: list[Path], out_paths: list[Path], kind: PolyglotKind,
+                covert_formats: list[Optional[str]], store: Optional[SampleStore] = None) -> list[Result]:
+    """Execute a generator on one overt and several coverts through ``generate_many``, one Result per covert.
+
+    Big overts are never loaded, each output is written by ``generate_into``
+    (from ``IN_PLACE_THRESHOLD``) or ``generate_stream`` (from ``STREAM_THRESHOLD``)
+    if the generator supports it.
+    """
+    if store is None:
+        store = _sample_store
+    coverts = [store.get(covert_path) for covert_path in covert_paths]
+    overt_size = overt_path.stat().st_size
+    in_place = generator.writes_in_place() and overt_size >= IN_PLACE_THRESHOLD
+    streamed = not in_place and generator.streams() and overt_size >= STREAM_THRESHOLD
+    if in_place or streamed:
+        overt_hash = store.sha256(overt_path)
+        outputs = repeat(None)
+    else:
+        overt = store.get(overt_path)
+        overt_hash = overt.sha256
+        outputs = generator.generate_many(overt.data, (covert.data for covert in coverts))
+    results = []
+    for covert_path, covert, out_path, covert_format, out in zip(covert_paths, coverts, out_paths, covert_formats, outputs):
+        status = GenStatus.SUCCESS
+        error = None
+        out_hash = None
+        out_size = None
+        if covert_format is None:
+            covert_format = covert_path.suffix.rsplit(".",1)[-1].upper()
+        try:
+            if in_place:
+                generator.generate_into(overt_path, covert.data, out_path)
+                out_hash = file_sha256(out_path)
+                out_size = out_path.stat().st_size
+            elif streamed:
+                _generate_stream(generator, overt_path, covert.data, out_path)
+                out_hash = file_sha256(out_path)
+                out_size = out_path.stat().st_size
+            else:
+                if isinstance(out, Exception):
+                    raise out
+                out_path.parent.mkdir(parents=True, exist_ok=True) # else it fails
+                out_path.write_bytes(out)
+                out_hash = sha256(out)
+                out_size = len(out)
+        except Exception as e:
+            error = str(e)
+            status = GenStatus.ERROR
+        results.append(Result(
             status = status,
             kind = kind ,
             generator = generator._get_name(),
@@ -73,12 +183,15 @@ def launch(generator: BaseGenerator, overt_path: Path, covert_path: Path, out_pa
             covert_format = covert_format,
             overt_path = str(overt_path),
             covert_path = str(covert_path),
-            overt_hash = sha256(overt),
-            covert_hash = sha256(covert),
+            overt_hash = overt_hash,
+            covert_hash = covert.sha256,
             output_path = str(out_path),
             output_hash = out_hash,
-            error = error
-        )
+            error = error,
+            generator_version = generator._get_version(),
+            output_size = out_size
+        ))
+    return results
 
 @dataclass
 class PolyDataset:
@@ -101,4 +214,79 @@ class PolyDataset:
         with path.open('w') as f:
             json.dump(asdict(self), f)
 
+    @staticmethod
+    def load(path: Path) -> "PolyDataset":
+        """Load a dataset written by :meth:`save` or streamed by :class:`PolyDatasetWriter`."""
+        if path.suffix == ".jsonl":
+            data = load_jsonl(path)
+        else:
+            with path.open() as f:
+                data = json.load(f)
+        return PolyDataset(
+            timestamp=data["timestamp"],
+            polyglots=[Result.from_dict(r) for r in data["polyglots"]]
+        )
+
+
+class PolyDatasetWriter:
+    """Streaming dataset sink that appends one JSON record per result.
+
+    The first line is a header record holding the timestamp, every further line
+    is one :class:`Result`. Lines are flushed right away so a crash only loses
+    the result that was being written.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.timestamp = datetime.now().isoformat()
+        self._file = path.open('w')
+        self._write({"timestamp": self.timestamp})
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def add(self, result: Result):
+        self._write(asdict(result))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _iter_jsonl(path: Path):
+    """Yield the records of a JSONL dataset, skipping a line cut off by a crash."""
+    with path.open() as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # only the last line can be incomplete
+                continue
+
+def load_jsonl(path: Path) -> dict:
+    """Load a streamed dataset into the run.json layout ({timestamp, polyglots})."""
+    records = _iter_jsonl(path)
+    header = next(records)
+    return {"timestamp": header["timestamp"], "polyglots": list(records)}
+
+def jsonl_to_json(src: Path, dst: Path):
+    """Convert a streamed dataset into run.json without holding all records in memory."""
+    records = _iter_jsonl(src)
+    header = next(records)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    with dst.open('w') as f:
+        f.write('{"timestamp": ' + json.dumps(header["timestamp"]) + ', "polyglots": [')
+        for idx, record in enumerate(records):
+            if idx:
+                f.write(', ')
+            f.write(json.dumps(record))
+        f.write(']}')
+
 
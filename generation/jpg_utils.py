@@ -1,47 +1,125 @@
 """Utility functions for parsing and manipulating JPEG file structure."""
 
+import hashlib
+import re
 import sys
 import struct
+from .cache import LRUCache
 
 
-def parse_jpg_segments(jpg):
-    """Parse JPEG markers and return dict of {name: {pos, length}} for APP0/APP1/SOS."""
-    segments = {}
-    pos = 2  # Skip SOI
+# first marker after entropy coded data, skips FF00 stuffing and RSTn (D0-D7)
+_SCAN_END = re.compile(rb'\xFF[\xC0-\xCF\xD8-\xFE]')
+_index_cache = LRUCache(1024, sizeof=lambda segments: 1) # index per host hash
+
+def _marker_name(marker):
+    if 0xE0 <= marker <= 0xEF:
+        return f'APP{marker - 0xE0}'
+    if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+        return f'SOF{marker - 0xC0}'
+    return {0xC4: 'DHT', 0xCC: 'DAC', 0xDA: 'SOS', 0xDB: 'DQT', 0xDD: 'DRI', 0xD9: 'EOI', 0xFE: 'COM'}.get(marker, f'0x{marker:02X}')
+
+def index_jpg_segments(jpg):
+    """Single pass over all JPEG markers, returns list of {type, marker, pos, length} in file order.
 
+    Covers every APPn, DQT, DHT, SOFn, each (progressive) SOS and the EOI. SOS
+    entries also have 'data_end', the end of the entropy coded data following them.
+    """
+    segments = []
+    pos = 2  # Skip SOI
+    seen_sos = False
     while pos < len(jpg) - 1:
         # All markers have form 0xFFXX
-        if jpg[pos] != 0xFF:
-            raise ValueError(f"Error: expect 0xffXX at offset {pos} but found {jpg[pos:pos+1].hex()}")
         marker = jpg[pos + 1]
         #0x00/0xFF is FF as literal data but we dont parse for FF anyway but jump through the file using length so we did something wrong
-        if marker in [0x00, 0xFF]:
+        if jpg[pos] != 0xFF or marker in [0x00, 0xFF]:
+            if seen_sos:
+                # past the first scan only the scan layout is affected, keep what we have
+                break
+            if jpg[pos] != 0xFF:
+                raise ValueError(f"Error: expect 0xffXX at offset {pos} but found {jpg[pos:pos+1].hex()}")
+            raise ValueError(f"Error parsing ended up in data not a segment beginning")
+        if marker == 0xD9: #EOI
+            segments.append({'type': 'EOI', 'marker': marker, 'pos': pos, 'length': 2})
+            break
+        # no length field
+        if marker == 0x01 or marker in range(0xD0, 0xD9):
+            pos += 2
+            continue
+        #has length field
+        if pos + 4 > len(jpg):
+            if seen_sos:
+                break
+            raise ValueError(f"Error: file ends in the segment at offset {pos}")
+        length = struct.unpack('>H', jpg[pos + 2:pos + 4])[0]
+        length += 2 # the marker
+        segment = {'type': _marker_name(marker), 'marker': marker, 'pos': pos, 'length': length}
+        segments.append(segment)
+        pos += length
+        # SOS = header then img data up to the next real marker
+        #https://en.wikipedia.org/wiki/JPEG_File_Interchange_Format#File_format_structure
+        if marker == 0xDA:
+            seen_sos = True
+            scan_end = _SCAN_END.search(jpg, pos)
+            pos = scan_end.start() if scan_end else len(jpg)
+            segment['data_end'] = pos
+    return segments
+
+def index_jpg_header(f):
+    """Like :func:`index_jpg_segments` up to and including the first SOS, read from the file object f.
+
+    Only the marker and length fields are read (f must be seekable and
+    positioned at the SOI), so the size of the file does not matter.
+    """
+    segments = []
+    start = f.tell()
+    pos = 2  # Skip SOI
+    while True:
+        f.seek(start + pos)
+        head = f.read(4)
+        if len(head) < 2:
+            break
+        marker = head[1]
+        if head[0] != 0xFF or marker in [0x00, 0xFF]:
+            if head[0] != 0xFF:
+                raise ValueError(f"Error: expect 0xffXX at offset {pos} but found {head[:1].hex()}")
             raise ValueError(f"Error parsing ended up in data not a segment beginning")
         if marker == 0xD9: #EOI
-                return segments
-        # no length field 
+            segments.append({'type': 'EOI', 'marker': marker, 'pos': pos, 'length': 2})
+            break
+        # no length field
         if marker == 0x01 or marker in range(0xD0, 0xD9):
             pos += 2
-        else:
-            #has length field  
-            length = struct.unpack('>H', jpg[pos + 2:pos + 4])[0]
-            length += 2 # the marker
-            # APP0
-            if marker == 0xE0:
-                segments['APP0'] = {'type': 'APP0', 'pos': pos, 'length': length}
-                pos += length
-            # APP1
-            elif marker == 0xE1:
-                segments['APP1']={'type': 'APP1', 'pos': pos, 'length': length}
-                pos += length
-            # SOS = img data, after this nothing of interest follow anyway so just quit
-            #https://en.wikipedia.org/wiki/JPEG_File_Interchange_Format#File_format_structure
-            elif marker == 0xDA:
-                segments['SOS']={'type': 'SOS', 'pos': pos, 'length': length}  
-                return segments  # quit
-            # other but with dynamic 
-            else:
-                pos += length 
+            continue
+        if len(head) < 4:
+            raise ValueError(f"Error: file ends in the segment at offset {pos}")
+        length = struct.unpack('>H', head[2:4])[0] + 2
+        segments.append({'type': _marker_name(marker), 'marker': marker, 'pos': pos, 'length': length})
+        pos += length
+        if marker == 0xDA: # image data follows, nothing of interest for the header
+            break
+    f.seek(start)
+    return segments
+
+def get_jpg_index(jpg, key=None):
+    """Memoized :func:`index_jpg_segments`, key defaults to the sha256 of jpg."""
+    if key is None:
+        key = hashlib.sha256(jpg).digest()
+    segments = _index_cache.get(key)
+    if segments is None:
+        segments = index_jpg_segments(jpg)
+        _index_cache.put(key, segments)
+    return segments
+
+def parse_jpg_segments(jpg):
+    """Return dict of {name: {pos, length}} for APP0/APP1/SOS in front of the image data (from the cached index)."""
+    segments = {}
+    for segment in get_jpg_index(jpg):
+        if segment['type'] in ('APP0', 'APP1'):
+            segments[segment['type']] = segment
+        # SOS = img data, after this nothing of interest follow anyway so just quit
+        elif segment['type'] == 'SOS':
+            segments['SOS'] = segment
+            break
     return segments
 
 def inject_segment(old_jpg, segment, segment_name, offset):
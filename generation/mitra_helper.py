@@ -2,8 +2,11 @@
 
 import subprocess
 import hashlib
+import os
+import tempfile
 from pathlib import Path
-from .generation import Result, GenStatus, PolyglotKind
+from .cache import SampleStore
+from .generation import Result, GenStatus, PolyglotKind, get_sample_store
 
 MITRA_PATH_DEFAULT = Path.home() / "tools" / "mitra" / "mitra.py"
 
@@ -13,54 +16,49 @@ def sha256(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
 
 
-def run_mitra(overt_path: Path, covert_path: Path, output_path: Path, covert_format: str, overt_format: str, mitra_path: Path | None = None) -> Result:
+def run_mitra(overt_path: Path, covert_path: Path, output_path: Path, covert_format: str, overt_format: str, mitra_path: Path | None = None,
+              store: SampleStore | None = None) -> Result:
     """Run external Mitra tool, select stack polyglot if multiple outputs, return Result."""
     if mitra_path is None:
         mitra_path = MITRA_PATH_DEFAULT
-    overt_data = overt_path.read_bytes()
-    covert_data = covert_path.read_bytes()
+    if store is None:
+        store = get_sample_store()
+    # mitra reads the files itself, we only need the hashes
+    overt_hash = store.sha256(overt_path)
+    covert_hash = store.sha256(covert_path)
     status = GenStatus.SUCCESS
     error = None
     out_hash = None
+    out_size = None
 
     try:
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        # need all files before to see what it generated
-        output_dir = output_path.parent
-        files_before = set(output_dir.glob("*"))
-        # mitra.py overt covert -f -o output_dir
-        # -f force with any format
-        result = subprocess.run( #need use absolute path for this!
-            ["python3", str(mitra_path), str(overt_path.absolute()), str(covert_path.absolute()), "-f", "-o", str(output_dir.absolute())],
-            cwd=mitra_path.parent,
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-        if result.returncode != 0:
-            raise Exception(f"Mitra gen failed: {result.stderr.strip()}")
-        files_after = set(output_dir.glob("*"))
-        new_files = list(files_after - files_before)
-        if not new_files:
-            raise Exception("No output file created by Mitra")
-        # mitra gen multiple files we need to chosoe one and rename to our structure of naming
-        if len(new_files) > 1:
+        # every run gets its own scratch dir so whatever appears there is ours and runs can go in parallel
+        # (created next to the output so the final rename stays on one filesystem = atomic)
+        with tempfile.TemporaryDirectory(prefix=".mitra-", dir=output_path.parent) as scratch:
+            scratch_dir = Path(scratch)
+            # mitra.py overt covert -f -o output_dir
+            # -f force with any format
+            result = subprocess.run( #need use absolute path for this!
+                ["python3", str(mitra_path), str(overt_path.absolute()), str(covert_path.absolute()), "-f", "-o", str(scratch_dir.absolute())],
+                cwd=mitra_path.parent,
+                capture_output=True,
+                text=True,
+                timeout=30
+            )
+            if result.returncode != 0:
+                raise Exception(f"Mitra gen failed: {result.stderr.strip()}")
+            new_files = sorted(scratch_dir.iterdir())
+            if not new_files:
+                raise Exception("No output file created by Mitra")
+            # mitra gen multiple files we need to chosoe one and rename to our structure of naming
             # S( mean its stack polyglot) prefer this due to koch et al say stack is most used
             stack = [f for f in new_files if f.name.startswith('S(')]
-            if stack:
-                actual_output = stack[0]
-            else:
-                #use some polyglot
-                actual_output = new_files[0]
-
-            #del all files except the we chose
-            for f in new_files:
-                if f != actual_output:
-                    f.unlink()
-        else:
-            actual_output = new_files[0]
-        actual_output.rename(output_path)
+            actual_output = stack[0] if stack else new_files[0]
+            # rest is removed together with the scratch dir
+            os.replace(actual_output, output_path)
         out_hash = sha256(output_path.read_bytes())
+        out_size = output_path.stat().st_size
     except Exception as e:
 
         status = GenStatus.ERROR
@@ -73,10 +71,11 @@ def run_mitra(overt_path: Path, covert_path: Path, output_path: Path, covert_for
             overt_format=overt_format,
             covert_format=covert_format,
             overt_path=str(overt_path),
-            overt_hash=sha256(overt_data),
+            overt_hash=overt_hash,
             covert_path=str(covert_path),
-            covert_hash=sha256(covert_data),
+            covert_hash=covert_hash,
             output_path=str(output_path),
             output_hash=out_hash,
-            error=error
+            error=error,
+            output_size=out_size
         )
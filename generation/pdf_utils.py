@@ -2,20 +2,28 @@
 
 import re
 import sys
+import zlib
 
 
-def find_highest_obj_ID(PDF):
+_OBJ_HEADER = re.compile(rb'(\d+)[ \t\n]*(\d+)[ \t\n]*obj')
+_STARTXREF_VALUE = re.compile(rb'startxref[ \t\r\n]*(\d+)')
+_SIZE = re.compile(rb'/Size[ \t\r\n]*(\d+)')
+
+def index_objects(PDF):
+    """Map each object ID to the byte offset of its 'N G obj' header in a single scan.
+
+    If an object is defined more than once (incremental updates) the last definition wins.
+    """
+    offsets = {}
+    for match in _OBJ_HEADER.finditer(PDF):
+        offsets[int(match.group(1))] = match.start()
+    return offsets
+
+def find_highest_obj_ID(PDF, offsets=None):
     """Find the highest object ID number in a PDF."""
-    #Copied from rimser thesis raw_pdf.py
-    splitPDF = re.findall( b'(\d+[ \t]*\d+[ \t]*obj)', PDF) # split PDF into objects, modified so it match tab too
-    max_num = -1
-    for split in splitPDF:
-        numbers = re.search(b'[0-9]*', split).group()
-        if numbers:
-            num = int(numbers.decode())
-            if num > max_num:
-                max_num = num
-    return max_num
+    if offsets is None:
+        offsets = index_objects(PDF)
+    return max(offsets, default=-1)
 
 def find_byte_offset(PDF, content):
     """Find the byte offset of content within a PDF."""
@@ -23,25 +31,18 @@ def find_byte_offset(PDF, content):
     offset = len(b''.join(search))
     return offset
 
-def create_xref(PDF):
-    """Create a new xref table for the PDF."""
-    xref = b'\nxref\n'
-    xref += b'0 '
-    xref += str(find_highest_obj_ID(PDF) + 1).encode() + b'\n' # fixed this to correct format and size (size is index+1 if start from 0 and reversed order)
-    xref += b'0000000000 65535 f\n'
-    objDict = {}
-    for objectM in re.findall(b'\d+[ \t\n]*\d+[ \t\n]*obj', PDF):
-        objectID = int(re.findall(b'\d+[ \t\n]*', objectM)[0].strip())
-        objDict[objectID] = str(find_byte_offset(PDF, objectM)).rjust(10, '0').encode() +b' 00000 n\n'
-    sortedList = sorted(objDict.items())
-    for key, value in sortedList:
-        xref += value
+def create_xref(PDF, offsets=None):
+    """Create a new xref table for the PDF (offsets from :func:`index_objects` can be passed in).
 
-    return xref
+    Object numbers need not be contiguous, every run of consecutive numbers gets its own subsection.
+    """
+    if offsets is None:
+        offsets = index_objects(PDF)
+    return b'\n' + create_xref_section({objectID: (offset, 0) for objectID, offset in offsets.items()})
 
-def create_trailer(PDF, root_ref=None):
+def create_trailer(PDF, root_ref=None, offsets=None):
     """Create a new trailer section for the PDF."""
-    object_count = find_highest_obj_ID(PDF) - 1
+    object_count = find_highest_obj_ID(PDF, offsets) + 1 # /Size is one above the highest number, like the xref covers
 
     trailer = b'\ntrailer\n'
     trailer += b'<<\n'
@@ -53,22 +54,410 @@ def create_trailer(PDF, root_ref=None):
 
     return trailer
 
+def find_startxref(PDF):
+    """Offset the last startxref points to, None if there is none."""
+    last = PDF.rfind(b'startxref') # rfind instead of in/slicing from there also works on an mmap
+    match = _STARTXREF_VALUE.match(PDF, last) if last != -1 else None
+    return int(match.group(1)) if match else None
+
+def last_trailer(PDF):
+    """Bytes of the trailer dict (or xref stream dict) the last startxref points to, None if not found."""
+    prev = find_startxref(PDF)
+    if prev is None or prev >= len(PDF):
+        return None
+    start = PDF.find(b'trailer', prev) if PDF[prev:prev+4] == b'xref' else prev # else an xref stream object
+    if start == -1:
+        return None
+    dict_start = PDF.find(b'<<', start)
+    dict_end = parseDictSpan(PDF, dict_start) if dict_start != -1 else None
+    if dict_end is None:
+        return None
+    return bytes(PDF[dict_start:dict_end])
+
+def trailer_size(PDF):
+    """/Size of the last trailer (see :func:`last_trailer`), None if not found.
+
+    Unlike the highest 'N G obj' header it also counts objects compressed in object streams.
+    """
+    trailer = last_trailer(PDF)
+    match = _SIZE.search(trailer) if trailer is not None else None
+    return int(match.group(1)) if match else None
+
+# besides /Size, /Root and /Prev an update trailer has to repeat these (ISO 32000 7.5.6)
+UPDATE_TRAILER_KEYS = (b'/Encrypt', b'/ID', b'/Info')
+
+def trailer_entries(PDF, keys=UPDATE_TRAILER_KEYS):
+    """Raw b'/Key value' of the top level entries in keys of the last trailer, in trailer order."""
+    trailer = last_trailer(PDF)
+    if trailer is None:
+        return []
+    entries = []
+    pos = 2 # after <<
+    while True:
+        pos = _WHITESPACE.match(trailer, pos).end()
+        name = _NAME.match(trailer, pos)
+        if name is None: # >> or something we do not understand
+            return entries
+        value_start = _WHITESPACE.match(trailer, name.end()).end()
+        value_end = _valueEnd(trailer, value_start)
+        if value_end is None:
+            return entries
+        if name.group() in keys:
+            entries.append(name.group() + b' ' + trailer[value_start:value_end])
+        pos = value_end
+
+def object_generation(obj):
+    """Generation number from the 'N G obj' header at the start of obj."""
+    return int(_OBJ_HEADER.match(obj).group(2))
+
+def create_xref_section(entries):
+    """Create an xref section for {obj ID: (offset, generation)}, one subsection per consecutive ID run."""
+    xref = b'xref\n'
+    xref += b'0 1\n0000000000 65535 f \n' # head of the free list, readers expect the section to start at 0
+    ids = sorted(entries)
+    run_start = 0
+    for i in range(1, len(ids) + 1):
+        if i == len(ids) or ids[i] != ids[i-1] + 1:
+            xref += f'{ids[run_start]} {i - run_start}\n'.encode()
+            for objectID in ids[run_start:i]:
+                offset, generation = entries[objectID]
+                xref += f'{offset:010d} {generation:05d} n \n'.encode() # entries are exactly 20 bytes
+            run_start = i
+    return xref
+
+def create_update_trailer(size, root_ref, prev, entries=()):
+    """Create the trailer of an incremental update, /Prev links to the previous xref.
+
+    entries are raw b'/Key value' repeated from the previous trailer (see :func:`trailer_entries`).
+    """
+    trailer = b'trailer\n'
+    trailer += b'<<\n'
+    trailer += b'  /Size ' + str(size).encode('ascii') + b'\n'
+    trailer += b'  ' + root_ref + b'\n'
+    for entry in entries:
+        trailer += b'  ' + entry + b'\n'
+    trailer += b'  /Prev ' + str(prev).encode('ascii') + b'\n'
+    trailer += b'>>\n'
+    return trailer
+
+
+# everything that matters for dict nesting, single < is a hex string, stream keyword must end its line
+_DICT_TOKEN = re.compile(rb'<<|>>|[(<%]|\bstream(?=\r?\n)')
+_STRING_TOKEN = re.compile(rb'\\.|[()]', re.S)
+_EOL = re.compile(rb'[\r\n]')
+
+_WHITESPACE = re.compile(rb'[ \t\r\n\f\x00]*')
+_NAME = re.compile(rb'/[^ \t\r\n\f\x00/<>\[\]()%{}]+')
+_REF = re.compile(rb'\d+[ \t\r\n]+\d+[ \t\r\n]+R\b')
+_TOKEN_END = re.compile(rb'[ \t\r\n\f\x00/<>\[\]()%{}]')
+_ARRAY_TOKEN = re.compile(rb'<<|[\[\](<]')
+
+def _valueEnd(pdf, pos):
+    """Position after the object (dict, array, string, reference, name, number...) starting at pos, None if unterminated."""
+    if pdf.startswith(b'<<', pos):
+        return parseDictSpan(pdf, pos)
+    if pdf.startswith(b'(', pos):
+        return _skipString(pdf, pos)
+    if pdf.startswith(b'<', pos):
+        end = pdf.find(b'>', pos)
+        return end + 1 if end != -1 else None
+    if pdf.startswith(b'[', pos):
+        depth = 0
+        i = pos
+        while (match := _ARRAY_TOKEN.search(pdf, i)) is not None:
+            token = match.group()
+            if token == b'[':
+                depth += 1
+                i = match.end()
+            elif token == b']':
+                depth -= 1
+                i = match.end()
+                if depth == 0:
+                    return i
+            else:
+                i = _valueEnd(pdf, match.start())
+            if i is None:
+                return None
+        return None
+    ref = _REF.match(pdf, pos)
+    if ref:
+        return ref.end()
+    end = _TOKEN_END.search(pdf, pos + 1)
+    return end.start() if end else len(pdf)
+
+def _skipString(pdf, pos):
+    """Position after the literal string whose ( is at pos (nested parens and escapes), None if unterminated."""
+    depth = 0
+    for match in _STRING_TOKEN.finditer(pdf, pos):
+        token = match.group()
+        if token == b'(':
+            depth += 1
+        elif token == b')':
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return None
+
+def iterDictTokens(pdf, start):
+    """Yield (pos, end, +1/-1) for every << and >> from start on.
+
+    Jumps over literal and hex strings, comments and stream bodies with
+    find/regex so their content cannot unbalance the count.
+    """
+    i = start
+    while True:
+        match = _DICT_TOKEN.search(pdf, i)
+        if match is None:
+            return
+        token = match.group()
+        if token == b'<<':
+            yield match.start(), match.end(), 1
+            i = match.end()
+        elif token == b'>>':
+            yield match.start(), match.end(), -1
+            i = match.end()
+        elif token == b'(':
+            i = _skipString(pdf, match.start())
+        elif token == b'<':
+            i = pdf.find(b'>', match.end())
+            i = i + 1 if i != -1 else None
+        elif token == b'%':
+            eol = _EOL.search(pdf, match.end())
+            i = eol.end() if eol else None
+        else: # stream
+            i = pdf.find(b'endstream', match.end())
+            i = i + len(b'endstream') if i != -1 else None
+        if i is None: # unterminated string/comment/stream
+            return
 
 def parseDictSpan(pdf, start):
     """Find end position of PDF dict starting at 'start' by counting << >> pairs."""
     count = 0
-    i = start
-    while i < len(pdf):
-        curr = pdf[i:i+2]
-        if curr == b"<<":
-            count += 1
-            i += 2
-        elif curr == b">>":
-            count -= 1
-            i+=2
-            if count == 0:
-                return i #reached end
-        else:
-            i += 1
+    for _, end, delta in iterDictTokens(pdf, start):
+        count += delta
+        if count == 0:
+            return end #reached end
     print("dict parsing fail reached end", file=sys.stderr)
-    return None
\ No newline at end of file
+    return None
+
+_OBJSTM_TYPE = re.compile(rb'/Type[ \t\r\n]*/ObjStm\b')
+_OBJSTM_N = re.compile(rb'/N[ \t\r\n]+(\d+)')
+_OBJSTM_FIRST = re.compile(rb'/First[ \t\r\n]+(\d+)')
+_FILTER = re.compile(rb'/Filter[ \t\r\n]*\[?[ \t\r\n]*/(\w+)')
+_STREAM_START = re.compile(rb'stream\r?\n')
+
+def read_object_stream(obj):
+    """Objects compressed in the object stream obj as {num: object body}.
+
+    Only unfiltered and plain /FlateDecode streams are read (no predictors),
+    an empty dict is returned for anything else.
+    """
+    dict_start = obj.find(b'<<')
+    dict_end = parseDictSpan(obj, dict_start) if dict_start != -1 else None
+    if dict_end is None:
+        return {}
+    stream_dict = obj[dict_start:dict_end]
+    n = _OBJSTM_N.search(stream_dict)
+    first = _OBJSTM_FIRST.search(stream_dict)
+    filter_match = _FILTER.search(stream_dict)
+    if n is None or first is None or b'/DecodeParms' in stream_dict:
+        return {}
+    start = _STREAM_START.match(obj, obj.find(b'stream', dict_end))
+    end = obj.rfind(b'endstream')
+    if start is None or end < start.end():
+        return {}
+    data = obj[start.end():end]
+    try:
+        if filter_match is not None:
+            if filter_match.group(1) != b'FlateDecode':
+                return {}
+            data = zlib.decompressobj().decompress(data) # ignores the EOL before endstream
+        header = data[:int(first.group(1))].split()
+        pairs = [(int(header[i]), int(header[i+1])) for i in range(0, 2 * int(n.group(1)), 2)]
+    except (zlib.error, ValueError, IndexError):
+        return {}
+    first = int(first.group(1))
+    objects = {}
+    for i, (num, offset) in enumerate(pairs):
+        end = first + pairs[i+1][1] if i + 1 < len(pairs) else len(data)
+        objects[num] = data[first + offset:end].strip()
+    return objects
+
+_ROOT_REF = re.compile(rb'/Root[ \t\n]*\d+[ \t\n]*\d+[ \t\n]*R')
+## search for /Type{0..*(space,tabetc)}/Page{\s or / or >> allwed} so it cant match Pages or sth
+_PAGE_TYPE = re.compile(rb'/Type\s*/Page(\s|/|>>)')
+
+def isPageObject(obj):
+    """Check if the top level dict of an object has /Type /Page."""
+    dict_start = obj.find(b'<<')
+    if dict_start == -1:
+        return False
+    #we have to parse both header and footer
+    #it seems like in PDF /Type/Page its either in beginning or end
+    depth = 0
+    begin_nested = None # first nested dict start
+    end_nested = None # last nested dict end (we WANT to skip same-level nested)
+    dict_end = None
+    for pos, end, delta in iterDictTokens(obj, dict_start):
+        depth += delta
+        if delta > 0 and depth == 2 and begin_nested is None:
+            begin_nested = pos
+        elif delta < 0 and depth == 1:
+            end_nested = pos
+        elif depth == 0:
+            dict_end = end
+            break
+    if dict_end is None:
+        return False
+    # get header and footer with pos we parsed
+    if begin_nested is not None:
+        header = obj[dict_start:begin_nested]
+    else:
+        #theres no nested
+        header = obj[dict_start:dict_end]
+    if end_nested is not None: #we find a nested dict end
+        footer = obj[end_nested+2:dict_end]
+    else:
+        #theres no nested dict
+        footer = b''
+    return bool(_PAGE_TYPE.search(header) or _PAGE_TYPE.search(footer))
+
+class PDFIndex:
+    """Object index of a PDF built in one scan over the document.
+
+    Maps object numbers to the byte span of their ``N G obj ... endobj``
+    (last definition wins), lists page objects in file order and keeps the
+    first /Root reference, so callers never have to rescan the whole file.
+    Objects compressed in object streams are read on demand and returned by
+    :meth:`get` with a synthetic ``N 0 obj`` header, they are not in ``spans``
+    as they have no bytes of their own in the file.
+    """
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self.spans = {}
+        pos = 0
+        while (match := _OBJ_HEADER.search(pdf, pos)) is not None:
+            end = pdf.find(b'endobj', match.end())
+            if end == -1:
+                break
+            pos = end + len(b'endobj')
+            self.spans[int(match.group(1))] = (match.start(), pos)
+        self._pages = None
+        self._compressed = None
+        root = _ROOT_REF.search(pdf)
+        self.root_ref = root.group() if root else None
+
+    @property
+    def compressed(self):
+        """{num: object body} of objects in object streams that are not also defined at top level."""
+        if self._compressed is None:
+            self._compressed = {}
+            if _OBJSTM_TYPE.search(self.pdf) is not None: # most files have none, skip the per object check
+                for num, (start, end) in sorted(self.spans.items(), key=lambda item: item[1]):
+                    if self.pdf.find(b'/ObjStm', start, end) != -1 and _OBJSTM_TYPE.search(self.pdf, start, end):
+                        for inner, body in read_object_stream(self.pdf[start:end]).items():
+                            if inner not in self.spans:
+                                self._compressed.setdefault(inner, body) # first stream wins, like the xref order
+        return self._compressed
+
+    def iter_pages(self):
+        """Yield page object numbers in file order (compressed ones last), checking objects only as far as needed."""
+        for num, (start, end) in sorted(self.spans.items(), key=lambda item: item[1]):
+            # cheap prefilter, only objects mentioning /Type can be pages
+            if self.pdf.find(b'/Type', start, end) != -1 and isPageObject(self.pdf[start:end]):
+                yield num
+        for num, body in self.compressed.items():
+            if b'/Type' in body and isPageObject(body):
+                yield num
+
+    @property
+    def pages(self):
+        if self._pages is None:
+            self._pages = list(self.iter_pages())
+        return self._pages
+
+    def get(self, num):
+        """Bytes of object num (header to endobj) or None if it does not exist."""
+        span = self.spans.get(num)
+        if span is None:
+            body = self.compressed.get(num)
+            return None if body is None else f"{num} 0 obj\n".encode() + body + b"\nendobj"
+        return self.pdf[span[0]:span[1]]
+
+    def highest_id(self):
+        return max(max(self.spans, default=-1), max(self.compressed, default=-1))
+
+    def first_page(self):
+        if self._pages is not None:
+            return self._pages[0] if self._pages else None
+        return next(self.iter_pages(), None)
+
+    def apply(self, edits):
+        """Return the document with objects replaced by edits ({num: new object bytes}) in a single join."""
+        parts = []
+        pos = 0
+        for start, end, new_obj in sorted((*self.spans[num], new_obj) for num, new_obj in edits.items()):
+            parts.append(self.pdf[pos:start])
+            parts.append(new_obj)
+            pos = end
+        parts.append(self.pdf[pos:])
+        return b''.join(parts)
+
+
+class EditedPDF:
+    """View of an indexed document with edits ({num: new object bytes}) applied, without joining it.
+
+    Unedited parts are read from the original (bytes or an mmap) only when
+    written out, so a huge host never has to be copied in memory. Matches
+    cannot cross from an edited object into the original as every object
+    starts with its 'N G obj' header and ends with 'endobj'.
+    """
+
+    def __init__(self, index, edits):
+        self.pieces = [] # (buffer, start, end) in document order
+        pos = 0
+        for start, end, new_obj in sorted((*index.spans[num], new_obj) for num, new_obj in edits.items()):
+            self.pieces.append((index.pdf, pos, start))
+            self.pieces.append((new_obj, 0, len(new_obj)))
+            pos = end
+        self.pieces.append((index.pdf, pos, len(index.pdf)))
+        self.length = sum(end - start for _, start, end in self.pieces)
+
+    def __len__(self):
+        return self.length
+
+    def _located(self):
+        """Yield (document offset, buffer, start, end) per piece."""
+        offset = 0
+        for buf, start, end in self.pieces:
+            yield offset, buf, start, end
+            offset += end - start
+
+    def search(self, pattern):
+        """Document offset of the first match of the compiled pattern, None if there is none."""
+        for offset, buf, start, end in self._located():
+            match = pattern.search(buf, start, end)
+            if match:
+                return offset + match.start() - start
+        return None
+
+    def index_objects(self, stop=None):
+        """Like :func:`index_objects` on the document cut at stop (default: whole document)."""
+        stop = self.length if stop is None else stop
+        offsets = {}
+        for offset, buf, start, end in self._located():
+            if offset >= stop:
+                break
+            for match in _OBJ_HEADER.finditer(buf, start, min(end, start + stop - offset)):
+                offsets[int(match.group(1))] = offset + match.start() - start
+        return offsets
+
+    def write(self, out, begin=0, stop=None, chunk_size=1024 * 1024):
+        """Write the document bytes [begin:stop] to the file object out in chunks of at most chunk_size."""
+        stop = self.length if stop is None else stop
+        for offset, buf, start, end in self._located():
+            lo = max(begin, offset) - offset + start
+            hi = min(stop, offset + end - start) - offset + start
+            for pos in range(lo, hi, chunk_size):
+                out.write(buf[pos:min(pos + chunk_size, hi)])
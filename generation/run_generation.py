@@ -6,16 +6,18 @@ for detection evaluation. Also includes Mitra tool integration as baseline.
 """
 
 import argparse
+import importlib
+import random
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
-from dataclasses import dataclass
-from .generation import PolyDataset, PolyglotKind, launch
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Iterable, Iterator
+from .cache import DEFAULT_SAMPLE_BUDGET
+from .generation import GenStatus, PolyDataset, PolyDatasetWriter, PolyglotKind, Result, configure_caches, file_sha256, get_sample_store, jsonl_to_json, launch_many, reject
+from .capacity import CapacityIndex
 from .baseGenerator import BaseGenerator
-from .BMPPixelGenerator import BMPPixelGenerator
-from .PNGPixelGenerator import PNGPixelGenerator
-from .PNGICCGenerator import PNGICCGenerator
-from .JPEGAPP0Generator import JPEGAPP0Generator
-from .JPEGPixelGenerator import JPEGPixelGenerator
-from .PDFInvisTextGenerator import PDFInvisTextGenerator
 from .mitra_helper import run_mitra, MITRA_PATH_DEFAULT
 
 BASE_PATH = Path(__file__).parent.parent
@@ -23,77 +25,371 @@ SAMPLES_DIR = BASE_PATH / "samples"
 OUTPUT_DIR = BASE_PATH / "generated"
 
 COVERT_ALLOWED = ["PHP", "JS", "RAR"]
+BATCH_SIZE = 64 # max coverts per generate_many call
 MITRA_OVERT = ["BMP", "PNG", "JPEG", "PDF"]
 
 
 @dataclass
 class GeneratorConfig:
-    """Configuration pairing a generator with its polyglot kind."""
-    generator: BaseGenerator
+    """Configuration pairing a generator class (by name, imported on first use) with its polyglot kind.
+
+    ``kwargs`` go to the constructor, so one class can be registered several
+    times with different settings, each variant then needs its own ``label``.
+    """
+    name: str # class name, also the module name unless module is given
     kind: PolyglotKind
+    module: str | None = None
+    kwargs: dict = field(default_factory=dict)
+    label: str | None = None # name for --generators, defaults to name
     #allowed_covert: List[str] TODO implement if wanted to test maybe zip or sth that dont work i.e need blacklist/whitelist approach
 
+    @property
+    def key(self) -> str:
+        return self.label or self.name
+
+    @cached_property
+    def generator(self) -> BaseGenerator:
+        module = importlib.import_module(f".{self.module or self.name}", __package__)
+        return getattr(module, self.name)(**self.kwargs)
+
 #PUT HERE IF YOU WANT TO ADD A NEW GENERATOR
 ALL_GENERATORS: dict[str, list[GeneratorConfig]] = {
     "BMP": [
-        GeneratorConfig(BMPPixelGenerator(), PolyglotKind.SEMANTIC),
+        GeneratorConfig("BMPPixelGenerator", PolyglotKind.SEMANTIC),
     ],
     "PNG": [
-        GeneratorConfig(PNGPixelGenerator(), PolyglotKind.SEMANTIC),
-        GeneratorConfig(PNGICCGenerator(), PolyglotKind.PARASITE),
+        GeneratorConfig("PNGPixelGenerator", PolyglotKind.SEMANTIC),
+        GeneratorConfig("PNGPixelGenerator", PolyglotKind.SEMANTIC, kwargs={"mode": "mixed"},
+                        label="PNGPixelGeneratorMixed"),
+        GeneratorConfig("PNGICCGenerator", PolyglotKind.PARASITE),
     ],
     "JPEG": [
-        GeneratorConfig(JPEGPixelGenerator(), PolyglotKind.SEMANTIC),
-        GeneratorConfig(JPEGAPP0Generator(), PolyglotKind.PARASITE)
+        GeneratorConfig("JPEGPixelGenerator", PolyglotKind.SEMANTIC),
+        GeneratorConfig("JPEGAPP0Generator", PolyglotKind.PARASITE)
     ],
     "PDF": [
-        GeneratorConfig(PDFInvisTextGenerator(), PolyglotKind.SEMANTIC),
+        GeneratorConfig("PDFInvisTextGenerator", PolyglotKind.SEMANTIC),
+        GeneratorConfig("PDFInvisTextGenerator", PolyglotKind.SEMANTIC, kwargs={"incremental": True},
+                        label="PDFInvisTextGeneratorIncremental"),
     ],
 }
+MITRA = "Mitra"
+
+def generator_names() -> list[str]:
+    """Names accepted by --generators, Mitra included."""
+    return [cfg.key for cfgs in ALL_GENERATORS.values() for cfg in cfgs] + [MITRA]
 
 def get_files(fmt: str, limit: int | None = None) -> list[Path]:
-    """Get sample files for a given format from the samples directory."""
+    """Get sample files for a given format from the samples directory, sorted so plans (and samples) do not depend on the filesystem."""
     files = []
     fmt = fmt.lower()
     fmt_dir = SAMPLES_DIR / fmt
     exts = ["*.jpg", "*.jpeg"] if fmt == "jpeg" else [f"*.{fmt}"] #ugly but simple enough
     for ext in exts:
         files.extend(fmt_dir.glob(ext))
+    files.sort()
     return files[:limit] if limit else files
 
-def run(limit: int | None = None, mitra_path: Path | None = None) -> PolyDataset:
-    """Run all generators on sample files and return the complete dataset."""
-    polyDataset = PolyDataset.create()
-    # run generators
+@dataclass
+class Task:
+    """Single generation job: one generator (or Mitra if cfg is None) on one overt/covert pair."""
+    cfg: GeneratorConfig | None
+    overt: Path
+    covert: Path
+    overt_format: str
+    covert_format: str
+    out_path: Path
+    mitra_path: Path | None = None
+
+    @property
+    def generator_name(self) -> str:
+        return self.cfg.generator._get_name() if self.cfg else MITRA
+
+    @property
+    def generator_version(self) -> str | None:
+        return self.cfg.generator._get_version() if self.cfg else None
+
+
+def select_pairs(n_overt: int, n_covert: int, sample: int | None = None, cap: int | None = None,
+                 rng: random.Random | None = None) -> Iterator[tuple[int, int]]:
+    """Lazily yield (overt index, covert index) pairs of one cell in overt-major order.
+
+    ``sample`` draws that many pairs at random from ``rng`` (without building
+    the N x M product), ``cap`` keeps at most that many pairs spread evenly over
+    the product so every host contributes. Both together sample at most ``cap``.
+    """
+    total = n_overt * n_covert
+    count = total
+    if cap is not None:
+        count = min(count, cap)
+    if sample is not None:
+        count = min(count, sample)
+        picks = sorted((rng or random.Random()).sample(range(total), count))
+    elif count < total:
+        picks = (i * total // count for i in range(count)) # stratified
+    else:
+        picks = range(total)
+    for pick in picks:
+        yield divmod(pick, n_covert)
+
+def iter_tasks(limit: int | None = None, mitra_path: Path | None = None, generators: set[str] | None = None,
+               sample: int | None = None, cap: int | None = None, seed: int = 0) -> Iterator[Task]:
+    """Lazily plan the overt x covert x generator tasks (Mitra baseline last) in a fixed order.
+
+    ``generators`` restricts the run to these names (see :func:`generator_names`),
+    only their modules get imported. ``sample`` and ``cap`` limit every
+    (generator, overt format, covert format) cell, see :func:`select_pairs`.
+    Each cell draws from its own generator seeded with ``seed`` and the cell
+    name, so a cell gets the same pairs whatever else is selected.
+    """
+    files = {}
+    def files_of(fmt):
+        if fmt not in files:
+            files[fmt] = get_files(fmt, limit)
+        return files[fmt]
+
+    def cell(name, overt_fmt, covert_fmt):
+        """(overt, covert, output file name) of the selected pairs of one cell."""
+        overts, coverts = files_of(overt_fmt), files_of(covert_fmt)
+        rng = random.Random(f"{seed}:{name}:{overt_fmt}:{covert_fmt}")
+        for i, j in select_pairs(len(overts), len(coverts), sample, cap, rng):
+            overt, covert = overts[i], coverts[j]
+            #INCLUDE COVERT FMT ELSE  HARD TO FIND BUG COLLISION ON FIELNAME
+            yield overt, covert, f"{overt.stem}_{covert.stem}_{covert_fmt}.{overt_fmt.lower()}"
+
     for overt_fmt, cfgs in ALL_GENERATORS.items():
-        overts = get_files(overt_fmt, limit)
-        for covert_fmt in COVERT_ALLOWED:
-            coverts = get_files(covert_fmt, limit)
+        cfgs = [cfg for cfg in cfgs if generators is None or cfg.key in generators]
+        for covert_fmt in COVERT_ALLOWED if cfgs else []:
             for cfg in cfgs:
-                curr_gen = cfg.generator
-                print("Running generator: " + curr_gen._get_name() + " on overt: " + overt_fmt + ", covert: " + covert_fmt)
-                for overt in overts:
-                    for covert in coverts:
-                        out_path = OUTPUT_DIR / curr_gen._get_name() / f"{overt.stem}_{covert.stem}_{covert_fmt}.{overt_fmt.lower()}"
-                        res = launch(curr_gen, overt, covert, out_path, cfg.kind, covert_fmt.upper())
-                        polyDataset.add(res)
-                        if res.error:
-                            print("Error: " + res.error)
-    #run mitra for baseline
-    print("\nRunning Mitra generator...")
+                for overt, covert, out_name in cell(cfg.key, overt_fmt, covert_fmt):
+                    out_path = OUTPUT_DIR / cfg.generator._get_name() / out_name
+                    yield Task(cfg, overt, covert, overt_fmt.upper(), covert_fmt.upper(), out_path)
+    # mitra for baseline
+    if generators is not None and MITRA not in generators:
+        return
     for overt_fmt in MITRA_OVERT:
-        overts = get_files(overt_fmt, limit)
         for covert_fmt in COVERT_ALLOWED:
-            coverts = get_files(covert_fmt, limit)
-            for overt in overts:
-                print(f"Running Mitra on overt: {overt_fmt}, covert: {covert_fmt}")
-                for covert in coverts:
-                    #INCLUDE COVERT FMT ELSE  HARD TO FIND BUG COLLISION ON FIELNAME
-                    out_path = OUTPUT_DIR / "Mitra" / f"{overt.stem}_{covert.stem}_{covert_fmt}.{overt_fmt.lower()}"
-                    res = run_mitra(overt, covert, out_path, covert_fmt.upper(), overt_fmt.upper(), mitra_path)
-                    polyDataset.add(res)
-                    if res.error:
-                        print("Error: " + res.error)
+            for overt, covert, out_name in cell(MITRA, overt_fmt, covert_fmt):
+                yield Task(None, overt, covert, overt_fmt.upper(), covert_fmt.upper(), OUTPUT_DIR / MITRA / out_name, mitra_path)
+
+def plan_tasks(limit: int | None = None, mitra_path: Path | None = None, generators: set[str] | None = None,
+               sample: int | None = None, cap: int | None = None, seed: int = 0) -> list[Task]:
+    """All tasks of :func:`iter_tasks` as a list."""
+    return list(iter_tasks(limit, mitra_path, generators, sample, cap, seed))
+
+@dataclass
+class PreviousRun:
+    """Results of an earlier run keyed by output path, and when its run file was written."""
+    results: dict[str, Result]
+    written: float = 0.0 # mtime of the run file
+
+    def get(self, out_path: str) -> Result | None:
+        return self.results.get(out_path)
+
+def _is_reusable(prev: Result | None, generator: str, version: str | None, overt: Path, covert: Path,
+                 written: float = 0.0) -> bool:
+    """Check if a previous result still matches its inputs, generator and output on disk.
+
+    An output of the recorded size that was not modified after the run file
+    was ``written`` still has its recorded hash (same as collect_files in the
+    detection), only other outputs are hashed again.
+    """
+    if prev is None or prev.status != GenStatus.SUCCESS:
+        return False
+    if prev.generator != generator or prev.generator_version != version:
+        return False
+    store = get_sample_store()
+    if prev.overt_hash != store.sha256(overt) or prev.covert_hash != store.sha256(covert):
+        return False
+    out_path = Path(prev.output_path)
+    if not out_path.is_file():
+        return False
+    if prev.output_size is not None:
+        stat = out_path.stat()
+        if stat.st_size != prev.output_size:
+            return False
+        if stat.st_mtime <= written:
+            return True
+    return file_sha256(out_path) == prev.output_hash
+
+def load_previous(*paths: Path) -> PreviousRun:
+    """Load results of an earlier run (first existing path) keyed by output path."""
+    for path in paths:
+        if path.exists():
+            print(f"Reusing unchanged results from {path}")
+            written = path.stat().st_mtime
+            return PreviousRun({res.output_path: res for res in PolyDataset.load(path).polyglots}, written)
+    print("No previous run found, regenerating everything")
+    return PreviousRun({})
+
+def carry_over(previous: PreviousRun, generators: set[str] | None) -> list[Result]:
+    """Previous results of the generators left out by ``generators``, a filtered run keeps them as they are."""
+    if generators is None:
+        return []
+    selected = {cfg.generator._get_name() for cfgs in ALL_GENERATORS.values() for cfg in cfgs if cfg.key in generators}
+    if MITRA in generators:
+        selected.add(MITRA)
+    return [res for res in previous.results.values() if res.generator not in selected]
+
+def triage(tasks: Iterable[Task], previous: PreviousRun, stats: Counter) -> Iterator[tuple[Task, Result | None]]:
+    """Pair every task with its result if it does not have to run, else None.
+
+    Tasks unchanged since the ``previous`` run are taken over, tasks that can
+    never succeed are rejected by the pre-flight check (hosts are scanned once
+    per generator, payloads once, see :class:`CapacityIndex`, Mitra is not
+    checked). Counts go to ``stats``.
+    """
+    index = CapacityIndex(get_sample_store())
+    for task in tasks:
+        stats["planned"] += 1
+        prev = previous.get(str(task.out_path))
+        if _is_reusable(prev, task.generator_name, task.generator_version, task.overt, task.covert, previous.written):
+            stats["unchanged"] += 1
+            yield task, prev
+            continue
+        reason = index.rejection(task.cfg.generator, task.overt, task.covert) if task.cfg is not None else None
+        if reason is not None:
+            stats["rejected"] += 1
+            stats["rejected_bytes"] += task.overt.stat().st_size
+            yield task, reject(task.cfg.generator, task.overt, task.covert, task.out_path, task.cfg.kind, task.covert_format, reason)
+            continue
+        yield task, None
+
+def group_tasks(items: Iterable[tuple[Task, Result | None]], max_size: int = BATCH_SIZE) -> Iterator[list[tuple[Task, Result | None]]]:
+    """Lazily split triaged tasks into batches of consecutive tasks to run with the same generator and overt.
+
+    The host is prepared once per batch. Tasks that already have a result and
+    Mitra tasks always form their own batch.
+    """
+    batch = []
+    for task, res in items:
+        first, last = (batch[0], batch[-1][0]) if batch else (None, None)
+        if (res is None and task.cfg is not None and first is not None and first[1] is None and last.cfg is task.cfg
+                and last.overt == task.overt and len(batch) < max_size):
+            batch.append((task, res))
+            continue
+        if batch:
+            yield batch
+        batch = [(task, res)]
+    if batch:
+        yield batch
+
+def _run_batch(batch: list[Task]) -> list[Result]:
+    """Worker entry point, module level so it can be pickled for the process pool."""
+    first = batch[0]
+    if first.cfg is None:
+        return [run_mitra(task.overt, task.covert, task.out_path, task.covert_format, task.overt_format, task.mitra_path) for task in batch]
+    return launch_many(first.cfg.generator, first.overt, [task.covert for task in batch], [task.out_path for task in batch],
+                       first.cfg.kind, [task.covert_format for task in batch])
+
+def _report(task: Task, res: Result):
+    if res.error and res.status != GenStatus.REJECTED:
+        print(f"Error ({res.generator}: {task.overt.name} + {task.covert.name}): {res.error}")
+
+def execute(items: Iterable[tuple[Task, Result | None]], workers: int = 1, sample_budget: int = DEFAULT_SAMPLE_BUDGET,
+            stats: Counter | None = None) -> Iterator[Result]:
+    """Run triaged tasks (see :func:`triage`) serially or on a process pool and yield all results in task order.
+
+    Tasks sharing a generator and overt are run as one batch (see :func:`group_tasks`).
+    Results are reported as soon as they finish but handed out in the order of
+    ``items`` so run.json stays deterministic independent of scheduling. Items
+    are pulled lazily, at most a few batches per worker are in flight.
+    ``sample_budget`` is split evenly over the workers, each one divides its part
+    between its sample store and the host caches of the generators (see :func:`configure_caches`).
+    If a batch raises or the run is interrupted, the results that already
+    finished are still handed out (out of order) before the error propagates.
+    """
+    stats = stats if stats is not None else Counter()
+    def done(batch, results):
+        for (task, _), res in zip(batch, results):
+            _report(task, res)
+        # progress roughly every 100 tasks
+        if (stats["generated"] + len(results)) // 100 > stats["generated"] // 100:
+            print(f"[{stats['generated'] + len(results)}] generated")
+        stats["generated"] += len(results)
+
+    if workers <= 1:
+        for batch in group_tasks(items):
+            if batch[0][1] is not None:
+                yield batch[0][1]
+                continue
+            results = _run_batch([task for task, _ in batch])
+            done(batch, results)
+            yield from results
+        return
+    max_in_flight = workers * 4
+    with ProcessPoolExecutor(max_workers=workers, initializer=configure_caches, initargs=(sample_budget // workers,)) as pool:
+        pending = {} # future -> (seq, batch)
+        finished = {}
+        next_seq = 0
+
+        def collect(block):
+            nonlocal next_seq
+            if block or len(pending) >= max_in_flight:
+                completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    seq, batch = pending.pop(future)
+                    finished[seq] = future.result()
+                    done(batch, finished[seq])
+            # hand out the finished prefix so order matches the serial run
+            while next_seq in finished:
+                yield from finished.pop(next_seq)
+                next_seq += 1
+
+        try:
+            for seq, batch in enumerate(group_tasks(items)):
+                if batch[0][1] is not None:
+                    finished[seq] = [batch[0][1]]
+                else:
+                    pending[pool.submit(_run_batch, [task for task, _ in batch])] = (seq, batch)
+                yield from collect(block=False)
+            while pending:
+                yield from collect(block=True)
+            yield from collect(block=False)
+        except GeneratorExit:
+            raise
+        except BaseException:
+            # results waiting for an earlier batch would be lost, a streamed run.jsonl keeps them for --incremental
+            pool.shutdown(cancel_futures=True)
+            for future, (seq, batch) in pending.items():
+                if not future.cancelled() and future.exception() is None:
+                    finished[seq] = future.result()
+                    done(batch, finished[seq])
+            for seq in sorted(finished):
+                yield from finished[seq]
+            raise
+
+def run(limit: int | None = None, mitra_path: Path | None = None, workers: int = 1, previous: PreviousRun | None = None,
+        dataset: PolyDataset | PolyDatasetWriter | None = None, sample_budget: int = DEFAULT_SAMPLE_BUDGET,
+        generators: set[str] | None = None, sample: int | None = None, cap: int | None = None, seed: int = 0) -> PolyDataset | PolyDatasetWriter:
+    """Run all generators on sample files and return the complete dataset.
+
+    Tasks are planned lazily (see :func:`iter_tasks`), ``generators`` limits
+    the run to the named generators (default: all and Mitra), ``sample``/``cap``
+    with ``seed`` pick a subset of pairs per cell.
+    If ``previous`` results (see :func:`load_previous`) are given, tasks whose
+    inputs, generator and output are unchanged are taken over instead of rerun,
+    results of generators not in ``generators`` are kept (see :func:`carry_over`).
+    Tasks that can never succeed are recorded as rejected without running (see :func:`triage`).
+    Results are added to ``dataset`` (a new in-memory PolyDataset by default),
+    pass a :class:`PolyDatasetWriter` to stream them to disk instead.
+    """
+    polyDataset = dataset if dataset is not None else PolyDataset.create()
+    previous = previous or PreviousRun({})
+    configure_caches(sample_budget // max(workers, 1))
+    stats = Counter()
+    print(f"Running generation with {workers} worker(s)")
+    for res in carry_over(previous, generators):
+        stats["kept"] += 1
+        polyDataset.add(res)
+    tasks = iter_tasks(limit, mitra_path, generators, sample, cap, seed)
+    for res in execute(triage(tasks, previous, stats), workers, sample_budget, stats):
+        polyDataset.add(res)
+    print(f"{stats['planned']} tasks: {stats['generated']} generated, {stats['unchanged']} unchanged, {stats['rejected']} rejected")
+    if stats["kept"]:
+        print(f"Kept {stats['kept']} previous results of the generators not selected")
+    if stats["rejected"]:
+        print(f"Pre-flight rejections saved processing {stats['rejected_bytes'] / (1024 * 1024):.1f} MB of hosts")
 
     return polyDataset
 
@@ -111,10 +407,73 @@ def main():
         default=None,
         help=f"Path of mitra.py"
     )
+    parser.add_argument(
+        "--workers", "-w",
+        type=int,
+        default=1,
+        help="Number of worker processes for the generators and Mitra (default: 1 = serial)"
+    )
+    parser.add_argument(
+        "--incremental", "-i",
+        action="store_true",
+        help="Reuse unchanged polyglots from the previous run.json instead of regenerating them"
+    )
+    parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="Stream results to run.jsonl as they finish and convert it to run.json at the end"
+    )
+    parser.add_argument(
+        "--sample-cache-mb",
+        type=int,
+        default=DEFAULT_SAMPLE_BUDGET // (1024 * 1024),
+        help="Memory budget in MB for cached sample files and prepared hosts, split over the worker processes"
+    )
+    parser.add_argument(
+        "--generators", "-g",
+        nargs="+",
+        choices=generator_names(),
+        default=None,
+        metavar="NAME",
+        help=f"Only run these generators (default: all), one of {', '.join(generator_names())}"
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=None,
+        help="Randomly pick this many overt/covert pairs per (generator, overt format, covert format) cell"
+    )
+    parser.add_argument(
+        "--cap",
+        type=int,
+        default=None,
+        help="At most this many pairs per cell, spread evenly over the hosts"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed for --sample, the same seed picks the same pairs (default: 0)"
+    )
     args = parser.parse_args()
+    generators = set(args.generators) if args.generators else None
+    sample_budget = args.sample_cache_mb * 1024 * 1024
 
-    dataset = run(limit=args.limit, mitra_path=args.mitra_path)
-    dataset.save(OUTPUT_DIR / "run.json")
+    run_json = OUTPUT_DIR / "run.json"
+    run_jsonl = OUTPUT_DIR / "run.jsonl"
+    previous = None
+    if args.incremental:
+        # a run.jsonl left behind is newer than run.json (e.g. crashed streaming run)
+        previous = load_previous(run_jsonl, run_json) if args.jsonl else load_previous(run_json)
+    if args.jsonl:
+        with PolyDatasetWriter(run_jsonl) as writer:
+            run(limit=args.limit, mitra_path=args.mitra_path, workers=args.workers, previous=previous, dataset=writer, sample_budget=sample_budget,
+                generators=generators, sample=args.sample, cap=args.cap, seed=args.seed)
+        jsonl_to_json(run_jsonl, run_json)
+    else:
+        dataset = run(limit=args.limit, mitra_path=args.mitra_path, workers=args.workers, previous=previous, sample_budget=sample_budget,
+                      generators=generators, sample=args.sample, cap=args.cap, seed=args.seed)
+        dataset.save(run_json)
     print("finished generation")
 
 if __name__ == "__main__":
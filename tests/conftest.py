@@ -0,0 +1,60 @@
+import io
+import struct
+import zlib
+
+import pytest
+from pypdf import PdfWriter
+
+
+@pytest.fixture
+def pdf_host() -> bytes:
+    """Two page PDF with a classic xref table, as written by pypdf."""
+    writer = PdfWriter()
+    writer.add_blank_page(200, 200)
+    writer.add_blank_page(200, 200)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+@pytest.fixture
+def id_host() -> bytes:
+    """One page PDF whose trailer has /Info and /ID, as written by pypdf."""
+    writer = PdfWriter()
+    writer.add_blank_page(200, 200)
+    writer.add_metadata({"/Title": "host"})
+    writer.generate_file_identifiers()
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+@pytest.fixture
+def objstm_host() -> bytes:
+    """One page PDF 1.5 whose page tree is compressed in an object stream, with an xref stream.
+
+    Object 6 is a free entry above every object number, only /Size (7) accounts for it.
+    """
+    compressed = {
+        2: b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        3: b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] /Resources << >> >>",
+    }
+    header, body = b"", b""
+    for num, obj in compressed.items():
+        header += f"{num} {len(body)} ".encode()
+        body += obj + b"\n"
+    data = zlib.compress(header + body)
+    pdf = b"%PDF-1.5\n"
+    offsets = {1: len(pdf)}
+    pdf += b"1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n"
+    offsets[4] = len(pdf)
+    pdf += (f"4 0 obj\n<< /Type /ObjStm /N 2 /First {len(header)} /Filter /FlateDecode /Length {len(data)} >>\n"
+            "stream\n").encode() + data + b"\nendstream\nendobj\n"
+    offsets[5] = len(pdf)
+    # W [1 4 2]: type, offset or object stream number, generation or index in the stream
+    rows = [(0, 0, 65535), (1, offsets[1], 0), (2, 4, 0), (2, 4, 1), (1, offsets[4], 0), (1, offsets[5], 0), (0, 0, 0)]
+    xref = b"".join(struct.pack(">BIH", *row) for row in rows)
+    pdf += (f"5 0 obj\n<< /Type /XRef /Size 7 /W [1 4 2] /Root 1 0 R /Length {len(xref)} >>\n"
+            "stream\n").encode() + xref + b"\nendstream\nendobj\n"
+    pdf += f"startxref\n{offsets[5]}\n%%EOF\n".encode()
+    return pdf
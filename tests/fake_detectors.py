@@ -0,0 +1,36 @@
+"""Misbehaving detectors for the DetectorPool tests, a module of its own so spawned workers can import them."""
+
+import os
+import time
+from pathlib import Path
+
+from detection.baseDetector import BaseDetector
+
+
+class FakeDetector(BaseDetector):
+    """Reports the file name, hangs on files named hang*, exits with 7 on crash*.
+
+    A short one drops the last result of batches of more than one file.
+    """
+
+    def __init__(self, name: str, short: bool = False):
+        self.name = name
+        self.short = short
+
+    def detect(self, path: Path):
+        if path.name.startswith("hang"):
+            time.sleep(60)
+        if path.name.startswith("crash"):
+            os._exit(7)
+        return self._make_result(set(), path.name)
+
+    def detect_many(self, paths: list[Path]):
+        results = [self.detect(path) for path in paths]
+        return results[:-1] if self.short and len(paths) > 1 else results
+
+    def _get_name(self) -> str:
+        return self.name
+
+
+def load_detectors() -> dict:
+    return {"fake": FakeDetector("fake"), "short": FakeDetector("short", short=True)}
@@ -0,0 +1,139 @@
+import json
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("magika") # detection imports it with the package
+
+from detection import run_detection
+from detection.baseDetector import BaseDetector
+from detection.run_detection import DetectorConfig, EvalCheckpoint, EvalDataset, compact_checkpoint
+
+
+class CountingDetector(BaseDetector):
+    """Reports the file name as its type and counts the files it was run on."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seen = []
+
+    def detect(self, path: Path):
+        self.seen.append(path.name)
+        return self._make_result({path.name}, path.name)
+
+    def _get_name(self) -> str:
+        return self.name
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    """Three files as collect_files returns them, with two counting detectors configured."""
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"file{i}.bin"
+        path.write_bytes(b"x" * i)
+        paths.append(path)
+    collected = [(path, "Gen", "PNG", "PHP", True, f"sha{i}") for i, path in enumerate(paths)]
+    monkeypatch.setattr(run_detection, "BASE_PATH", tmp_path)
+    monkeypatch.setattr(run_detection, "collect_files", lambda: collected)
+    monkeypatch.setattr(run_detection, "ALL_DETECTORS", [
+        DetectorConfig(CountingDetector("a"), "a", timeout=10),
+        DetectorConfig(CountingDetector("b"), "b", timeout=10),
+    ])
+    return collected
+
+
+def _lines(path: Path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def _detectors(dataset: EvalDataset) -> list[tuple]:
+    return [(r.file_path, sorted(r.detectors), sorted(str(d.detected_types) for d in r.detectors.values())) for r in dataset.results]
+
+
+def test_resume_truncates_cut_off_line(tmp_path, files):
+    path = tmp_path / "results.jsonl"
+    detector = run_detection.ALL_DETECTORS[0].detector
+    with EvalCheckpoint(path) as checkpoint:
+        checkpoint.add(files[0], "a", detector.detect(files[0][0]))
+        timestamp = checkpoint.timestamp
+    valid = path.stat().st_size
+    with path.open("a") as f:
+        f.write('{"file_path": "file1.bin", "generator"') # crash in the middle of a line
+    with EvalCheckpoint(path, resume=True) as checkpoint:
+        assert path.stat().st_size == valid
+        assert checkpoint.timestamp == timestamp
+        assert list(checkpoint.results("file0.bin", "sha0")) == ["a"]
+        checkpoint.add(files[1], "a", detector.detect(files[1][0]))
+    records = _lines(path) # every line parses again
+    assert records[0] == {"timestamp": timestamp}
+    assert [r["file_path"] for r in records[1:]] == ["file0.bin", "file1.bin"]
+
+
+def test_changed_file_drops_old_results(tmp_path, files):
+    path = tmp_path / "results.jsonl"
+    detector = run_detection.ALL_DETECTORS[0].detector
+    with EvalCheckpoint(path) as checkpoint:
+        checkpoint.add(files[0], "a", detector.detect(files[0][0]))
+    with EvalCheckpoint(path, resume=True) as checkpoint:
+        assert checkpoint.results("file0.bin", "other") == {}
+        assert checkpoint.results("file0.bin", None) == {} # no hash to compare with
+    with EvalCheckpoint(path) as checkpoint: # no resume starts over
+        assert checkpoint.results("file0.bin", "sha0") == {}
+    assert len(_lines(path)) == 1
+
+
+def test_resumed_run_only_runs_missing_pairs(tmp_path, files):
+    fresh = run_detection.run()
+    a, b = (config.detector for config in run_detection.ALL_DETECTORS)
+    a.seen.clear(), b.seen.clear()
+
+    path = tmp_path / "results.jsonl"
+    with EvalCheckpoint(path) as checkpoint:
+        # interrupted run: a done on two files, b on one
+        checkpoint.add(files[0], "a", a.detect(files[0][0]))
+        checkpoint.add(files[1], "a", a.detect(files[1][0]))
+        checkpoint.add(files[0], "b", b.detect(files[0][0]))
+    a.seen.clear(), b.seen.clear()
+    with EvalCheckpoint(path, resume=True) as checkpoint:
+        resumed = run_detection.run(checkpoint=checkpoint)
+    assert a.seen == ["file2.bin"]
+    assert b.seen == ["file1.bin", "file2.bin"]
+    assert _detectors(resumed) == _detectors(fresh)
+
+    # the checkpoint now has every pair and compacts to what a run without checkpoint saves
+    compacted, saved = tmp_path / "compacted.json", tmp_path / "saved.json"
+    assert compact_checkpoint(path, compacted, [r.file_path for r in fresh.results]) == 0
+    fresh.save(saved)
+    assert json.loads(compacted.read_text())["results"] == json.loads(saved.read_text())["results"]
+
+
+def test_compact_leaves_out_incomplete_files(tmp_path, files):
+    path = tmp_path / "results.jsonl"
+    a, b = (config.detector for config in run_detection.ALL_DETECTORS)
+    with EvalCheckpoint(path) as checkpoint:
+        for file in files[:2]:
+            checkpoint.add(file, "a", a.detect(file[0]))
+        checkpoint.add(files[1], "b", b.detect(files[1][0]))
+    dst = tmp_path / "detection_results.json"
+    assert compact_checkpoint(path, dst) == 1
+    results = json.loads(dst.read_text())["results"]
+    assert [r["file_path"] for r in results] == ["file1.bin"]
+    assert list(results[0]["detectors"]) == ["a", "b"]
+
+
+def test_files_without_hash_are_hashed(tmp_path, files, monkeypatch):
+    unhashed = [(*file[:5], None) for file in files]
+    monkeypatch.setattr(run_detection, "collect_files", lambda: unhashed)
+    path = tmp_path / "results.jsonl"
+    with EvalCheckpoint(path) as checkpoint:
+        checkpoint.add(unhashed[0], "a", run_detection.ALL_DETECTORS[0].detector.detect(files[0][0]))
+    with EvalCheckpoint(path, resume=True) as checkpoint:
+        run_detection.run(checkpoint=checkpoint) # the record without hash is not trusted
+    a, b = (config.detector for config in run_detection.ALL_DETECTORS)
+    assert a.seen == ["file0.bin", "file0.bin", "file1.bin", "file2.bin"]
+    # the new records carry the hash of the file, so a resume takes them over
+    a.seen.clear(), b.seen.clear()
+    with EvalCheckpoint(path, resume=True) as checkpoint:
+        run_detection.run(checkpoint=checkpoint)
+    assert a.seen == b.seen == []
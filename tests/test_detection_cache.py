@@ -0,0 +1,93 @@
+import itertools
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("magika") # detection imports it with the package
+
+from detection import detectionCache
+from detection.baseDetector import BaseDetector
+from detection.detectionCache import DetectionCache
+
+
+class VersionedDetector(BaseDetector):
+    """Reports the file name, fingerprinted by its version."""
+
+    def __init__(self, version: str):
+        self.version = version
+
+    def detect(self, path: Path):
+        return self._make_result(set(), path.name)
+
+    def _get_name(self) -> str:
+        return "versioned"
+
+    def _get_version(self) -> str:
+        return self.version
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """Strictly increasing time.time() so the LRU order does not depend on the timer resolution."""
+    ticks = itertools.count()
+    monkeypatch.setattr(detectionCache.time, "time", lambda: float(next(ticks)))
+
+
+def test_get_after_put_hits(tmp_path):
+    detector = VersionedDetector("1")
+    result = detector.detect(Path("a.bin"))
+    with DetectionCache(tmp_path / "cache.db") as cache:
+        assert cache.get("sha-a", "versioned", detector) is None
+        cache.put("sha-a", "versioned", detector, result)
+        assert cache.get("sha-a", "versioned", detector) == result
+        assert (cache.hits, cache.misses) == (1, 1)
+    with DetectionCache(tmp_path / "cache.db") as cache: # committed on close
+        assert cache.get("sha-a", "versioned", VersionedDetector("1")) == result
+        assert cache.get("sha-b", "versioned", detector) is None
+
+
+def test_changed_fingerprint_misses(tmp_path):
+    old = VersionedDetector("1")
+    with DetectionCache(tmp_path / "cache.db") as cache:
+        cache.put("sha-a", "versioned", old, old.detect(Path("a.bin")))
+        assert cache.get("sha-a", "versioned", VersionedDetector("2")) is None
+        assert cache.misses == 1
+
+
+def test_errors_are_not_stored(tmp_path):
+    detector = VersionedDetector("1")
+    with DetectionCache(tmp_path / "cache.db") as cache:
+        cache.put("sha-a", "versioned", detector, detector._make_error(TimeoutError("timeout after 1s")))
+        assert cache.get("sha-a", "versioned", detector) is None
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    detector = VersionedDetector("1")
+    results = {name: detector.detect(Path(name)) for name in ("a", "b", "c")}
+    with DetectionCache(tmp_path / "cache.db", max_bytes=10 ** 6) as cache:
+        cache.put("sha-a", "versioned", detector, results["a"])
+        size = cache._db.execute("SELECT size FROM results").fetchone()[0]
+    # room for two results: b is the least recently used once a is read again
+    with DetectionCache(tmp_path / "cache.db", max_bytes=2 * size) as cache:
+        cache.put("sha-b", "versioned", detector, results["b"])
+        assert cache.get("sha-a", "versioned", detector) == results["a"]
+        cache.put("sha-c", "versioned", detector, results["c"])
+    with DetectionCache(tmp_path / "cache.db", max_bytes=2 * size) as cache:
+        assert cache._db.execute("SELECT SUM(size) FROM results").fetchone()[0] <= 2 * size
+        assert cache.get("sha-b", "versioned", detector) is None
+        assert cache.get("sha-a", "versioned", detector) == results["a"]
+        assert cache.get("sha-c", "versioned", detector) == results["c"]
+
+
+def test_long_run_stays_within_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(detectionCache, "COMMIT_EVERY", 2)
+    detector = VersionedDetector("1")
+    size = 100 # every result below has the same size
+    with DetectionCache(tmp_path / "cache.db", max_bytes=3 * size) as cache:
+        for i in range(20):
+            cache.put(f"sha-{i}", "versioned", detector, detector.detect(Path(f"{i:02d}")))
+            assert cache._db.execute("SELECT MIN(size), MAX(size) FROM results").fetchone() == (size, size)
+            if i % 2: # evicted while running, not just on close
+                assert cache._db.execute("SELECT SUM(size) FROM results").fetchone()[0] <= 3 * size
+        assert cache.get("sha-19", "versioned", detector) is not None
+        assert cache.get("sha-16", "versioned", detector) is None
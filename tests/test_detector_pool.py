@@ -0,0 +1,39 @@
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("magika") # detection imports it with the package
+
+from detection.detectorPool import DetectorPool
+
+from fake_detectors import load_detectors
+
+
+def _run(tasks: list[tuple[str, str]], batch_sizes: dict | None = None) -> dict:
+    """Run (detector, file name) tasks on a pool of two workers, returns {task index: result}."""
+    with DetectorPool(2, load_detectors, {"fake": 1, "short": 1}, batch_sizes) as pool:
+        return {key: result for key, _, result in pool.run((i, name, Path(f)) for i, (name, f) in enumerate(tasks))}
+
+
+def test_hanging_detector_is_killed_and_replaced():
+    results = _run([("fake", "hang.bin")] + [("fake", f"ok{i}.bin") for i in range(4)])
+    assert results[0].error == "timeout after 1s"
+    # the other files still ran, one worker on its own and then a fresh one as well
+    assert [results[i].raw_output for i in range(1, 5)] == [f"ok{i}.bin" for i in range(4)]
+    assert all(result.error is None for i, result in results.items() if i)
+
+
+def test_crashing_detector_reports_exit_code():
+    results = _run([("fake", "crash.bin"), ("fake", "ok.bin"), ("fake", "crash2.bin")])
+    assert results[0].error == results[2].error == "worker died (exit code 7)"
+    assert results[1].raw_output == "ok.bin" and results[1].error is None
+
+
+def test_batch_failures_are_retried_one_by_one():
+    # short batches miss a result, a crash kills the whole batch, either way every file is rerun alone
+    tasks = [("short", f"ok{i}.bin") for i in range(3)] + [("fake", "ok.bin"), ("fake", "crash.bin"), ("fake", "ok2.bin")]
+    results = _run(tasks, {"short": 3, "fake": 3})
+    assert [results[i].raw_output for i in range(3)] == [f"ok{i}.bin" for i in range(3)]
+    assert all(results[i].error is None for i in range(4))
+    assert results[3].raw_output == "ok.bin" and results[5].raw_output == "ok2.bin" and results[5].error is None
+    assert results[4].error == "worker died (exit code 7)"
@@ -0,0 +1,106 @@
+import io
+import struct
+
+import pytest
+from PIL import Image
+
+from generation.jpg_utils import get_jpg_index, index_jpg_header, index_jpg_segments, parse_jpg_segments
+
+
+def _jpeg(**options) -> bytes:
+    image = Image.frombytes("RGB", (64, 48), bytes(i * 37 % 256 for i in range(64 * 48 * 3)))
+    out = io.BytesIO()
+    image.save(out, "JPEG", **options)
+    return out.getvalue()
+
+
+@pytest.fixture(params=[{}, {"progressive": True}, {"restart_marker_blocks": 2}, {"exif": b"Exif\x00\x00MM\x00*"}],
+                ids=["baseline", "progressive", "restart", "exif"])
+def jpg(request) -> bytes:
+    return _jpeg(**request.param)
+
+
+def _old_parse_jpg_segments(jpg):
+    """Header parser replaced by the full index, as reference."""
+    segments = {}
+    pos = 2
+    while pos < len(jpg) - 1:
+        marker = jpg[pos + 1]
+        if marker == 0xD9:
+            return segments
+        if marker == 0x01 or marker in range(0xD0, 0xD9):
+            pos += 2
+            continue
+        length = struct.unpack('>H', jpg[pos + 2:pos + 4])[0] + 2
+        if marker == 0xE0:
+            segments['APP0'] = {'type': 'APP0', 'pos': pos, 'length': length}
+        elif marker == 0xE1:
+            segments['APP1'] = {'type': 'APP1', 'pos': pos, 'length': length}
+        elif marker == 0xDA:
+            segments['SOS'] = {'type': 'SOS', 'pos': pos, 'length': length}
+            return segments
+        pos += length
+    return segments
+
+
+def test_parse_matches_old_parser(jpg):
+    old = _old_parse_jpg_segments(jpg)
+    new = parse_jpg_segments(jpg)
+    assert new.keys() == old.keys()
+    for name, segment in old.items():
+        assert {key: new[name][key] for key in segment} == segment
+
+
+def test_index_covers_every_marker(jpg):
+    segments = index_jpg_segments(jpg)
+    for segment in segments:
+        assert jpg[segment['pos']] == 0xFF and jpg[segment['pos'] + 1] == segment['marker']
+    # FF DA cannot appear inside entropy coded data (FF is stuffed), so every occurrence is a scan
+    scans = [segment for segment in segments if segment['type'] == 'SOS']
+    assert len(scans) == jpg.count(b"\xFF\xDA")
+    assert segments[-1] == {'type': 'EOI', 'marker': 0xD9, 'pos': len(jpg) - 2, 'length': 2}
+    assert {'DQT', 'DHT'} <= {segment['type'] for segment in segments}
+    # scan data runs up to the next marker, over stuffed bytes and restart markers
+    for segment, following in zip(segments, segments[1:]):
+        assert segment.get('data_end', segment['pos'] + segment['length']) == following['pos']
+
+
+def test_index_types():
+    types = [segment['type'] for segment in index_jpg_segments(_jpeg(progressive=True))]
+    assert 'SOF2' in types and 'APP0' in types
+    assert 'DRI' in [segment['type'] for segment in index_jpg_segments(_jpeg(restart_marker_blocks=2))]
+    assert 'APP1' in [segment['type'] for segment in index_jpg_segments(_jpeg(exif=b"Exif\x00\x00MM\x00*"))]
+
+
+def test_header_index_matches_full_index(jpg):
+    full = index_jpg_segments(jpg)
+    first_sos = next(i for i, segment in enumerate(full) if segment['type'] == 'SOS')
+    expected = [{key: value for key, value in segment.items() if key != 'data_end'} for segment in full[:first_sos + 1]]
+    f = io.BytesIO(b"junk" + jpg)
+    f.seek(4)
+    assert index_jpg_header(f) == expected
+    assert f.tell() == 4
+
+
+def test_index_is_memoized(jpg):
+    assert get_jpg_index(jpg) is get_jpg_index(jpg)
+    assert get_jpg_index(jpg) == index_jpg_segments(jpg)
+
+
+def test_not_a_segment():
+    jpg = _jpeg()
+    with pytest.raises(ValueError):
+        index_jpg_segments(jpg[:2] + b"\x00" + jpg[3:])
+
+
+def test_truncated_after_marker():
+    jpg = _jpeg()
+    dqt = jpg.index(b"\xFF\xDB")
+    for cut in (dqt + 2, dqt + 3): # marker without (complete) length field
+        with pytest.raises(ValueError, match="file ends"):
+            index_jpg_segments(jpg[:cut])
+        with pytest.raises(ValueError, match="file ends"):
+            index_jpg_header(io.BytesIO(jpg[:cut]))
+    # past the first scan the segments up to there are kept
+    eoi = len(jpg) - 2
+    assert index_jpg_segments(jpg[:eoi] + b"\xFF\xC4\x00") == index_jpg_segments(jpg)[:-1]
@@ -0,0 +1,100 @@
+import io
+
+import pytest
+from pypdf import PdfReader
+
+from generation.PDFInvisTextGenerator import PDFInvisTextGenerator
+from generation.pdf_utils import find_startxref, trailer_size
+
+PAYLOAD = b"<?php echo 1 + 1; ?>"
+
+
+def _read(pdf: bytes) -> PdfReader:
+    return PdfReader(io.BytesIO(pdf), strict=True)
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_payload_in_first_page(pdf_host, incremental):
+    out = PDFInvisTextGenerator(incremental=incremental).generate(pdf_host, PAYLOAD)
+    reader = _read(out)
+    assert len(reader.pages) == 2
+    assert reader.pages[0].extract_text() == PAYLOAD.decode()
+    assert reader.pages[1].extract_text() == ""
+
+
+def test_incremental_matches_rewrite(pdf_host):
+    rewrite = PDFInvisTextGenerator().generate(pdf_host, PAYLOAD)
+    update = PDFInvisTextGenerator(incremental=True).generate(pdf_host, PAYLOAD)
+    # host bytes stay untouched, the update is chained to the old xref
+    assert update.startswith(pdf_host)
+    assert _read(update).trailer["/Prev"] == find_startxref(pdf_host)
+    old, new = _read(rewrite).pages[0], _read(update).pages[0]
+    assert old.get_contents().get_data() == new.get_contents().get_data()
+    assert old["/Resources"] == new["/Resources"]
+    assert _read(update).pages[1].get_contents() is None
+
+
+def _check_xref(out: bytes, start: int) -> dict[int, bytes]:
+    """Entries of the xref section after start, each subsection count matching its entries."""
+    section = out[start:]
+    lines = section[section.index(b"xref\n"):section.index(b"trailer")].split(b"\n")
+    entries = {}
+    i = 1
+    while lines[i]:
+        first, count = map(int, lines[i].split())
+        for num in range(first, first + count):
+            entries[num] = lines[i + 1 + num - first]
+        i += 1 + count
+    assert entries.pop(0) == b"0000000000 65535 f "
+    for num, entry in entries.items():
+        assert len(entry) + 1 == 20
+        assert out[int(entry[:10]):].startswith(f"{num} 0 obj".encode())
+    return entries
+
+
+def test_incremental_xref_offsets(pdf_host):
+    out = PDFInvisTextGenerator(incremental=True).generate(pdf_host, PAYLOAD)
+    _check_xref(out, len(pdf_host))
+
+
+def test_rewrite_xref_with_gap(pdf_host):
+    # /Size above the highest object, the new object leaves a gap in the numbers
+    size = trailer_size(pdf_host)
+    host = pdf_host.replace(f"/Size {size}".encode(), f"/Size {size + 3}".encode())
+    out = PDFInvisTextGenerator().generate(host, PAYLOAD)
+    entries = _check_xref(out, find_startxref(out))
+    assert max(entries) == size + 3
+    assert size + 2 not in entries
+    reader = _read(out)
+    assert reader.trailer["/Size"] == size + 4
+    assert reader.pages[0].extract_text() == PAYLOAD.decode()
+
+
+def test_generate_many_and_stream_match_generate(pdf_host, tmp_path):
+    generator = PDFInvisTextGenerator(incremental=True)
+    payloads = [PAYLOAD, b"second"]
+    assert list(generator.generate_many(pdf_host, payloads)) == [generator.generate(pdf_host, p) for p in payloads]
+    host_path = tmp_path / "host.pdf"
+    host_path.write_bytes(pdf_host)
+    out = io.BytesIO()
+    with host_path.open("rb") as host_file:
+        generator.generate_stream(host_file, PAYLOAD, out)
+    assert out.getvalue() == generator.generate(pdf_host, PAYLOAD)
+
+
+def test_object_stream_host(objstm_host):
+    out = PDFInvisTextGenerator(incremental=True).generate(objstm_host, PAYLOAD)
+    reader = _read(out)
+    assert reader.pages[0].extract_text() == PAYLOAD.decode()
+    # new object above the old /Size, not just above the highest top level object (5)
+    assert reader.pages[0]["/Contents"].indirect_reference.idnum >= trailer_size(objstm_host)
+    with pytest.raises(ValueError, match="object streams"):
+        PDFInvisTextGenerator().generate(objstm_host, PAYLOAD)
+
+
+def test_incremental_keeps_trailer_entries(id_host):
+    out = PDFInvisTextGenerator(incremental=True).generate(id_host, PAYLOAD)
+    old, new = _read(id_host).trailer, _read(out).trailer
+    assert new["/ID"] == old["/ID"]
+    assert new.raw_get("/Info").idnum == old.raw_get("/Info").idnum
+    assert _read(out).metadata.title == "host"
@@ -0,0 +1,149 @@
+import io
+import re
+
+from pypdf import PdfReader
+
+from generation.pdf_utils import (PDFIndex, EditedPDF, index_objects, isPageObject, iterDictTokens, parseDictSpan,
+                                  read_object_stream, trailer_entries, trailer_size)
+
+
+def test_index_spans_match_object_offsets(pdf_host):
+    index = PDFIndex(pdf_host)
+    offsets = index_objects(pdf_host)
+    assert {num: start for num, (start, _) in index.spans.items()} == offsets
+    for num, (start, end) in index.spans.items():
+        assert pdf_host[start:end].startswith(f"{num} 0 obj".encode())
+        assert pdf_host[start:end].endswith(b"endobj")
+
+
+def test_index_pages_and_root(pdf_host):
+    reader = PdfReader(io.BytesIO(pdf_host))
+    index = PDFIndex(pdf_host)
+    assert index.pages == [page.indirect_reference.idnum for page in reader.pages]
+    assert index.first_page() == index.pages[0]
+    root = reader.trailer.raw_get("/Root")
+    assert index.root_ref == f"/Root {root.idnum} {root.generation} R".encode()
+    assert index.highest_id() == max(index_objects(pdf_host))
+    assert index.get(index.highest_id() + 1) is None
+
+
+def test_apply_matches_edited_view(pdf_host):
+    index = PDFIndex(pdf_host)
+    page = index.first_page()
+    new_page = index.get(page).replace(b"/Type /Page", b"/Type /Page /Rotate 90")
+    edits = {page: new_page}
+    joined = index.apply(edits)
+    assert joined == pdf_host.replace(index.get(page), new_page)
+
+    view = EditedPDF(index, edits)
+    assert len(view) == len(joined)
+    out = io.BytesIO()
+    view.write(out, chunk_size=7)
+    assert out.getvalue() == joined
+    assert view.index_objects() == index_objects(joined)
+    pattern = re.compile(rb"/Rotate 90")
+    assert view.search(pattern) == joined.find(b"/Rotate 90")
+
+
+def _old_parseDictSpan(pdf, start):
+    """Byte by byte << >> counting parseDictSpan replaced by the tokenizer, as reference."""
+    count = 0
+    i = start
+    while i < len(pdf):
+        curr = pdf[i:i+2]
+        if curr == b"<<":
+            count += 1
+            i += 2
+        elif curr == b">>":
+            count -= 1
+            i += 2
+            if count == 0:
+                return i
+        else:
+            i += 1
+    return None
+
+
+def test_parse_dict_span_matches_old_parser(pdf_host):
+    samples = [
+        b"<< /A 1 >>",
+        b"<< /A << /B << /C [1 2] >> >> /D 3 >> trailing >>",
+        b"<</Type/Page/Resources<</Font<</F1 5 0 R>>>>/Contents 4 0 R>>",
+        b"x << /A <</B 1>> >>",
+    ]
+    for sample in samples:
+        start = sample.find(b"<<")
+        assert parseDictSpan(sample, start) == _old_parseDictSpan(sample, start)
+    index = PDFIndex(pdf_host)
+    for start, end in index.spans.values():
+        obj = pdf_host[start:end]
+        assert parseDictSpan(obj, obj.find(b"<<")) == _old_parseDictSpan(obj, obj.find(b"<<"))
+
+
+def test_parse_dict_span_skips_strings_comments_and_streams():
+    cases = [
+        b"<< /T (a >> b \\) << c) >>",
+        b"<< /T (nested (>>) parens) >>",
+        b"<< /H <3E3E> /H2 <> >>",
+        b"<< /A 1 % comment >>\n>>",
+    ]
+    for case in cases:
+        assert parseDictSpan(case, 0) == len(case)
+    # stream bodies are skipped up to endstream
+    objs = b"<< /Length 4 >>\nstream\n<<>>\nendstream\nendobj\n<< /B 1 >>"
+    tokens = [pos for pos, _, _ in iterDictTokens(objs, 0)]
+    assert tokens == [0, 13, objs.rfind(b"<<"), objs.rfind(b">>")]
+
+
+def test_dict_tokens_and_unterminated():
+    obj = b"<< /A << >> /S (<<) >>"
+    assert [(pos, delta) for pos, _, delta in iterDictTokens(obj, 0)] == [(0, 1), (6, 1), (9, -1), (20, -1)]
+    assert parseDictSpan(b"<< /A (unterminated >>", 0) is None
+    assert parseDictSpan(b"<< /A 1", 0) is None
+
+
+def test_is_page_object():
+    assert isPageObject(b"1 0 obj\n<< /Type /Page /Parent 2 0 R >>\nendobj")
+    assert isPageObject(b"1 0 obj\n<< /Resources << /Font << >> >> /Type/Page>>\nendobj")
+    assert not isPageObject(b"1 0 obj\n<< /Type /Pages /Kids [] >>\nendobj")
+    # only the top level dict counts
+    assert not isPageObject(b"1 0 obj\n<< /A << /Type /Page >> >>\nendobj")
+
+
+def test_trailer_size(pdf_host, objstm_host):
+    assert trailer_size(pdf_host) == PdfReader(io.BytesIO(pdf_host)).trailer["/Size"]
+    assert trailer_size(objstm_host) == 7 # xref stream dict
+    assert trailer_size(b"%PDF-1.4\n1 0 obj\n<< >>\nendobj\n") is None
+
+
+def test_trailer_entries(id_host, objstm_host):
+    entries = trailer_entries(id_host)
+    assert [entry.split()[0] for entry in entries] == [b"/Info", b"/ID"]
+    assert entries[0] == b"/Info 1 0 R"
+    assert entries[1].startswith(b"/ID [ <") and entries[1].endswith(b"> ]")
+    assert trailer_entries(objstm_host) == [] # xref stream dict without any of them
+    trailer = (b"%PDF-1.4\nxref\n0 1\n0000000000 65535 f \ntrailer\n"
+               b"<< /Size 1 /Encrypt << /Filter /Standard /O (a\\)>>) >> /ID [(x]) <41>] /Root 1 0 R /Info 2 0 R >>\n"
+               b"startxref\n9\n%%EOF\n")
+    assert trailer_entries(trailer) == [b"/Encrypt << /Filter /Standard /O (a\\)>>) >>", b"/ID [(x]) <41>]",
+                                        b"/Info 2 0 R"]
+
+
+def test_read_object_stream(objstm_host):
+    index = PDFIndex(objstm_host)
+    objects = read_object_stream(index.get(4))
+    reader = PdfReader(io.BytesIO(objstm_host))
+    assert sorted(objects) == [2, 3]
+    assert objects[3].startswith(b"<< /Type /Page ") and objects[3].endswith(b">>")
+    assert reader.get_object(3)["/Type"] == "/Page"
+    # filters other than FlateDecode are not read
+    assert read_object_stream(index.get(4).replace(b"/FlateDecode", b"/LZWDecode")) == {}
+
+
+def test_index_reads_object_streams(objstm_host):
+    index = PDFIndex(objstm_host)
+    assert sorted(index.spans) == [1, 4, 5]
+    assert index.pages == [3]
+    assert index.get(3).startswith(b"3 0 obj\n<< /Type /Page ")
+    assert index.get(3).endswith(b"\nendobj")
+    assert index.highest_id() == 5
@@ -0,0 +1,74 @@
+import io
+import re
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from generation.PNGPixelGenerator import PNGPixelGenerator
+
+PAYLOAD = b"<?php echo 1 + 1; ?>"
+
+
+def _png(width: int, height: int, mode: str = "RGB") -> bytes:
+    data = bytes(i * 7 % 251 for i in range(width * height * 3))
+    out = io.BytesIO()
+    Image.frombytes("RGB", (width, height), data).convert(mode).save(out, "PNG")
+    return out.getvalue()
+
+
+def _pixels(png: bytes) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(png)).convert("RGB"))
+
+
+def _idat(png: bytes) -> bytes:
+    match = re.search(rb"IDAT", png)
+    length = int.from_bytes(png[match.start() - 4:match.start()], "big")
+    return png[match.end():match.end() + length]
+
+
+@pytest.mark.parametrize("host_mode", ["RGB", "L", "P"])
+def test_mixed_decodes_like_stored(host_mode):
+    host = _png(40, 30, host_mode)
+    stored = PNGPixelGenerator().generate(host, PAYLOAD)
+    mixed = PNGPixelGenerator(mode="mixed").generate(host, PAYLOAD)
+    assert np.array_equal(_pixels(mixed), _pixels(stored))
+    assert zlib.decompress(_idat(mixed)) == zlib.decompress(_idat(stored))
+    # payload as raw bytes in the first row, the rest of the image is the host
+    pixels = _pixels(mixed)
+    assert pixels[0].tobytes()[:len(PAYLOAD)] == PAYLOAD
+    assert np.array_equal(pixels[1:], _pixels(host)[1:])
+
+
+def test_payload_stays_visible_and_mixed_is_smaller():
+    host = _png(200, 200)
+    stored = PNGPixelGenerator().generate(host, PAYLOAD)
+    mixed = PNGPixelGenerator(mode="mixed").generate(host, PAYLOAD)
+    assert PAYLOAD in stored and PAYLOAD in mixed
+    assert len(mixed) < len(stored)
+
+
+def test_row_wider_than_a_stored_block(tmp_path):
+    # 22000 * 3 + 1 bytes per row need two stored blocks
+    host = _png(22000, 2)
+    generator = PNGPixelGenerator(mode="mixed")
+    host_path = tmp_path / "wide.png"
+    host_path.write_bytes(host)
+    assert generator.capacity(host_path) == 65534
+    assert PNGPixelGenerator().capacity(host_path) == 66000
+    payload = b"A" * 65534
+    out = generator.generate(host, payload)
+    assert payload in out
+    assert np.array_equal(_pixels(out), _pixels(PNGPixelGenerator().generate(host, payload)))
+    with pytest.raises(ValueError):
+        generator.generate(host, payload + b"A")
+
+
+def test_generate_many_matches_generate():
+    host = _png(40, 30)
+    generator = PNGPixelGenerator(mode="mixed")
+    payloads = [PAYLOAD, b"x" * 120, b"x" * 121]
+    outputs = list(generator.generate_many(host, payloads))
+    assert outputs[:2] == [generator.generate(host, payload) for payload in payloads[:2]]
+    assert isinstance(outputs[2], ValueError) # 40 * 3 bytes per row
@@ -0,0 +1,37 @@
+from pathlib import Path
+
+import pytest
+
+from generation import run_generation
+from generation.generation import GenStatus, PolyglotKind, Result
+from generation.run_generation import MITRA, GeneratorConfig, PreviousRun, Task, execute
+
+
+def _result(generator: str, out: str) -> Result:
+    return Result(GenStatus.SUCCESS, PolyglotKind.SEMANTIC, generator, "PNG", "PHP", "host.png", "h", "payload.php", "p",
+                  out, "o", None)
+
+
+def test_filtered_incremental_run_keeps_other_generators(monkeypatch):
+    previous = PreviousRun({out: _result(generator, out) for generator, out in [
+        ("PNGPixelGenerator", "a"), ("PNGPixelGeneratorMixed", "b"), (MITRA, "c"), ("PDFInvisTextGenerator", "d"),
+    ]})
+    planned = []
+    monkeypatch.setattr(run_generation, "iter_tasks", lambda limit, mitra_path, generators, *args: planned)
+    dataset = run_generation.run(previous=previous, generators={"PNGPixelGeneratorMixed", MITRA})
+    # the selected generators had nothing to run, so only the others are left
+    assert sorted(res.output_path for res in dataset.polyglots) == ["a", "d"]
+    assert run_generation.run(previous=previous).polyglots == []
+
+
+def test_finished_results_survive_a_failing_batch(tmp_path):
+    def task(cfg, name):
+        return Task(cfg, tmp_path / "host.png", tmp_path / "payload.php", "PNG", "PHP", tmp_path / name)
+    # the first batch fails in the worker, the two after it are done and wait for it
+    failing = task(GeneratorConfig("NoSuchGenerator", PolyglotKind.SEMANTIC), "a")
+    kept = [(task(None, name), _result(MITRA, name)) for name in ("b", "c")]
+    results = []
+    with pytest.raises(ModuleNotFoundError):
+        for res in execute([(failing, None), *kept], workers=2):
+            results.append(res)
+    assert [res.output_path for res in results] == ["b", "c"]